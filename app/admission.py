@@ -0,0 +1,227 @@
+"""Admission control для записи и аутентификации: token bucket на клиента и лимит одновременных запросов (ADMISSION_CONTROL)"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+from app import auth, metrics
+from app.config import settings
+
+ROUTE_CLASSES = ("read", "write", "auth")
+AUTH_PATHS = frozenset({"/token", "/register"})
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+def route_class(method: str, path: str) -> str:
+    """Класс маршрута по методу и пути"""
+    if path in AUTH_PATHS:
+        return "auth"
+    return "read" if method in READ_METHODS else "write"
+
+
+class ConcurrencyLimiter:
+    """
+    Не больше limit одновременных запросов, не больше queue_depth ожидающих (limit 0 — без ограничения).
+    Освободившийся слот передаётся первому ожидающему; ожидающие — future своего event loop
+    """
+
+    def __init__(self, name: str, limit: int, queue_depth: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._active_gauge = metrics.ADMISSION_ACTIVE.labels(name)
+        self._queued_gauge = metrics.ADMISSION_QUEUED.labels(name)
+
+    async def acquire(self) -> Optional[str]:
+        """Занимает слот; None — допущен, иначе причина отказа ("queue" или "timeout")"""
+        with self._lock:
+            if not self.limit or (self.active < self.limit and not self._waiters):
+                self.active += 1
+                self.admitted += 1
+                self._active_gauge.set(self.active)
+                return None
+            if len(self._waiters) >= self.queue_depth:
+                self.rejected += 1
+                return "queue"
+            loop = asyncio.get_running_loop()
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+            self._queued_gauge.set(len(self._waiters))
+        try:
+            await asyncio.wait_for(waiter[1], self.timeout)
+            return None
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            with self._lock:
+                granted = waiter not in self._waiters
+                if not granted:
+                    self._waiters.remove(waiter)
+                    self._queued_gauge.set(len(self._waiters))
+                if isinstance(error, asyncio.TimeoutError):
+                    self.timed_out += 1
+            if granted:
+                # Слот передан одновременно с таймаутом или отменой — отдаётся следующему
+                self.release()
+            if isinstance(error, asyncio.CancelledError):
+                raise
+            return "timeout"
+
+    def release(self):
+        """Освобождает слот: передаёт его первому ожидающему или уменьшает счётчик"""
+        with self._lock:
+            if self.limit and self._waiters:
+                loop, future = self._waiters.popleft()
+                self.admitted += 1
+                self._queued_gauge.set(len(self._waiters))
+                loop.call_soon_threadsafe(_grant, future)
+                return
+            self.active -= 1
+            self._active_gauge.set(self.active)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "queue_depth": self.queue_depth,
+                "active": self.active,
+                "queued": len(self._waiters),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+class TokenBuckets:
+    """Token bucket на клиента: rate запросов в секунду, всплеск burst; хранит не больше max_clients ведер"""
+
+    def __init__(self, rate: float, burst: int, max_clients: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def take(self, client: str) -> float:
+        """Забирает токен; 0 — разрешено, иначе через сколько секунд появится токен"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+                self.throttled += 1
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rate": self.rate, "burst": self.burst, "clients": len(self._buckets),
+                    "throttled": self.throttled}
+
+
+class AdmissionController:
+    """Лимиты и ведра по классам маршрутов"""
+
+    def __init__(self, limits: dict[str, ConcurrencyLimiter], buckets: dict[str, TokenBuckets], retry_after: int):
+        self.limits = limits
+        self.buckets = buckets
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        concurrency = {"read": settings.ADMISSION_READ_CONCURRENCY, "write": settings.ADMISSION_WRITE_CONCURRENCY,
+                       "auth": settings.ADMISSION_AUTH_CONCURRENCY}
+        rates = {"read": (settings.ADMISSION_READ_RATE, settings.ADMISSION_READ_BURST),
+                 "write": (settings.ADMISSION_WRITE_RATE, settings.ADMISSION_WRITE_BURST),
+                 "auth": (settings.ADMISSION_AUTH_RATE, settings.ADMISSION_AUTH_BURST)}
+        return cls(
+            limits={name: ConcurrencyLimiter(name, concurrency[name], settings.ADMISSION_QUEUE_DEPTH,
+                                             settings.ADMISSION_QUEUE_TIMEOUT) for name in ROUTE_CLASSES},
+            buckets={name: TokenBuckets(*rates[name], settings.ADMISSION_MAX_CLIENTS) for name in ROUTE_CLASSES},
+            retry_after=settings.ADMISSION_RETRY_AFTER,
+        )
+
+    def stats(self) -> dict:
+        return {"enabled": True, "classes": {
+            name: {**self.limits[name].stats(), "rate_limit": self.buckets[name].stats()} for name in ROUTE_CLASSES}}
+
+
+def client_key(scope, name: str) -> str:
+    """
+    Клиент для token bucket класса name. Для auth — всегда IP: иначе перебор паролей обходил бы
+    лимит, меняя заголовок. Для остальных — id пользователя из JWT с проверенной подписью;
+    заголовок без валидного токена не даёт отдельного ведра и считается по IP
+    """
+    if name != "auth":
+        for header, value in scope["headers"]:
+            if header == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    try:
+                        user_id, _ = auth.decode_token(token)
+                    except HTTPException:
+                        break
+                    return f"user:{user_id}"
+                break
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+def _reject(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class AdmissionMiddleware:
+    """ASGI-middleware: token bucket клиента и лимит одновременных запросов класса маршрута"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = route_class(scope["method"], scope["path"])
+        wait = self.controller.buckets[name].take(client_key(scope, name))
+        if wait:
+            metrics.ADMISSION_REJECTED.labels(name, "rate").inc()
+            await _reject(429, "Слишком много запросов, повторите позже", wait)(scope, receive, send)
+            return
+        limiter = self.controller.limits[name]
+        reason = await limiter.acquire()
+        if reason is not None:
+            metrics.ADMISSION_REJECTED.labels(name, reason).inc()
+            await _reject(503, "Сервер перегружен, повторите позже", self.controller.retry_after)(
+                scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
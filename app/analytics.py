@@ -0,0 +1,223 @@
+"""
+Аналитический снимок каталога для GET /stats/summary: распределение оценок, перцентили
+по жанрам, авторы, гистограмма числа оценок на книгу.
+
+ratings, book_genre и book_author читаются одним проходом в колонки NumPy/pandas,
+метрики считаются векторными group-by. Снимок помнит поколение записей — версии таблиц
+из app/versions.py — и отдаётся из памяти, пока поколение не сменится. После записи
+ответ сразу отдаёт прежний снимок (stale: true), а новый строится в фоновом потоке:
+чтение миллионов оценок из SQLite занимает секунды, и запрос не должен их ждать.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app import database, models, versions
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, записи в которые меняют снимок
+SNAPSHOT_TABLES = ("ratings", "books", "genres", "authors")
+PERCENTILES = (0.25, 0.5, 0.75, 0.9)
+
+_RATING_DTYPE = np.dtype([("user_id", "i8"), ("book_id", "i8"), ("score", "f8")])
+_LINK_DTYPE = np.dtype([("book_id", "i8"), ("other_id", "i8")])
+
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+_summary: Optional[dict] = None
+_rebuilding = False
+
+
+def write_generation() -> list[int]:
+    """Поколение записей: версии таблиц снимка в этом процессе"""
+    return [versions.current(table)[0] for table in SNAPSHOT_TABLES]
+
+
+# --- Загрузка колонок ---
+def load_ratings(db: Session, user_ids=None) -> np.ndarray:
+    """Оценки структурированным массивом (user_id, book_id, score); user_ids — подзапрос id пользователей"""
+    table = models.Rating.__table__
+    statement = select(table.c.user_id, table.c.book_id, table.c.score)
+    if user_ids is not None:
+        statement = statement.where(table.c.user_id.in_(user_ids))
+    return np.fromiter(map(tuple, db.execute(statement)), dtype=_RATING_DTYPE)
+
+
+def _load_links(db: Session, table, column: str) -> pd.DataFrame:
+    result = db.execute(select(table.c.book_id, table.c[column]))
+    links = np.fromiter(map(tuple, result), dtype=_LINK_DTYPE)
+    return pd.DataFrame({"book_id": links["book_id"], column: links["other_id"]})
+
+
+def load_snapshot(db: Session) -> dict:
+    """Колонки ratings, book_genre, book_author и справочные счётчики для compute_summary"""
+    ratings = load_ratings(db)
+    return {
+        "ratings": pd.DataFrame({name: ratings[name] for name in _RATING_DTYPE.names}),
+        "book_genre": _load_links(db, models.book_genre_table, "genre_id"),
+        "book_author": _load_links(db, models.book_author_table, "author_id"),
+        "genres": dict(db.execute(select(models.Genre.id, models.Genre.name)).all()),
+        "books_total": db.scalar(select(func.count()).select_from(models.Book)),
+        "authors_total": db.scalar(select(func.count()).select_from(models.Author)),
+    }
+
+
+# --- Метрики ---
+def _number(value) -> Optional[float]:
+    value = float(value)
+    return None if np.isnan(value) else round(value, 4)
+
+
+def _describe(values: np.ndarray) -> dict:
+    """Среднее, медиана, p90 и максимум (пустой массив — None)"""
+    if not len(values):
+        return {"mean": None, "p50": None, "p90": None, "max": None}
+    p50, p90 = np.percentile(values, [50, 90])
+    return {"mean": _number(values.mean()), "p50": _number(p50), "p90": _number(p90),
+            "max": _number(values.max())}
+
+
+def _count_histogram(counts: np.ndarray) -> list[dict]:
+    """Гистограмма числа оценок на книгу: 0, 1, 2–3, 4–7, … (корзины по степеням двойки)"""
+    buckets = np.zeros(len(counts), dtype=np.int64)
+    rated = counts > 0
+    buckets[rated] = np.floor(np.log2(counts[rated])).astype(np.int64) + 1
+    histogram = []
+    for bucket, books in enumerate(np.bincount(buckets)):
+        if not books:
+            continue
+        low = 0 if bucket == 0 else 2 ** (bucket - 1)
+        high = 0 if bucket == 0 else 2 ** bucket - 1
+        histogram.append({"min": low, "max": high, "books": int(books)})
+    return histogram
+
+
+def compute_summary(ratings: pd.DataFrame, book_genre: pd.DataFrame, book_author: pd.DataFrame,
+                    genres: dict, books_total: int, authors_total: int) -> dict:
+    """Метрики снимка; всё считается векторно по колонкам, без циклов по оценкам"""
+    scores = ratings["score"].to_numpy()
+    per_book = ratings.groupby("book_id").size()
+
+    score_percentiles = np.percentile(scores, [p * 100 for p in PERCENTILES]) if len(scores) else [np.nan] * 4
+    bands, band_counts = np.unique(np.floor(scores).astype(np.int64), return_counts=True)
+    rating_summary = {
+        "count": int(len(scores)),
+        "raters": int(ratings["user_id"].nunique()),
+        "mean": _number(scores.mean()) if len(scores) else None,
+        "std": _number(scores.std()) if len(scores) else None,
+        "percentiles": {f"p{round(p * 100)}": _number(v) for p, v in zip(PERCENTILES, score_percentiles)},
+        "distribution": [{"band": int(band), "count": int(count)} for band, count in zip(bands, band_counts)],
+    }
+
+    # Книги без оценок входят в гистограмму нулевой корзиной
+    counts = np.concatenate([per_book.to_numpy(), np.zeros(max(books_total - len(per_book), 0), dtype=np.int64)])
+    books_summary = {"books": int(books_total), "rated": int(len(per_book)),
+                     **_describe(counts), "histogram": _count_histogram(counts)}
+
+    genre_scores = ratings[["book_id", "score"]].merge(book_genre, on="book_id")
+    grouped = genre_scores.groupby("genre_id")["score"]
+    quantiles = grouped.quantile(list(PERCENTILES)).unstack()
+    genre_frame = pd.DataFrame({
+        "books": book_genre.groupby("genre_id").size(),
+        "ratings": grouped.size(),
+        "mean": grouped.mean(),
+    }).join(quantiles).reindex(list(genres))
+    genre_summary = [
+        {
+            "id": int(genre_id),
+            "name": genres[genre_id],
+            "books": int(np.nan_to_num(row["books"])),
+            "ratings": int(np.nan_to_num(row["ratings"])),
+            "mean": _number(row["mean"]),
+            **{f"p{round(p * 100)}": _number(row[p]) if p in row else None for p in PERCENTILES},
+        }
+        for genre_id, row in genre_frame.iterrows()
+    ]
+
+    author_ratings = book_author["book_id"].map(per_book).fillna(0)
+    author_summary = {
+        "total": int(authors_total),
+        "with_books": int(book_author["author_id"].nunique()),
+        "books_per_author": _describe(book_author.groupby("author_id").size().to_numpy()),
+        "ratings_per_author": _describe(author_ratings.groupby(book_author["author_id"]).sum().to_numpy()),
+    }
+    return {"ratings": rating_summary, "ratings_per_book": books_summary,
+            "genres": genre_summary, "authors": author_summary}
+
+
+# --- Снимок ---
+def build_summary(db: Session) -> dict:
+    """Снимок для текущего поколения записей (поколение берётся до чтения: запись во время
+    чтения сделает снимок устаревшим, и он будет пересобран)"""
+    generation = write_generation()
+    started = time.perf_counter()
+    summary = compute_summary(**load_snapshot(db))
+    summary["generation"] = generation
+    summary["built_at"] = time.time()
+    summary["build_seconds"] = round(time.perf_counter() - started, 4)
+    return summary
+
+
+def _rebuild(db: Optional[Session] = None) -> dict:
+    """Собирает и публикует снимок; параллельные сборки сливаются в одну"""
+    global _summary
+    with _build_lock:
+        current = _summary
+        if current is not None and current["generation"] == write_generation():
+            return current
+        session = db or database.ReadSessionLocal()
+        try:
+            current = build_summary(session)
+        finally:
+            if db is None:
+                session.close()
+        with _lock:
+            _summary = current
+        return current
+
+
+def _rebuild_in_background():
+    global _rebuilding
+    try:
+        _rebuild()
+    except Exception:
+        logger.exception("Не удалось пересобрать аналитический снимок")
+    finally:
+        with _lock:
+            _rebuilding = False
+
+
+def get_summary(db: Session, fresh: bool = False) -> dict:
+    """
+    Снимок для /stats/summary. Первый снимок (и любой при fresh=True) собирается в запросе;
+    если поколение записей сменилось, отдаётся прежний снимок с stale: true и запускается фоновая сборка
+    """
+    global _rebuilding
+    with _lock:
+        current = _summary
+    if current is not None and current["generation"] == write_generation():
+        return {**current, "stale": False}
+    if current is None or fresh:
+        current = _rebuild(db)
+        return {**current, "stale": current["generation"] != write_generation()}
+    with _lock:
+        start = not _rebuilding
+        _rebuilding = True
+    if start:
+        threading.Thread(target=_rebuild_in_background, name="analytics-summary", daemon=True).start()
+    return {**current, "stale": True}
+
+
+def reset():
+    """Забывает снимок (тесты, смена БД)"""
+    global _summary
+    with _lock:
+        _summary = None
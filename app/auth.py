@@ -1,25 +1,118 @@
-"""Авторизация проекта"""
+"""
+Авторизация проекта.
 
+passlib/bcrypt, контекст паролей и пул хэширования создаются при первом использовании
+(get_pwd_context, get_hashing_pool): запуск воркера и импорт модуля за них не платят.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
 
-from app import models
-from app.database import get_db
-from app.config import settings
+from app import coherence, models
+from app.cache import TTLCache
+from app.hashing import HashingPool, HashingPoolBusy
+from app.database import get_primary_read_db, get_async_read_db
+from app.config import Settings, settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
+_lazy_lock = threading.Lock()
+_pwd_context = None
+_hashing_pool: Optional[HashingPool] = None
+
+
+def get_pwd_context():
+    """Контекст паролей: стоимость bcrypt задаётся настройкой; хэши с другой стоимостью пересчитываются при входе"""
+    global _pwd_context
+    with _lazy_lock:
+        if _pwd_context is None:
+            from passlib.context import CryptContext
+            _pwd_context = CryptContext(
+                schemes=["bcrypt"],
+                deprecated="auto",
+                bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+                bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+                bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+            )
+        return _pwd_context
+
+
+def get_hashing_pool() -> HashingPool:
+    """Пул для bcrypt, чтобы всплеск логинов не занимал воркеры и потоки веб-сервера"""
+    global _hashing_pool
+    with _lazy_lock:
+        if _hashing_pool is None:
+            _hashing_pool = HashingPool(workers=settings.HASH_POOL_WORKERS,
+                                        queue_depth=settings.HASH_POOL_QUEUE_DEPTH)
+        return _hashing_pool
+
+
+def __getattr__(name: str):
+    # auth.pwd_context / auth.hashing_pool — прежние имена, создаются при первом обращении
+    if name == "pwd_context":
+        return get_pwd_context()
+    if name == "hashing_pool":
+        return get_hashing_pool()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    """Лёгкое представление аутентифицированного пользователя (без ORM-объекта)"""
+    id: int
+    username: str
+
+
+# Кэш: JWT -> UserPrincipal. Запись живёт не дольше TTL и не дольше срока действия токена
+# (размер и TTL из настроек выставляет configure)
+user_cache = TTLCache(ttl=Settings.model_fields["AUTH_CACHE_TTL"].default,
+                      maxsize=Settings.model_fields["AUTH_CACHE_SIZE"].default)
+
+
+def configure():
+    """Применяет текущие настройки: кэш пользователей, контекст паролей и пул создаются заново"""
+    global _pwd_context, _hashing_pool
+    user_cache.configure(ttl=settings.AUTH_CACHE_TTL, maxsize=settings.AUTH_CACHE_SIZE)
+    with _lazy_lock:
+        old_pool, _pwd_context, _hashing_pool = _hashing_pool, None, None
+    if old_pool is not None:
+        old_pool.shutdown()
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+async def _run_hashing(fn, *args):
+    try:
+        return await get_hashing_pool().run(fn, *args)
+    except HashingPoolBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервер перегружен, повторите попытку позже",
+            headers={"Retry-After": str(settings.HASH_POOL_RETRY_AFTER)},
+        )
+
+async def verify_password_async(plain_password, hashed_password) -> tuple[bool, Optional[str]]:
+    """
+    Проверка пароля в пуле хэширования. Возвращает (совпал, новый хэш);
+    новый хэш не None, если сохранённый посчитан с другой стоимостью и его надо заменить
+    """
+    return await _run_hashing(get_pwd_context().verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash_async(password) -> str:
+    """Хэширование пароля в пуле хэширования"""
+    return await _run_hashing(get_pwd_context().hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -27,21 +120,83 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str) -> tuple[int, Optional[float]]:
+    """ID пользователя и срок действия (unix time) из JWT; при невалидном токене — 401"""
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
-            raise credentials_exception
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    return int(user_id), payload.get("exp")
 
-    user = db.query(models.User).filter(models.User.id == int(user_id)).first()
+def _cache_principal(token: str, user: models.User, expires_at: Optional[float], generation: int) -> UserPrincipal:
+    principal = UserPrincipal(id=user.id, username=user.username)
+    ttl = settings.AUTH_CACHE_TTL
+    if expires_at is not None:
+        ttl = min(ttl, expires_at - time.time())
+    if ttl > 0:
+        user_cache.set(token, principal, ttl=ttl, generation=generation)
+    return principal
+
+# Пользователь читается из основной БД: user_cache общий для процесса, и строка с отстающей
+# реплики вернула бы в него старые данные после сброса
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_primary_read_db)) -> UserPrincipal:
+    principal = user_cache.get(token)
+    if principal is not None:
+        return principal
+    generation = user_cache.generation
+    user_id, expires_at = decode_token(token)
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if user is None:
+        raise _credentials_exception()
+    return _cache_principal(token, user, expires_at, generation)
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_read_db)
+) -> UserPrincipal:
+    """Асинхронный вариант get_current_user для режима ASYNC_DB"""
+    principal = user_cache.get(token)
+    if principal is not None:
+        return principal
+    generation = user_cache.generation
+    user_id, expires_at = decode_token(token)
+    user = await db.get(models.User, user_id)
     if user is None:
-        raise credentials_exception
-    return user
+        raise _credentials_exception()
+    return _cache_principal(token, user, expires_at, generation)
+
+def invalidate_user(user_id: int):
+    """Сбрасывает закэшированные токены пользователя"""
+    user_cache.discard_if(lambda principal: principal.id == user_id)
+
+
+# Изменение или удаление пользователя через ORM сбрасывает его записи в кэше после commit
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _remember_changed_user(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_user_ids", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        invalidate_user(user_id)
+
+
+# Другой процесс изменил пользователей (какие — неизвестно): кэш сбрасывается целиком
+def _on_remote_write(tables: set[str]):
+    if "users" in tables:
+        user_cache.invalidate()
+
+
+coherence.subscribe(_on_remote_write)
@@ -0,0 +1,174 @@
+"""In-process кэш с TTL, LRU-вытеснением и защитой от одновременных промахов"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Потокобезопасный кэш: записи живут ttl секунд, при переполнении вытесняются самые старые.
+    get_or_compute гарантирует, что при одновременных промахах по одному ключу
+    значение вычисляется один раз, остальные потоки ждут результат.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._key_locks: dict = {}
+        self._pending: dict = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def configure(self, ttl: float, maxsize: int):
+        """Новые TTL и размер (из настроек при создании приложения); записи сбрасываются"""
+        with self._lock:
+            self.ttl = ttl
+            self.maxsize = maxsize
+            self._data.clear()
+            self._generation += 1
+
+    def _lookup(self, key: Hashable):
+        """Значение по ключу или _MISSING; вызывается под self._lock"""
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Значение из кэша без вычисления"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None, generation: int = None):
+        """
+        Кладёт значение в кэш. Если передано поколение и с тех пор была инвалидация,
+        значение считается устаревшим и не сохраняется
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Значение из кэша, при промахе — вычисляет его ровно один раз на ключ"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                value = self._lookup(key)
+                if value is not _MISSING:
+                    self.coalesced += 1
+                    return value
+                self.misses += 1
+                generation = self._generation
+            try:
+                value = compute()
+                self.set(key, value, generation=generation)
+            finally:
+                with self._lock:
+                    if self._key_locks.get(key) is key_lock:
+                        del self._key_locks[key]
+        return value
+
+    async def aget_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Асинхронный вариант get_or_compute: ожидающие корутины не блокируют event loop"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            future = self._pending.get(key)
+            leader = future is None
+            generation = self._generation
+            if leader:
+                future = asyncio.get_running_loop().create_future()
+                self._pending[key] = future
+                self.misses += 1
+
+        if not leader:
+            await asyncio.wait([future])
+            if future.cancelled():
+                return await self.aget_or_compute(key, compute)
+            with self._lock:
+                self.coalesced += 1
+            return future.result()
+
+        try:
+            value = await compute()
+            self.set(key, value, generation=generation)
+            future.set_result(value)
+        finally:
+            if not future.done():
+                future.cancel()
+            with self._lock:
+                self._pending.pop(key, None)
+        return value
+
+    def invalidate(self, key: Hashable = _MISSING):
+        """Сбрасывает один ключ или весь кэш"""
+        with self._lock:
+            self.invalidations += 1
+            self._generation += 1
+            if key is _MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def discard_if(self, predicate: Callable[[Any], bool]):
+        """Удаляет записи, значения которых удовлетворяют условию"""
+        with self._lock:
+            self.invalidations += 1
+            self._generation += 1
+            for key in [key for key, (_, value) in self._data.items() if predicate(value)]:
+                del self._data[key]
+
+    @property
+    def generation(self) -> int:
+        """Номер поколения: меняется при каждой инвалидации (для set(..., generation=...))"""
+        return self._generation
+
+    def stats(self) -> dict:
+        """Счётчики для подбора размера и TTL"""
+        with self._lock:
+            requests = self.hits + self.misses + self.coalesced
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_ratio": round((self.hits + self.coalesced) / requests, 4) if requests else 0.0,
+            }
@@ -0,0 +1,178 @@
+"""Сброс in-process кэшей по записям других процессов (поколения в cache_generations, PRAGMA data_version)"""
+
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app import database, metrics, models
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Таблица БД -> поколение кэшей, которые от неё зависят (имена версий app/versions.py)
+GENERATIONS = {
+    "books": "books", "book_author": "books", "book_genre": "books",
+    "authors": "authors", "genres": "genres",
+    "ratings": "ratings", "book_rating_stats": "ratings", "author_rating_stats": "ratings",
+    "genre_book_stats": "ratings",
+    "users": "users",
+}
+
+_state_lock = threading.Lock()
+_check_lock = threading.Lock()
+_checker: Optional[sqlite3.Connection] = None
+# Поколения таблиц, изменения которых этот процесс уже учёл; None — sync ещё не вызывался
+_known: Optional[dict[str, int]] = None
+_data_version: Optional[int] = None
+_checked_at = 0.0
+_UNSET = object()
+_path = _UNSET
+_subscribers: list[Callable[[set[str]], None]] = []
+
+
+def subscribe(handler: Callable[[set[str]], None]):
+    """handler(таблицы) вызывается, когда sync находит записи других процессов"""
+    _subscribers.append(handler)
+
+
+def _database_path() -> Optional[str]:
+    # Файл основной БД; разбор URL запоминается до close()
+    global _path
+    if _path is _UNSET:
+        _path = database.sqlite_path(database.database_url())
+    return _path
+
+
+def _enabled() -> bool:
+    return settings.CACHE_COHERENCE and _database_path() is not None
+
+
+def _connect() -> sqlite3.Connection:
+    return sqlite3.connect(f"file:{_database_path()}?mode=ro", uri=True,
+                           timeout=settings.SQLITE_BUSY_TIMEOUT / 1000,
+                           isolation_level=None, check_same_thread=False)
+
+
+def _track(session: Session, tables):
+    names = {GENERATIONS[table] for table in tables if table in GENERATIONS}
+    if names:
+        session.info.setdefault("cache_tables", set()).update(names)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    _track(session, {type(obj).__table__.name for obj in (*session.new, *session.dirty, *session.deleted)})
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement(orm_execute_state):
+    # db.execute(insert / update / delete ...) проходит мимо flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None:
+            _track(orm_execute_state.session, {table.name})
+
+
+@event.listens_for(Session, "before_commit")
+def _publish_in_transaction(session):
+    """Новые поколения изменённых таблиц в транзакции записи, на её соединении"""
+    if not settings.CACHE_COHERENCE:
+        session.info.pop("cache_tables", None)
+        return
+    session.flush()
+    tables = session.info.pop("cache_tables", None)
+    if not tables or session.get_bind().dialect.name != "sqlite":
+        return
+    table = models.CacheGeneration.__table__
+    statement = sqlite_insert(table).values([{"name": name, "generation": 1} for name in sorted(tables)])
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.name], set_={"generation": table.c.generation + 1})
+    session.info["cache_generations"] = session.execute(
+        statement.returning(table.c.name, table.c.generation)).all()
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_published(session):
+    # Свои записи не должны будить подписчиков этого процесса при следующем sync
+    rows = session.info.pop("cache_generations", None)
+    if not rows:
+        return
+    with _state_lock:
+        if _known is None:
+            return
+        for name, generation in rows:
+            # Поколение перескочило — таблицу менял и другой процесс, это заметит sync
+            if _known.get(name, 0) == generation - 1:
+                _known[name] = generation
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_pending(session):
+    session.info.pop("cache_tables", None)
+    session.info.pop("cache_generations", None)
+
+
+def sync(force: bool = False) -> set[str]:
+    """
+    Проверяет записи других процессов (не чаще CACHE_COHERENCE_INTERVAL) и оповещает подписчиков.
+    Первый вызов только запоминает поколения. Возвращает изменённые таблицы
+    """
+    global _checker, _known, _data_version, _checked_at
+    if not _enabled():
+        return set()
+    now = time.monotonic()
+    if not force and now - _checked_at < settings.CACHE_COHERENCE_INTERVAL:
+        return set()
+    with _check_lock:
+        _checked_at = now
+        try:
+            if _checker is None:
+                _checker = _connect()
+            data_version = _checker.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == _data_version:
+                return set()
+            generations = dict(_checker.execute("SELECT name, generation FROM cache_generations"))
+        except sqlite3.Error:
+            logger.warning("Не удалось прочитать cache_generations", exc_info=True)
+            return set()
+        _data_version = data_version
+        with _state_lock:
+            changed = set() if _known is None else {
+                name for name, generation in generations.items() if _known.get(name) != generation}
+            _known = generations
+    if changed:
+        for table in changed:
+            metrics.CACHE_REMOTE_INVALIDATIONS.labels(table).inc()
+        for handler in _subscribers:
+            handler(changed)
+    return changed
+
+
+def close():
+    """Закрывает соединение и забывает поколения (остановка приложения, смена БД)"""
+    global _checker, _known, _data_version, _checked_at, _path
+    with _check_lock, _state_lock:
+        if _checker is not None:
+            _checker.close()
+        _checker = None
+        _known = _data_version = None
+        _checked_at = 0.0
+        _path = _UNSET
+
+
+class CoherenceMiddleware:
+    """ASGI-middleware: sync() перед каждым HTTP-запросом"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            sync()
+        await self.app(scope, receive, send)
@@ -1,4 +1,12 @@
-"""Конфиг для ключа"""
+"""
+Конфиг для ключа.
+
+Settings() читается из окружения и .env не при импорте, а при первом обращении к полю
+settings (или задаётся явно через configure / create_app(settings)): без SECRET_KEY
+модули импортируются, а ошибка возникает только там, где настройки действительно нужны.
+"""
+
+from typing import Optional
 
 from pydantic_settings import BaseSettings
 
@@ -7,7 +15,137 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # Файл базы данных SQLite
+    DB_PATH: str = "data/catalog.db"
+    # URL основной БД (SQLAlchemy); по умолчанию sqlite:///DB_PATH
+    DATABASE_URL: Optional[str] = None
+    # URL реплик для чтения через запятую: GET-эндпоинты читают из них по кругу.
+    # Клиент после записи READ_YOUR_WRITES_SECONDS секунд читает из основной БД (cookie db_primary_until)
+    READ_DATABASE_URLS: str = ""
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+
+    # Профиль SQLite: применяется к каждому соединению
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_CACHE_SIZE: int = -64000  # отрицательное значение — размер в КиБ
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_BUSY_TIMEOUT: int = 5000  # мс
+    SQLITE_FOREIGN_KEYS: bool = True
+    SQLITE_READ_POOL_SIZE: int = 8
+    SQLITE_WRITE_POOL_SIZE: int = 1
+
+    # Кэш аутентифицированных пользователей (JWT -> пользователь)
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_CACHE_TTL: float = 60.0
+
+    # bcrypt: стоимость и пул хэширования для /token и /register
+    BCRYPT_ROUNDS: int = 12
+    HASH_POOL_WORKERS: int = 4
+    HASH_POOL_QUEUE_DEPTH: int = 16
+    HASH_POOL_RETRY_AFTER: int = 1  # секунд, заголовок Retry-After при 503
+
+    # Пакетная запись оценок (app/ingest.py): POST /books/{id}/rate ставит оценку в очередь, фоновый
+    # писатель фиксирует очередь одной транзакцией, как только набралось BATCH_SIZE оценок или первая
+    # ждёт MAX_DELAY секунд; ответ — после commit пачки. При заполненной очереди — 503 с Retry-After
+    RATING_INGEST: bool = False
+    RATING_INGEST_BATCH_SIZE: int = 256
+    RATING_INGEST_MAX_DELAY: float = 0.005
+    RATING_INGEST_QUEUE_DEPTH: int = 10000
+    RATING_INGEST_RETRY_AFTER: int = 1  # секунд
+
+    # Admission control (app/admission.py): классы маршрутов read (GET), write (прочие методы),
+    # auth (/token, /register). На класс — лимит одновременных запросов (0 — без лимита) с общей
+    # глубиной очереди ожидания и token bucket на клиента (токен Authorization или IP): RATE запросов
+    # в секунду, всплеск BURST (RATE 0 — без лимита). Пустое ведро — 429, полная очередь или
+    # ожидание дольше QUEUE_TIMEOUT — 503; оба с Retry-After
+    ADMISSION_CONTROL: bool = False
+    ADMISSION_READ_CONCURRENCY: int = 0
+    ADMISSION_WRITE_CONCURRENCY: int = 4
+    ADMISSION_AUTH_CONCURRENCY: int = 4
+    ADMISSION_QUEUE_DEPTH: int = 64
+    ADMISSION_QUEUE_TIMEOUT: float = 2.0  # секунд
+    ADMISSION_READ_RATE: float = 0.0
+    ADMISSION_READ_BURST: int = 0
+    ADMISSION_WRITE_RATE: float = 20.0
+    ADMISSION_WRITE_BURST: int = 40
+    ADMISSION_AUTH_RATE: float = 1.0
+    ADMISSION_AUTH_BURST: int = 5
+    ADMISSION_MAX_CLIENTS: int = 100000  # ведер в памяти, самые давние вытесняются
+    ADMISSION_RETRY_AFTER: int = 1  # секунд, Retry-After при 503
+
+    # Быстрый JSON для списков /books/, /authors/, /genres/: строки из БД кодируются orjson без Pydantic
+    FAST_JSON: bool = False
+
+    # Метрики Prometheus на GET /metrics: задержки по маршрутам, число и время SQL-запросов
+    METRICS_ENABLED: bool = True
+
+    # Бюджет SQL-запросов на HTTP-запрос (защита от N+1), для разработки и тестов:
+    # off — выключено, log — предупреждение с отчётом, raise — исключение на первом лишнем запросе.
+    # Бюджеты маршрутов — app/querybudget.py, для остальных QUERY_BUDGET_DEFAULT
+    QUERY_BUDGET_MODE: str = "off"
+    QUERY_BUDGET_DEFAULT: int = 10
+
+    # Асинхронный доступ к БД (AsyncSession + aiosqlite) для всех эндпоинтов
+    ASYNC_DB: bool = False
+
+    # Кэш лидербордов /stats
+    LEADERBOARD_CACHE_TTL: float = 30.0
+    LEADERBOARD_CACHE_SIZE: int = 256
+
+    # Согласованность кэшей между воркерами на одной БД (app/coherence.py): запись увеличивает
+    # поколение таблицы в cache_generations, перед запросом проверяется PRAGMA data_version.
+    # CACHE_COHERENCE_INTERVAL — проверять не чаще раза в столько секунд (0 — перед каждым запросом)
+    CACHE_COHERENCE: bool = True
+    CACHE_COHERENCE_INTERVAL: float = 0.0
+
+    # Взвешенный рейтинг топа книг: (PRIOR_WEIGHT * PRIOR_MEAN + сумма оценок) / (PRIOR_WEIGHT + число оценок)
+    # После изменения пересчитать лидерборды: python rebuild_stats.py
+    TOP_BOOKS_PRIOR_MEAN: float = 3.0
+    TOP_BOOKS_PRIOR_WEIGHT: float = 10.0
+
+    # Рекомендации (app/recommend.py): соседей на книгу, ослабление сходства при малом числе
+    # общих оценщиков (сходство × общие / (общие + RECOMMEND_SHRINK)), сколько оценок пользователя
+    # учитывать в /me/recommendations и период фонового пересчёта в секундах (0 — выключен).
+    # Полная пересборка: python rebuild_recommendations.py
+    RECOMMEND_NEIGHBORS: int = 20
+    RECOMMEND_SHRINK: float = 10.0
+    RECOMMEND_USER_HISTORY: int = 50
+    RECOMMEND_REFRESH_INTERVAL: float = 60.0
+
     class Config:
         env_file = ".env"
 
-settings = Settings()
+_current: Optional[Settings] = None
+
+
+def get_settings() -> Settings:
+    """Текущие настройки; при первом обращении читаются из окружения и .env"""
+    global _current
+    if _current is None:
+        _current = Settings()
+    return _current
+
+
+def configure(new_settings: Settings) -> Settings:
+    """Делает new_settings текущими (create_app, тесты, скрипты)"""
+    global _current
+    _current = new_settings
+    return new_settings
+
+
+class _SettingsProxy:
+    """settings.X — поле текущих настроек; присваивание (monkeypatch в тестах) меняет их же"""
+
+    __slots__ = ()
+
+    def __getattr__(self, name: str):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(get_settings(), name, value)
+
+    def __delattr__(self, name: str):
+        delattr(get_settings(), name)
+
+
+settings = _SettingsProxy()
@@ -3,20 +3,22 @@ CRUD операции для БД работы с книгами
 Включает аутентификацию пользователя, работу с книгами, их авторами, жанрами и рейтингами
 """
 
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from app import models, schemas
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from typing import Optional
+from sqlalchemy import (
+    select, insert, update, bindparam, func, tuple_, or_, collate, cast, literal, null, union_all, Integer,
+)
+from sqlalchemy.orm import Session, selectinload
+from app import auth, models, schemas, stats, search, versions, recommend
 
 # --- Authentication ---
 def get_user_by_username(db: Session, username: str):
     """Получает пользователя по имени"""
     return db.query(models.User).filter(models.User.username == username).first()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    """Создаёт нового пользователя с хэшированным паролем"""
-    hashed_pw = pwd_context.hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_pw: Optional[str] = None):
+    """Создаёт нового пользователя с хэшированным паролем (хэш можно посчитать заранее в пуле)"""
+    if hashed_pw is None:
+        hashed_pw = auth.get_password_hash(user.password)
     db_user = models.User(username=user.username, hashed_password=hashed_pw)
     db.add(db_user)
     db.commit()
@@ -26,10 +28,16 @@ def create_user(db: Session, user: schemas.UserCreate):
 def authenticate_user(db: Session, username: str, password: str):
     """Аутентификация по паролю и логину"""
     user = get_user_by_username(db, username)
-    if not user or not pwd_context.verify(password, user.hashed_password):
+    if not user or not auth.verify_password(password, user.hashed_password):
         return None
     return user
 
+def update_password_hash(db: Session, user: models.User, hashed_pw: str):
+    """Сохраняет пересчитанный хэш пароля (например, после смены стоимости bcrypt)"""
+    user.hashed_password = hashed_pw
+    db.commit()
+    return user
+
 # --- Genre ---
 def create_genre(db: Session, genre: schemas.GenreCreate):
     """Создаёт новый жанр"""
@@ -37,12 +45,17 @@ def create_genre(db: Session, genre: schemas.GenreCreate):
     db.add(db_genre)
     db.commit()
     db.refresh(db_genre)
+    versions.bump("genres", [db_genre.id])
     return db_genre
 
 def get_all_genres(db: Session):
     """Все жанры"""
     return db.query(models.Genre).all()
 
+def get_all_genres_rows(db: Session):
+    """Все жанры как словари в форме GenreRead, без ORM-объектов (быстрый JSON)"""
+    return [dict(row) for row in db.execute(select(models.Genre.name, models.Genre.id)).mappings()]
+
 def get_genre(db: Session, genre_id: int):
     """Получает жанр по ID"""
     return db.query(models.Genre).filter(models.Genre.id == genre_id).first()
@@ -54,6 +67,8 @@ def update_genre(db: Session, genre_id: int, genre: schemas.GenreCreate):
         return None
     db_genre.name = genre.name
     db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("genres", [genre_id])
     db.refresh(db_genre)
     return db_genre
 
@@ -62,8 +77,11 @@ def delete_genre(db: Session, genre_id: int):
     db_genre = db.query(models.Genre).filter(models.Genre.id == genre_id).first()
     if not db_genre:
         return None
+    stats.remove_genre_stats(db, genre_ids=[genre_id])
     db.delete(db_genre)
     db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("genres", [genre_id])
     return db_genre
 
 # --- Author ---
@@ -73,12 +91,17 @@ def create_author(db: Session, author: schemas.AuthorCreate):
     db.add(db_author)
     db.commit()
     db.refresh(db_author)
+    versions.bump("authors", [db_author.id])
     return db_author
 
 def get_all_authors(db: Session):
     """Получает весь список авторов"""
     return db.query(models.Author).all()
 
+def get_all_authors_rows(db: Session):
+    """Все авторы как словари в форме AuthorRead, без ORM-объектов (быстрый JSON)"""
+    return [dict(row) for row in db.execute(select(models.Author.name, models.Author.id)).mappings()]
+
 def get_author(db: Session, author_id: int):
     """Получает автора по ID"""
     return db.query(models.Author).filter(models.Author.id == author_id).first()
@@ -89,7 +112,10 @@ def update_author(db: Session, author_id: int, author: schemas.AuthorCreate):
     if not db_author:
         return None
     db_author.name = author.name
+    search.index_books(db, search.author_book_ids(db, author_id))
     db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("authors", [author_id])
     db.refresh(db_author)
     return db_author
 
@@ -98,8 +124,12 @@ def delete_author(db: Session, author_id: int):
     db_author = db.query(models.Author).filter(models.Author.id == author_id).first()
     if not db_author:
         return None
+    book_ids = search.author_book_ids(db, author_id)
     db.delete(db_author)
+    search.index_books(db, book_ids)
     db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("authors", [author_id])
     return db_author
 
 # --- Book ---
@@ -114,8 +144,11 @@ def create_book(db: Session, book: schemas.BookCreate):
         authors=authors
     )
     db.add(db_book)
+    db.flush()
+    search.index_books(db, [db_book.id])
     db.commit()
     db.refresh(db_book)
+    versions.bump("books", [db_book.id])
     return db_book
 
 def get_book(db: Session, book_id: int):
@@ -126,39 +159,260 @@ def get_all_books(db: Session):
     """Получает весь список книг"""
     return db.query(models.Book).all()
 
+# Авторов в фасетах — не больше стольких (самые частые в текущей выборке)
+FACET_AUTHORS_LIMIT = 20
+
+# Ключи сортировки: название — по индексу ix_books_title_nocase, оценка — книги без оценок в конце
+_TITLE_KEY = collate(models.Book.title, "NOCASE")
+_RATING_KEY = func.coalesce(models.BookRatingStats.average_rating, 0.0)
+
+def _like_prefix(prefix: str) -> str:
+    """Шаблон LIKE для начала строки; %, _ и \\ в префиксе экранируются"""
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def book_filter_clauses(filters: schemas.BookFilter) -> list:
+    """Условия WHERE по books для фильтров списка книг"""
+    clauses = []
+    if filters.author_id is not None:
+        clauses.append(models.Book.id.in_(
+            select(models.book_author_table.c.book_id)
+            .where(models.book_author_table.c.author_id == filters.author_id)))
+    if filters.genre_id is not None:
+        clauses.append(models.Book.id.in_(
+            select(models.book_genre_table.c.book_id)
+            .where(models.book_genre_table.c.genre_id == filters.genre_id)))
+    if filters.min_rating is not None:
+        clauses.append(models.Book.id.in_(
+            select(models.BookRatingStats.book_id).where(
+                models.BookRatingStats.ratings_count > 0,
+                models.BookRatingStats.average_rating >= filters.min_rating)))
+    if filters.title_prefix:
+        # LIKE без учёта регистра (латиница) идёт по индексу с NOCASE
+        clauses.append(models.Book.title.like(_like_prefix(filters.title_prefix), escape="\\"))
+    return clauses
+
+def books_page_query(query, limit: int, after: Optional[int] = None,
+                     filters: Optional[schemas.BookFilter] = None, sort: str = "id"):
+    """
+    Добавляет к select по books фильтры, сортировку и keyset-курсор (limit + 1 строк).
+    Курсор — ID последней книги страницы при любой сортировке: её ключ сортировки
+    берётся подзапросом, так что курсор остаётся числом. Если книги курсора уже нет, ключ —
+    NULL и страница пуста (см. books_cursor_missing)
+    """
+    if filters is not None:
+        query = query.where(*book_filter_clauses(filters))
+    if sort == "title":
+        query = query.order_by(_TITLE_KEY, models.Book.id)
+        if after is not None:
+            # (название, id) > ключа курсора; первое условие — диапазон по индексу названия
+            after_key = select(_TITLE_KEY).where(models.Book.id == after).scalar_subquery()
+            query = query.where(_TITLE_KEY >= after_key, or_(_TITLE_KEY > after_key, models.Book.id > after))
+    elif sort == "rating":
+        query = query.outerjoin(models.BookRatingStats, models.BookRatingStats.book_id == models.Book.id) \
+            .order_by(_RATING_KEY.desc(), models.Book.id.desc())
+        if after is not None:
+            # Книга без строки статистики — ключ 0, удалённая книга — NULL
+            after_key = select(_RATING_KEY) \
+                .outerjoin_from(models.Book, models.BookRatingStats,
+                                models.BookRatingStats.book_id == models.Book.id) \
+                .where(models.Book.id == after).correlate(None).scalar_subquery()
+            query = query.where(tuple_(_RATING_KEY, models.Book.id) < tuple_(after_key, after))
+    else:
+        query = query.order_by(models.Book.id)
+        if after is not None:
+            query = query.where(models.Book.id > after)
+    return query.limit(limit + 1)
+
+def books_cursor_missing(db: Session, after: Optional[int], sort: str) -> bool:
+    """
+    Курсор сортировки по названию или оценке указывает на удалённую книгу. Такой курсор даёт
+    пустую страницу, поэтому проверяется только для пустых страниц
+    """
+    if after is None or sort == "id":
+        return False
+    return db.scalar(select(models.Book.id).where(models.Book.id == after)) is None
+
+def get_books_page(db: Session, limit: int = 50, after: Optional[int] = None,
+                   filters: Optional[schemas.BookFilter] = None, sort: str = "id"):
+    """
+    Страница книг с keyset-пагинацией, фильтрами и сортировкой (см. books_page_query).
+    Авторы и жанры подгружаются пачками (selectin), поэтому на страницу
+    всегда уходит фиксированное число запросов. Возвращает (книги, курсор следующей страницы)
+    """
+    query = select(models.Book).options(
+        selectinload(models.Book.authors),
+        selectinload(models.Book.genres),
+    )
+    books = db.scalars(books_page_query(query, limit, after, filters, sort)).all()
+    if len(books) > limit:
+        return books[:limit], books[limit - 1].id
+    return books, None
+
+def get_book_facets(db: Session, filters: Optional[schemas.BookFilter] = None) -> dict:
+    """
+    Счётчики книг выборки по жанрам, авторам и диапазонам средней оценки одним запросом:
+    GROUP BY по таблицам связей и агрегатам, склеенные через UNION ALL.
+    Выборка с фильтрами — CTE, к которой присоединяется каждая ветка; без фильтров
+    ветки считают по индексам связей, не касаясь books
+    """
+    clauses = book_filter_clauses(filters) if filters is not None else []
+    filtered = select(models.Book.id.label("book_id")).where(*clauses).cte("filtered") if clauses else None
+
+    def restrict(query, table):
+        """Ветка фасета по table, ограниченная книгами выборки; выборка идёт первой в соединении"""
+        if filtered is None:
+            return query.select_from(table)
+        return query.select_from(filtered).join(table, table.c.book_id == filtered.c.book_id)
+
+    count = func.count().label("count")
+    book_genre, book_author = models.book_genre_table, models.book_author_table
+    book_stats = models.BookRatingStats.__table__
+
+    genre_counts = restrict(select(book_genre.c.genre_id.label("id"), count), book_genre) \
+        .group_by(book_genre.c.genre_id).subquery()
+    genres = select(literal("genre"), models.Genre.id, models.Genre.name, genre_counts.c.count) \
+        .join_from(genre_counts, models.Genre, models.Genre.id == genre_counts.c.id)
+    author_counts = restrict(select(book_author.c.author_id.label("id"), count), book_author) \
+        .group_by(book_author.c.author_id) \
+        .order_by(count.desc(), book_author.c.author_id) \
+        .limit(FACET_AUTHORS_LIMIT).subquery()
+    authors = select(literal("author"), models.Author.id, models.Author.name, author_counts.c.count) \
+        .join_from(author_counts, models.Author, models.Author.id == author_counts.c.id)
+    band = cast(book_stats.c.average_rating, Integer)
+    bands = restrict(select(literal("rating"), band, null(), count), book_stats) \
+        .where(book_stats.c.ratings_count > 0).group_by(band)
+    # Книги без оценок — разность между числом книг выборки и оценённых
+    total = select(literal("total"), null(), null(), func.count()) \
+        .select_from(filtered if filtered is not None else models.Book)
+
+    facets = {"genres": [], "authors": [], "rating_bands": []}
+    unrated = 0
+    for facet, facet_id, name, facet_count in db.execute(union_all(genres, authors, bands, total)):
+        if facet == "total":
+            unrated += facet_count
+        elif facet == "rating":
+            unrated -= facet_count
+            facets["rating_bands"].append({"band": facet_id, "count": facet_count})
+        else:
+            facets[f"{facet}s"].append({"id": facet_id, "name": name, "count": facet_count})
+    facets["genres"].sort(key=lambda item: (-item["count"], item["name"]))
+    facets["authors"].sort(key=lambda item: (-item["count"], item["id"]))
+    facets["rating_bands"].sort(key=lambda item: item["band"], reverse=True)
+    if unrated:
+        facets["rating_bands"].append({"band": None, "count": unrated})
+    return facets
+
+def get_related_rows(db: Session, link_table, link_column: str, model, book_ids):
+    """{id книги: [{"name", "id"}, ...]} для авторов или жанров страницы одним запросом"""
+    related = {}
+    rows = db.execute(
+        select(link_table.c.book_id, model.name, model.id)
+        .join(model, model.id == link_table.c[link_column])
+        .where(link_table.c.book_id.in_(book_ids))
+    )
+    for book_id, name, related_id in rows:
+        related.setdefault(book_id, []).append({"name": name, "id": related_id})
+    return related
+
+def get_books_page_rows(db: Session, limit: int = 50, after: Optional[int] = None,
+                        filters: Optional[schemas.BookFilter] = None, sort: str = "id"):
+    """
+    Та же страница, что и get_books_page, но строками: книги, авторы и жанры
+    читаются тремя запросами в словари в форме BookPage без ORM-объектов и Pydantic
+    """
+    query = select(models.Book.id, models.Book.title, models.Book.description)
+    rows = db.execute(books_page_query(query, limit, after, filters, sort)).all()
+    if not rows:
+        return {"items": [], "next_cursor": None}
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    rows = rows[:limit]
+    book_ids = [row.id for row in rows]
+    authors = get_related_rows(db, models.book_author_table, "author_id", models.Author, book_ids)
+    genres = get_related_rows(db, models.book_genre_table, "genre_id", models.Genre, book_ids)
+    items = [
+        {
+            "title": row.title,
+            "description": row.description,
+            "id": row.id,
+            "authors": authors.get(row.id, []),
+            "genres": genres.get(row.id, []),
+        }
+        for row in rows
+    ]
+    return {"items": items, "next_cursor": next_cursor}
+
 def update_book(db: Session, book_id: int, book_data: schemas.BookUpdate):
     """Обновляет информацию по книге, включая жанр и автора"""
     book = db.query(models.Book).filter(models.Book.id == book_id).first()
     if not book:
         return None
+    affected_authors = set()
     for attr, value in book_data.dict(exclude_unset=True).items():
         if attr == "genre_ids":
             genres = db.query(models.Genre).filter(models.Genre.id.in_(value)).all()
             book.genres = genres
         elif attr == "author_ids":
             authors = db.query(models.Author).filter(models.Author.id.in_(value)).all()
+            affected_authors.update(author.id for author in book.authors)
+            affected_authors.update(author.id for author in authors)
             book.authors = authors
         elif hasattr(book, attr):
             setattr(book, attr, value)
+    stats.refresh_author_stats(db, affected_authors)
+    stats.refresh_genre_stats(db, [book.id])
+    search.index_books(db, [book.id])
     db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("books", [book_id])
     db.refresh(book)
     return book
 
 def delete_book(db: Session, book_id: int):
     """Удаляет книгу по ID"""
-    book = db.query(models.Book).filter(models.Book.id == book_id).first()
+    book = db.query(models.Book).options(
+        selectinload(models.Book.authors),
+        selectinload(models.Book.genres),
+        selectinload(models.Book.ratings),
+        selectinload(models.Book.rating_stats),
+    ).filter(models.Book.id == book_id).first()
     if not book:
         return None
+    author_ids = [author.id for author in book.authors]
+    stats.remove_genre_stats(db, book_ids=[book_id])
+    recommend.remove_books(db, [book_id])
     db.delete(book)
+    stats.refresh_author_stats(db, author_ids)
+    search.remove_books(db, [book_id])
+    # Ответ собирается до commit: после него каждый автор и жанр перечитывался бы отдельным запросом
+    deleted = schemas.BookRead.from_orm(book)
     db.commit()
-    return book
+    stats.invalidate_leaderboards()
+    versions.bump("books", [book_id])
+    return deleted
 
 # --- Rating ---
 def create_rating(db: Session, user_id: int, book_id: int, rating: schemas.RatingCreate):
-    """Создаёт рейтинг книги для конкретного пользователя"""
-    db_rating = models.Rating(user_id=user_id, book_id=book_id, score=rating.score)
-    db.add(db_rating)
+    """
+    Ставит или меняет оценку пользователя книге (одна оценка на пару) и сдвигает агрегаты
+    в той же транзакции: новая оценка добавляется, повторная — заменяет прежнюю
+    """
+    if db.query(models.Book.id).filter(models.Book.id == book_id).first() is None:
+        return None
+    db_rating = db.query(models.Rating) \
+        .filter(models.Rating.user_id == user_id, models.Rating.book_id == book_id) \
+        .first()
+    if db_rating is None:
+        db_rating = models.Rating(user_id=user_id, book_id=book_id, score=rating.score)
+        db.add(db_rating)
+        stats.apply_rating(db, book_id, rating.score)
+    else:
+        score_delta = rating.score - db_rating.score
+        db_rating.score = rating.score
+        stats.apply_rating(db, book_id, score_delta, count_delta=0)
+    recommend.mark_dirty(db, [book_id])
     db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("ratings", [book_id])
     db.refresh(db_rating)
     return db_rating
 
@@ -175,7 +429,10 @@ def add_genre_to_book(db: Session, book_id: int, genre_id: int):
         return None
     if genre not in book.genres:
         book.genres.append(genre)
+        stats.refresh_genre_stats(db, [book_id])
         db.commit()
+        stats.invalidate_leaderboards()
+        versions.bump("books", [book_id])
     return book
 
 def remove_genre_from_book(db: Session, book_id: int, genre_id: int):
@@ -186,10 +443,209 @@ def remove_genre_from_book(db: Session, book_id: int, genre_id: int):
         return None
     if genre in book.genres:
         book.genres.remove(genre)
+        stats.refresh_genre_stats(db, [book_id])
         db.commit()
+        stats.invalidate_leaderboards()
+        versions.bump("books", [book_id])
     return book
 
 def get_book_genres(db: Session, book_id: int):
     """Получает все жанры книги"""
     book = db.query(models.Book).filter(models.Book.id == book_id).first()
     return book.genres if book else None
+
+# --- Bulk ---
+# Пакетная запись: ссылки проверяются одним IN-запросом на таблицу, корректные элементы
+# пишутся executemany в одной транзакции, ошибочные пропускаются и попадают в отчёт
+def _existing_ids(db: Session, column, ids):
+    """Какие из ids есть в таблице — один запрос"""
+    ids = set(ids)
+    if not ids:
+        return set()
+    return set(db.scalars(select(column).where(column.in_(ids))))
+
+def _next_ids(db: Session, column, count: int) -> list[int]:
+    """
+    ID для count новых строк после MAX(id): вставка пачки с явными ID — один executemany,
+    а INSERT ... RETURNING с порядком строк SQLite выполняет построчно. Транзакция писателя
+    начата BEGIN IMMEDIATE, поэтому между чтением MAX и вставкой никто не пишет
+    """
+    start = (db.scalar(select(func.max(column))) or 0) + 1
+    return list(range(start, start + count))
+
+def _bulk_result(results: list[dict]) -> dict:
+    """Сводка по элементам в форме schemas.BulkResult"""
+    results.sort(key=lambda item: item["index"])
+    failed = sum(1 for item in results if item["status"] == "error")
+    created = sum(1 for item in results if item["status"] == "created")
+    updated = sum(1 for item in results if item["status"] == "updated")
+    return {"created": created, "updated": updated, "failed": failed, "results": results}
+
+def create_books_bulk(db: Session, books: list[schemas.BookCreate]):
+    """Создаёт книги пачкой; книги с несуществующими авторами или жанрами не создаются"""
+    known_authors = _existing_ids(db, models.Author.id, (i for book in books for i in book.author_ids))
+    known_genres = _existing_ids(db, models.Genre.id, (i for book in books for i in book.genre_ids))
+
+    results, valid = [], []
+    for index, book in enumerate(books):
+        missing_authors = sorted(set(book.author_ids) - known_authors)
+        missing_genres = sorted(set(book.genre_ids) - known_genres)
+        if missing_authors or missing_genres:
+            errors = []
+            if missing_authors:
+                errors.append(f"Авторы не найдены: {missing_authors}")
+            if missing_genres:
+                errors.append(f"Жанры не найдены: {missing_genres}")
+            results.append({"index": index, "status": "error", "error": "; ".join(errors)})
+        else:
+            valid.append((index, book))
+    if not valid:
+        return _bulk_result(results)
+
+    book_ids = _next_ids(db, models.Book.id, len(valid))
+    db.execute(insert(models.Book.__table__), [
+        {"id": book_id, "title": book.title, "description": book.description}
+        for book_id, (_, book) in zip(book_ids, valid)
+    ])
+    book_authors, book_genres = [], []
+    for book_id, (index, book) in zip(book_ids, valid):
+        book_authors.extend({"book_id": book_id, "author_id": author_id}
+                            for author_id in dict.fromkeys(book.author_ids))
+        book_genres.extend({"book_id": book_id, "genre_id": genre_id}
+                           for genre_id in dict.fromkeys(book.genre_ids))
+        results.append({"index": index, "status": "created", "id": book_id})
+    if book_authors:
+        db.execute(insert(models.book_author_table), book_authors)
+    if book_genres:
+        db.execute(insert(models.book_genre_table), book_genres)
+    search.index_books(db, book_ids)
+    db.commit()
+    versions.bump("books", book_ids)
+    return _bulk_result(results)
+
+def _write_ratings(db: Session, items: list[tuple[int, int, float]]) -> list[Optional[tuple[int, bool]]]:
+    """
+    Пишет оценки (id пользователя, id книги, оценка) без commit: повторная оценка книги тем же
+    пользователем заменяет прежнюю, в том числе внутри пачки; агрегаты книг и авторов сдвигаются
+    один раз на книгу. Для каждого элемента — (id оценки, создана ли она) или None, если книги нет
+    """
+    known_books = _existing_ids(db, models.Book.id, (book_id for _, book_id, _ in items))
+    rating_table = models.Rating.__table__
+    current = {}  # (id пользователя, id книги) -> [id оценки или None, текущая оценка или None]
+    pairs = {(user_id, book_id) for user_id, book_id, _ in items if book_id in known_books}
+    if pairs:
+        # (user_id, book_id) IN (VALUES ...) SQLite выполняет полным просмотром, два IN идут по
+        # уникальному индексу; лишние пары пользователь × книга отсеиваются здесь
+        user_ids = {user_id for user_id, _ in pairs}
+        user_filter = (rating_table.c.user_id == next(iter(user_ids)) if len(user_ids) == 1
+                       else rating_table.c.user_id.in_(user_ids))
+        for rating_id, user_id, book_id, score in db.execute(
+            select(rating_table.c.id, rating_table.c.user_id, rating_table.c.book_id, rating_table.c.score)
+            .where(user_filter, rating_table.c.book_id.in_({book_id for _, book_id in pairs}))
+        ):
+            if (user_id, book_id) in pairs:
+                current[(user_id, book_id)] = [rating_id, score]
+
+    written, deltas = [], {}
+    for user_id, book_id, score in items:
+        if book_id not in known_books:
+            written.append(None)
+            continue
+        key = (user_id, book_id)
+        _, old_score = current.setdefault(key, [None, None])
+        total, count = deltas.get(book_id, (0.0, 0))
+        if old_score is None:
+            deltas[book_id] = (total + score, count + 1)
+        else:
+            deltas[book_id] = (total + score - old_score, count)
+        current[key][1] = score
+        written.append((key, old_score is None))
+    if not deltas:
+        return written
+
+    new_keys = [key for key, (rating_id, _) in current.items() if rating_id is None]
+    if new_keys:
+        new_ids = _next_ids(db, rating_table.c.id, len(new_keys))
+        for key, rating_id in zip(new_keys, new_ids):
+            current[key][0] = rating_id
+        db.execute(insert(rating_table), [
+            {"id": rating_id, "user_id": user_id, "book_id": book_id, "score": current[(user_id, book_id)][1]}
+            for (user_id, book_id), rating_id in zip(new_keys, new_ids)
+        ])
+    created = set(new_keys)
+    updated_keys = [key for key in current if key not in created]
+    if updated_keys:
+        db.execute(
+            update(rating_table).where(rating_table.c.id == bindparam("rating_id")).values(score=bindparam("new_score")),
+            [{"rating_id": current[key][0], "new_score": current[key][1]} for key in updated_keys],
+        )
+    stats.apply_ratings_bulk(db, deltas)
+    recommend.mark_dirty(db, deltas)
+    return [None if item is None else (current[item[0]][0], item[1]) for item in written]
+
+def _commit_ratings(db: Session, book_ids: set):
+    if not book_ids:
+        return
+    db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("ratings", book_ids)
+
+def create_ratings_bulk(db: Session, user_id: int, ratings: list[schemas.RatingBulkItem]):
+    """
+    Оценки пользователя пачкой (как create_rating: повторная оценка книги заменяет прежнюю,
+    в том числе внутри пачки); агрегаты книг и авторов сдвигаются один раз на книгу
+    """
+    written = _write_ratings(db, [(user_id, rating.book_id, rating.score) for rating in ratings])
+    results = []
+    for index, item in enumerate(written):
+        if item is None:
+            results.append({"index": index, "status": "error", "error": "Книга не найдена"})
+        else:
+            rating_id, created = item
+            results.append({"index": index, "status": "created" if created else "updated", "id": rating_id})
+    _commit_ratings(db, {rating.book_id for rating, item in zip(ratings, written) if item is not None})
+    return _bulk_result(results)
+
+def create_ratings_batch(db: Session, items: list[tuple[int, int, float]]) -> list[Optional[dict]]:
+    """
+    Оценки многих пользователей одной транзакцией (пакетная запись app/ingest.py): элементы —
+    (id пользователя, id книги, оценка); для каждого — оценка в форме schemas.RatingRead или None, если книги нет
+    """
+    written = _write_ratings(db, items)
+    _commit_ratings(db, {book_id for (_, book_id, _), item in zip(items, written) if item is not None})
+    return [None if item is None else {"id": item[0], "book_id": book_id, "user_id": user_id, "score": score}
+            for (user_id, book_id, score), item in zip(items, written)]
+
+def add_genres_to_books_bulk(db: Session, links: list[schemas.BookGenreLink]):
+    """Привязывает жанры к книгам пачкой; уже существующие связи отмечаются как exists"""
+    known_books = _existing_ids(db, models.Book.id, (link.book_id for link in links))
+    known_genres = _existing_ids(db, models.Genre.id, (link.genre_id for link in links))
+    link_table = models.book_genre_table
+    existing = set()
+    if known_books:
+        existing = set(db.execute(
+            select(link_table.c.book_id, link_table.c.genre_id)
+            .where(link_table.c.book_id.in_(known_books))
+        ).tuples())
+
+    results, new_links = [], []
+    for index, link in enumerate(links):
+        pair = (link.book_id, link.genre_id)
+        if link.book_id not in known_books:
+            results.append({"index": index, "status": "error", "error": "Книга не найдена"})
+        elif link.genre_id not in known_genres:
+            results.append({"index": index, "status": "error", "error": "Жанр не найден"})
+        elif pair in existing:
+            results.append({"index": index, "status": "exists"})
+        else:
+            existing.add(pair)
+            new_links.append({"book_id": link.book_id, "genre_id": link.genre_id})
+            results.append({"index": index, "status": "created"})
+    if new_links:
+        linked_books = {link["book_id"] for link in new_links}
+        db.execute(insert(link_table), new_links)
+        stats.refresh_genre_stats(db, linked_books)
+        db.commit()
+        stats.invalidate_leaderboards()
+        versions.bump("books", linked_books)
+    return _bulk_result(results)
@@ -0,0 +1,281 @@
+"""
+Асинхронные версии CRUD операций (AsyncSession + aiosqlite)
+Повторяют app/crud.py; связи книг подгружаются явно, так как ленивая загрузка в async недоступна
+"""
+
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from app import auth, crud, models, schemas, stats, search, versions, recommend
+
+_BOOK_RELATIONS = (selectinload(models.Book.authors), selectinload(models.Book.genres))
+
+# --- Authentication ---
+async def get_user_by_username(db: AsyncSession, username: str):
+    """Получает пользователя по имени"""
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
+
+async def get_user(db: AsyncSession, user_id: int):
+    """Получает пользователя по ID"""
+    return await db.get(models.User, user_id)
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    """Создаёт нового пользователя с хэшированным паролем; None — имя уже занято"""
+    # Соединение (если сессия его уже брала) возвращается в пул на время bcrypt
+    await db.close()
+    hashed_pw = await auth.get_password_hash_async(user.password)
+    db_user = models.User(username=user.username, hashed_password=hashed_pw)
+    db.add(db_user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Имя заняли, пока считался bcrypt
+        await db.rollback()
+        return None
+    return db_user
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    """Аутентификация по паролю и логину; устаревший хэш пересчитывается прозрачно"""
+    user = await get_user_by_username(db, username)
+    if not user:
+        return None
+    # Соединение возвращается в пул на время bcrypt
+    await db.close()
+    verified, new_hash = await auth.verify_password_async(password, user.hashed_password)
+    if not verified:
+        return None
+    if new_hash:
+        user.hashed_password = new_hash
+        db.add(user)
+        await db.commit()
+    return user
+
+# --- Genre ---
+async def create_genre(db: AsyncSession, genre: schemas.GenreCreate):
+    """Создаёт новый жанр"""
+    db_genre = models.Genre(name=genre.name)
+    db.add(db_genre)
+    await db.commit()
+    versions.bump("genres", [db_genre.id])
+    return db_genre
+
+async def get_all_genres(db: AsyncSession):
+    """Все жанры"""
+    return (await db.execute(select(models.Genre))).scalars().all()
+
+async def get_genre(db: AsyncSession, genre_id: int):
+    """Получает жанр по ID"""
+    return await db.get(models.Genre, genre_id)
+
+async def update_genre(db: AsyncSession, genre_id: int, genre: schemas.GenreCreate):
+    """Обновляет название жанра по ID"""
+    db_genre = await db.get(models.Genre, genre_id)
+    if not db_genre:
+        return None
+    db_genre.name = genre.name
+    await db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("genres", [genre_id])
+    return db_genre
+
+async def delete_genre(db: AsyncSession, genre_id: int):
+    """Удаляет жанр по ID"""
+    db_genre = await db.get(models.Genre, genre_id, options=[selectinload(models.Genre.books)])
+    if not db_genre:
+        return None
+    await db.run_sync(stats.remove_genre_stats, genre_ids=[genre_id])
+    await db.delete(db_genre)
+    await db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("genres", [genre_id])
+    return db_genre
+
+# --- Author ---
+async def create_author(db: AsyncSession, author: schemas.AuthorCreate):
+    """Создаёт нового автора"""
+    db_author = models.Author(name=author.name)
+    db.add(db_author)
+    await db.commit()
+    versions.bump("authors", [db_author.id])
+    return db_author
+
+async def get_all_authors(db: AsyncSession):
+    """Получает весь список авторов"""
+    return (await db.execute(select(models.Author))).scalars().all()
+
+async def get_author(db: AsyncSession, author_id: int):
+    """Получает автора по ID"""
+    return await db.get(models.Author, author_id)
+
+async def update_author(db: AsyncSession, author_id: int, author: schemas.AuthorCreate):
+    """Обновляет имя автора по его ID"""
+    db_author = await db.get(models.Author, author_id)
+    if not db_author:
+        return None
+    db_author.name = author.name
+    await db.run_sync(lambda sync_db: search.index_books(sync_db, search.author_book_ids(sync_db, author_id)))
+    await db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("authors", [author_id])
+    return db_author
+
+async def delete_author(db: AsyncSession, author_id: int):
+    """Удаляет автора по ID"""
+    db_author = await db.get(models.Author, author_id, options=[
+        selectinload(models.Author.books), selectinload(models.Author.rating_stats)])
+    if not db_author:
+        return None
+    book_ids = [book.id for book in db_author.books]
+    await db.delete(db_author)
+    await db.run_sync(search.index_books, book_ids)
+    await db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("authors", [author_id])
+    return db_author
+
+# --- Book ---
+async def create_book(db: AsyncSession, book: schemas.BookCreate):
+    """Создание новой книги с авторами и жанрами"""
+    genres = (await db.execute(
+        select(models.Genre).where(models.Genre.id.in_(book.genre_ids)))).scalars().all()
+    authors = (await db.execute(
+        select(models.Author).where(models.Author.id.in_(book.author_ids)))).scalars().all()
+    db_book = models.Book(
+        title=book.title,
+        description=book.description,
+        genres=list(genres),
+        authors=list(authors)
+    )
+    db.add(db_book)
+    await db.flush()
+    await db.run_sync(search.index_books, [db_book.id])
+    await db.commit()
+    versions.bump("books", [db_book.id])
+    return db_book
+
+async def get_book(db: AsyncSession, book_id: int):
+    """Книга по ID"""
+    return await db.get(models.Book, book_id, options=_BOOK_RELATIONS)
+
+async def get_all_books(db: AsyncSession):
+    """Получает весь список книг"""
+    return (await db.execute(select(models.Book).options(*_BOOK_RELATIONS))).scalars().all()
+
+async def get_books_page(db: AsyncSession, limit: int = 50, after: Optional[int] = None,
+                         filters: Optional[schemas.BookFilter] = None, sort: str = "id"):
+    """Страница книг с keyset-пагинацией, фильтрами и сортировкой (см. crud.get_books_page)"""
+    query = crud.books_page_query(select(models.Book).options(*_BOOK_RELATIONS), limit, after, filters, sort)
+    books = (await db.execute(query)).scalars().all()
+    if len(books) > limit:
+        return books[:limit], books[limit - 1].id
+    return books, None
+
+async def update_book(db: AsyncSession, book_id: int, book_data: schemas.BookUpdate):
+    """Обновляет информацию по книге, включая жанр и автора"""
+    book = await get_book(db, book_id)
+    if not book:
+        return None
+    affected_authors = set()
+    for attr, value in book_data.dict(exclude_unset=True).items():
+        if attr == "genre_ids":
+            genres = (await db.execute(
+                select(models.Genre).where(models.Genre.id.in_(value)))).scalars().all()
+            book.genres = list(genres)
+        elif attr == "author_ids":
+            authors = (await db.execute(
+                select(models.Author).where(models.Author.id.in_(value)))).scalars().all()
+            affected_authors.update(author.id for author in book.authors)
+            affected_authors.update(author.id for author in authors)
+            book.authors = list(authors)
+        elif hasattr(book, attr):
+            setattr(book, attr, value)
+    await db.run_sync(stats.refresh_author_stats, affected_authors)
+    await db.run_sync(stats.refresh_genre_stats, [book.id])
+    await db.run_sync(search.index_books, [book.id])
+    await db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("books", [book_id])
+    return book
+
+async def delete_book(db: AsyncSession, book_id: int):
+    """Удаляет книгу по ID"""
+    book = await db.get(models.Book, book_id, options=[
+        *_BOOK_RELATIONS,
+        selectinload(models.Book.ratings),
+        selectinload(models.Book.rating_stats),
+    ])
+    if not book:
+        return None
+    author_ids = [author.id for author in book.authors]
+    await db.run_sync(stats.remove_genre_stats, book_ids=[book_id])
+    await db.run_sync(recommend.remove_books, [book_id])
+    await db.delete(book)
+    await db.run_sync(stats.refresh_author_stats, author_ids)
+    await db.run_sync(search.remove_books, [book_id])
+    await db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("books", [book_id])
+    return book
+
+# --- Rating ---
+async def create_rating(db: AsyncSession, user_id: int, book_id: int, rating: schemas.RatingCreate):
+    """Ставит или меняет оценку пользователя книге и сдвигает агрегаты (см. crud.create_rating)"""
+    if (await db.execute(select(models.Book.id).where(models.Book.id == book_id))).first() is None:
+        return None
+    db_rating = (await db.execute(select(models.Rating).where(
+        models.Rating.user_id == user_id, models.Rating.book_id == book_id))).scalars().first()
+    if db_rating is None:
+        db_rating = models.Rating(user_id=user_id, book_id=book_id, score=rating.score)
+        db.add(db_rating)
+        await db.run_sync(stats.apply_rating, book_id, rating.score)
+    else:
+        score_delta = rating.score - db_rating.score
+        db_rating.score = rating.score
+        await db.run_sync(stats.apply_rating, book_id, score_delta, 0)
+    await db.run_sync(recommend.mark_dirty, [book_id])
+    await db.commit()
+    stats.invalidate_leaderboards()
+    versions.bump("ratings", [book_id])
+    return db_rating
+
+async def get_ratings_for_book(db: AsyncSession, book_id: int):
+    """Получает все оценки книги"""
+    result = await db.execute(select(models.Rating).where(models.Rating.book_id == book_id))
+    return result.scalars().all()
+
+# --- Genre-to-Book ---
+async def add_genre_to_book(db: AsyncSession, book_id: int, genre_id: int):
+    """Добавляет жанр к книге"""
+    book = await get_book(db, book_id)
+    genre = await db.get(models.Genre, genre_id)
+    if not book or not genre:
+        return None
+    if genre not in book.genres:
+        book.genres.append(genre)
+        await db.run_sync(stats.refresh_genre_stats, [book_id])
+        await db.commit()
+        stats.invalidate_leaderboards()
+        versions.bump("books", [book_id])
+    return book
+
+async def remove_genre_from_book(db: AsyncSession, book_id: int, genre_id: int):
+    """Убирает жанр из книги"""
+    book = await get_book(db, book_id)
+    genre = await db.get(models.Genre, genre_id)
+    if not book or not genre:
+        return None
+    if genre in book.genres:
+        book.genres.remove(genre)
+        await db.run_sync(stats.refresh_genre_stats, [book_id])
+        await db.commit()
+        stats.invalidate_leaderboards()
+        versions.bump("books", [book_id])
+    return book
+
+async def get_book_genres(db: AsyncSession, book_id: int):
+    """Получает все жанры книги"""
+    book = await get_book(db, book_id)
+    return book.genres if book else None
@@ -1,28 +1,321 @@
+"""
+Подключение к БД: писатель (основная БД), пул читателей, реплики и асинхронный движок.
+
+Основная БД — DATABASE_URL (по умолчанию sqlite:///DB_PATH), реплики для чтения — READ_DATABASE_URLS.
+get_write_db отдаёт сессию писателя, get_read_db — сессию реплики (по кругу); клиент, который
+только что писал, READ_YOUR_WRITES_SECONDS читает из основной БД (read-only пул), чтобы видеть
+свои записи, пока реплика отстаёт. Без реплик get_read_db читает read-only пул основной БД.
+
+Движки создаются при первом обращении (database.engine, SessionLocal() и т. п.) или в lifespan
+приложения, а не при импорте: импорт модуля не читает настройки и не трогает файловую систему.
+"""
+
+import itertools
+import math
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-# Путь к БД-файлу
-DB_FOLDER = "data"
-DB_FILENAME = "catalog.db"
-DB_PATH = os.path.join(DB_FOLDER, DB_FILENAME)
+from app import metrics
+from app.config import settings
+
+# Имена, которые появляются в модуле после init_engines (до этого их отдаёт __getattr__)
+_ENGINE_NAMES = ("engine", "read_engine", "replica_engines", "DB_PATH", "DB_FOLDER", "SQLALCHEMY_DATABASE_URL",
+                 "READ_SQLALCHEMY_DATABASE_URL", "ASYNC_SQLALCHEMY_DATABASE_URL")
+_init_lock = threading.RLock()
+_replica_cycle = None
+
+# Cookie read-your-writes: до этого времени (unix time) клиент читает из основной БД
+PRIMARY_UNTIL_COOKIE = "db_primary_until"
+
+
+def database_url() -> str:
+    """URL основной БД из настроек"""
+    return settings.DATABASE_URL or f"sqlite:///{settings.DB_PATH}"
+
+
+def replica_urls() -> list[str]:
+    """URL реплик для чтения (READ_DATABASE_URLS через запятую)"""
+    return [url.strip() for url in settings.READ_DATABASE_URLS.split(",") if url.strip()]
+
+
+def sqlite_path(url: str) -> Optional[str]:
+    """Путь к файлу SQLite из URL; None — другая СУБД или БД в памяти"""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or parsed.database in (None, "", ":memory:"):
+        return None
+    return parsed.database
+
+
+def _read_only_url(url: str) -> str:
+    # SQLite открывается только на чтение: файл не создаётся, запись невозможна
+    path = sqlite_path(url)
+    return url if path is None else f"sqlite:///file:{path}?mode=ro&uri=true"
+
 
-# Создаём папку data, если нет
-os.makedirs(DB_FOLDER, exist_ok=True)
+def sqlite_pragmas(read_only: bool = False) -> list[str]:
+    """PRAGMA из профиля SQLite в Settings, применяются к каждому новому соединению"""
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(settings.SQLITE_BUSY_TIMEOUT)}",
+        f"PRAGMA cache_size = {int(settings.SQLITE_CACHE_SIZE)}",
+        f"PRAGMA mmap_size = {int(settings.SQLITE_MMAP_SIZE)}",
+        f"PRAGMA foreign_keys = {'ON' if settings.SQLITE_FOREIGN_KEYS else 'OFF'}",
+    ]
+    if read_only:
+        # journal_mode хранится в самом файле БД, его выставляет писатель
+        pragmas.append("PRAGMA query_only = ON")
+    else:
+        pragmas += [
+            f"PRAGMA journal_mode = {settings.SQLITE_JOURNAL_MODE}",
+            f"PRAGMA synchronous = {settings.SQLITE_SYNCHRONOUS}",
+        ]
+    return pragmas
 
-# Подключение к SQLite
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+def apply_sqlite_profile(sync_engine, read_only: bool = False):
+    """
+    Вешает применение PRAGMA на событие connect движка (для других СУБД ничего не делает).
+    Транзакции писателя начинаются с BEGIN IMMEDIATE
+    """
+    if sync_engine.dialect.name != "sqlite":
+        return
+    pragmas = sqlite_pragmas(read_only)
+
+    @event.listens_for(sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+        if not read_only:
+            # BEGIN выдаёт событие begin ниже, а не драйвер перед первым изменением
+            dbapi_connection.isolation_level = None
+
+    if not read_only:
+        # Блокировка записи берётся в начале транзакции: писатель другого процесса ждёт busy_timeout
+        # на BEGIN, а не получает "database is locked", когда его транзакция переходит от чтения к записи
+        @event.listens_for(sync_engine, "begin")
+        def _begin_immediate(conn):
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+class _LazySessionmaker(sessionmaker):
+    """sessionmaker, который при первом вызове создаёт движки"""
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            init_engines()
+        return super().__call__(**local_kw)
+
+
+class _ReplicaSessionmaker(_LazySessionmaker):
+    """sessionmaker, который раздаёт реплики по кругу"""
+
+    def __call__(self, **local_kw):
+        if "bind" not in local_kw:
+            init_engines()
+            local_kw["bind"] = next(_replica_cycle)
+        return super().__call__(**local_kw)
+
+
+SessionLocal = _LazySessionmaker(autoflush=False, autocommit=False)
+# Read-only пул основной БД: фоновые задачи и чтение сразу после записи
+ReadSessionLocal = _LazySessionmaker(autoflush=False, autocommit=False)
+# Реплики для чтения в GET-эндпоинтах (без реплик — тот же read-only пул)
+ReplicaSessionLocal = _ReplicaSessionmaker(autoflush=False, autocommit=False)
 
 Base = declarative_base()
 
-def get_db():
+# Асинхронные движки создаются при первом обращении: aiosqlite нужен только в режиме ASYNC_DB
+_async_engine = None
+_async_read_engine = None
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+
+def _create_engine(url: str, pool_size: int, max_overflow: int, name: str, read_only: bool):
+    sqlite = make_url(url).get_backend_name() == "sqlite"
+    created = create_engine(
+        url,
+        connect_args={"check_same_thread": False} if sqlite else {},
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        poolclass=metrics.TimedQueuePool,
+        pool_logging_name=name,
+    )
+    apply_sqlite_profile(created, read_only=read_only)
+    if settings.METRICS_ENABLED:
+        metrics.instrument_engine(created)
+    return created
+
+
+def init_engines():
+    """Создаёт папку БД и движки по текущим настройкам; повторный вызов ничего не делает"""
+    global _replica_cycle
+    with _init_lock:
+        if "engine" in globals():
+            return
+        url = database_url()
+        db_path = sqlite_path(url)
+        db_folder = None
+        if db_path is not None:
+            db_folder = os.path.dirname(db_path) or "."
+            os.makedirs(db_folder, exist_ok=True)
+        urls = {
+            "SQLALCHEMY_DATABASE_URL": url,
+            "READ_SQLALCHEMY_DATABASE_URL": _read_only_url(url),
+            # ASYNC_DB поддерживает только файл SQLite (aiosqlite)
+            "ASYNC_SQLALCHEMY_DATABASE_URL": None if db_path is None else f"sqlite+aiosqlite:///{db_path}",
+        }
+
+        # Писатель: одно соединение, записи выстраиваются в очередь пула, а не ловят "database is locked"
+        writer = _create_engine(url, settings.SQLITE_WRITE_POOL_SIZE, 0, "write", read_only=False)
+        # Читатели: отдельный пул read-only соединений основной БД (в WAL не блокируются писателем)
+        reader = _create_engine(urls["READ_SQLALCHEMY_DATABASE_URL"], settings.SQLITE_READ_POOL_SIZE,
+                                settings.SQLITE_READ_POOL_SIZE, "read", read_only=True)
+        replicas = [
+            _create_engine(_read_only_url(replica_url), settings.SQLITE_READ_POOL_SIZE,
+                           settings.SQLITE_READ_POOL_SIZE, f"replica{number}", read_only=True)
+            for number, replica_url in enumerate(replica_urls())
+        ] or [reader]
+        SessionLocal.configure(bind=writer)
+        ReadSessionLocal.configure(bind=reader)
+        _replica_cycle = itertools.cycle(replicas)
+        # engine публикуется последним: по нему init_engines понимает, что всё готово
+        globals().update(urls, DB_PATH=db_path, DB_FOLDER=db_folder, read_engine=reader,
+                         replica_engines=replicas, engine=writer)
+
+
+def dispose_engines():
+    """Закрывает пулы и забывает движки: следующее обращение создаст их по текущим настройкам"""
+    global _async_engine, _async_read_engine
+    with _init_lock:
+        for replica in globals().get("replica_engines", ()):
+            replica.dispose()
+        for name in ("engine", "read_engine"):
+            if name in globals():
+                globals()[name].dispose()
+        for name in _ENGINE_NAMES:
+            globals().pop(name, None)
+        SessionLocal.kw.pop("bind", None)
+        ReadSessionLocal.kw.pop("bind", None)
+        async_engines = (_async_engine, _async_read_engine)
+        _async_engine = _async_read_engine = None
+    for async_engine in async_engines:
+        if async_engine is not None:
+            async_engine.sync_engine.dispose()
+
+
+def __getattr__(name: str):
+    if name in _ENGINE_NAMES:
+        init_engines()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def reads_from_primary(request: Request) -> bool:
+    """Клиент недавно писал (cookie PRIMARY_UNTIL_COOKIE не истекла) — читать из основной БД"""
+    until = request.cookies.get(PRIMARY_UNTIL_COOKIE)
+    if until is None:
+        return False
+    try:
+        return float(until) > time.time()
+    except ValueError:
+        return False
+
+
+def mark_written(response: Response):
+    """Клиент пишет: следующие READ_YOUR_WRITES_SECONDS секунд его чтения идут в основную БД"""
+    if settings.READ_DATABASE_URLS and settings.READ_YOUR_WRITES_SECONDS > 0:
+        seconds = settings.READ_YOUR_WRITES_SECONDS
+        response.set_cookie(PRIMARY_UNTIL_COOKIE, f"{time.time() + seconds:.3f}",
+                            max_age=math.ceil(seconds), httponly=True, samesite="lax")
+
+
+def get_write_db(response: Response):
+    """Сессия писателя для эндпоинтов, которые меняют данные"""
+    mark_written(response)
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+# Прежнее имя get_write_db
+get_db = get_write_db
+
+def get_read_db(request: Request):
+    """Сессия для эндпоинтов, которые только читают: реплика или, сразу после записи клиента, основная БД"""
+    db = ReadSessionLocal() if reads_from_primary(request) else ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_primary_read_db():
+    """
+    Read-only сессия основной БД для ответов с ETag: версии app/versions.py описывают основную БД,
+    и отстающая реплика отдала бы старые данные под новым ETag
+    """
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def _create_async_engine(read_only: bool):
+    init_engines()
+    url = globals()["ASYNC_SQLALCHEMY_DATABASE_URL"]
+    if url is None:
+        raise RuntimeError("ASYNC_DB поддерживает только DATABASE_URL с файлом SQLite")
+    if read_only:
+        url = f"sqlite+aiosqlite:///file:{globals()['DB_PATH']}?mode=ro&uri=true"
+    # Писатель — одно соединение (SQLITE_WRITE_POOL_SIZE), как у синхронного
+    pool_size, max_overflow = (settings.SQLITE_READ_POOL_SIZE, settings.SQLITE_READ_POOL_SIZE) if read_only \
+        else (settings.SQLITE_WRITE_POOL_SIZE, 0)
+    created = create_async_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        poolclass=metrics.TimedAsyncQueuePool,
+        pool_logging_name="async_read" if read_only else "async_write",
+    )
+    apply_sqlite_profile(created.sync_engine, read_only=read_only)
+    if settings.METRICS_ENABLED:
+        metrics.instrument_engine(created.sync_engine)
+    return created
+
+def get_async_engine():
+    """Асинхронный движок писателя (AsyncEngine + aiosqlite): одно соединение, как у синхронного"""
+    global _async_engine
+    with _init_lock:
+        if _async_engine is None:
+            _async_engine = _create_async_engine(read_only=False)
+        return _async_engine
+
+def get_async_read_engine():
+    """Асинхронный движок read-only пула основной БД"""
+    global _async_read_engine
+    with _init_lock:
+        if _async_read_engine is None:
+            _async_read_engine = _create_async_engine(read_only=True)
+        return _async_read_engine
+
+async def get_async_write_db(response: Response):
+    """Асинхронная сессия писателя для эндпоинтов, которые меняют данные"""
+    mark_written(response)
+    async with AsyncSessionLocal(bind=get_async_engine()) as db:
+        yield db
+
+async def get_async_read_db():
+    """Асинхронная read-only сессия для эндпоинтов, которые только читают"""
+    async with AsyncSessionLocal(bind=get_async_read_engine()) as db:
+        yield db
@@ -0,0 +1,103 @@
+"""
+Потоковая выгрузка каталога (GET /books/export) в NDJSON или CSV.
+Книги читаются пачками по keyset (id больше последнего), авторы и жанры
+подгружаются отдельным запросом на пачку, поэтому память не зависит от размера каталога.
+"""
+
+import csv
+import io
+import zlib
+from typing import Iterator
+
+from sqlalchemy import select
+
+from app import crud, models
+from app.database import ReplicaSessionLocal
+from app.fastjson import dumps
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+EXPORT_BATCH_SIZE = 1000
+CSV_COLUMNS = ("id", "title", "description", "authors", "genres")
+
+
+def iter_book_batches(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[list[dict]]:
+    """
+    Пачки книг в форме BookRead. Сессия своя (на реплике), а не из Depends:
+    ответ отдаётся уже после закрытия сессий зависимостей. Каждая пачка читается в своей
+    транзакции и соединение возвращается в пул до yield, поэтому медленный или отключившийся
+    клиент не держит снимок WAL (и не мешает checkpoint)
+    """
+    db = ReplicaSessionLocal()
+    after = None
+    try:
+        while True:
+            query = select(models.Book.id, models.Book.title, models.Book.description) \
+                .order_by(models.Book.id).limit(batch_size)
+            if after is not None:
+                query = query.where(models.Book.id > after)
+            rows = db.execute(query).all()
+            if not rows:
+                return
+            book_ids = [row.id for row in rows]
+            authors = crud.get_related_rows(db, models.book_author_table, "author_id", models.Author, book_ids)
+            genres = crud.get_related_rows(db, models.book_genre_table, "genre_id", models.Genre, book_ids)
+            db.close()
+            yield [
+                {
+                    "title": row.title,
+                    "description": row.description,
+                    "id": row.id,
+                    "authors": authors.get(row.id, []),
+                    "genres": genres.get(row.id, []),
+                }
+                for row in rows
+            ]
+            if len(rows) < batch_size:
+                return
+            after = rows[-1].id
+    finally:
+        db.close()
+
+
+def ndjson_chunks(batches: Iterator[list[dict]]) -> Iterator[bytes]:
+    """Одна книга — одна строка JSON"""
+    for books in batches:
+        yield b"".join(dumps(book) + b"\n" for book in books)
+
+
+def csv_chunks(batches: Iterator[list[dict]]) -> Iterator[bytes]:
+    """CSV с заголовком; авторы и жанры — имена через "/", как в books.csv"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+    for books in batches:
+        for book in books:
+            writer.writerow((
+                book["id"],
+                book["title"],
+                book["description"] or "",
+                "/".join(author["name"] for author in book["authors"]),
+                "/".join(genre["name"] for genre in book["genres"]),
+            ))
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def gzip_chunks(chunks: Iterator[bytes], level: int = 6) -> Iterator[bytes]:
+    """Сжимает поток в gzip; каждая пачка сбрасывается, чтобы клиент получал данные сразу"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_books(fmt: str, gzip: bool = False, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """Поток байтов выгрузки в формате fmt (ndjson или csv)"""
+    encode = ndjson_chunks if fmt == "ndjson" else csv_chunks
+    chunks = encode(iter_book_batches(batch_size))
+    return gzip_chunks(chunks) if gzip else chunks
@@ -0,0 +1,35 @@
+"""
+Быстрый JSON-ответ для списочных эндпоинтов (настройка FAST_JSON).
+Строки из БД уже имеют форму схемы ответа, поэтому кодируются сразу в байты,
+минуя валидацию через Pydantic и jsonable_encoder. Если orjson не установлен —
+используется стандартный json с теми же параметрами, что у JSONResponse.
+"""
+
+import json
+from typing import Any
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Кодирует словари и списки в JSON-байты"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """
+    Ответ из готовых словарей. Эндпоинт при этом сохраняет response_model,
+    так что схема OpenAPI не меняется; проверка формы ответа — на тестах
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,64 @@
+"""Ограниченный пул для bcrypt: хэширование и проверка паролей вне event loop"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class HashingPoolBusy(Exception):
+    """Все воркеры заняты и очередь ожидания заполнена"""
+
+
+class HashingPool:
+    """
+    Пул потоков фиксированного размера с ограниченной очередью.
+    bcrypt отпускает GIL на время вычисления, поэтому потоки дают реальный параллелизм.
+    Если занято workers + queue_depth мест, задача сразу отклоняется (HashingPoolBusy),
+    а не копится в очереди, занимая потоки веб-сервера.
+    """
+
+    def __init__(self, workers: int, queue_depth: int):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Выполняет fn(*args) в пуле; при переполнении — HashingPoolBusy"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingPoolBusy()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Место освобождается, когда задача закончилась в пуле, а не когда ожидающий запрос отменён
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future=None):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        """Загрузка пула"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        """Останавливает потоки пула (начатые задачи доделываются)"""
+        self._executor.shutdown(wait=False)
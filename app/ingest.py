@@ -0,0 +1,142 @@
+"""
+Пакетная запись оценок (group commit) для POST /books/{id}/rate при RATING_INGEST=true.
+
+Запрос проверяет оценку, ставит её в очередь и ждёт подтверждения. Фоновый поток-писатель
+забирает из очереди до RATING_INGEST_BATCH_SIZE оценок (или сколько накопилось за
+RATING_INGEST_MAX_DELAY секунд с первой) и пишет их одной транзакцией crud.create_ratings_batch:
+один commit на пачку вместо commit + refresh на каждую оценку. Ответ уходит только после
+commit пачки, поэтому подтверждённая оценка так же долговечна, как при обычной записи.
+Если пачка не записалась, её оценки пишутся по одной: ошибка одной не роняет остальные.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+from app import crud, database, metrics
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class IngestQueueFull(Exception):
+    """Очередь пакетной записи заполнена"""
+
+
+class RatingIngestor:
+    """Очередь оценок и поток-писатель, который фиксирует их пачками"""
+
+    def __init__(self, batch_size: int, max_delay: float, queue_depth: int, session_factory=None):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._session_factory = session_factory or database.SessionLocal
+        # (id пользователя, id книги, оценка, future, время постановки)
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_depth)
+        self._thread = threading.Thread(target=self._run, name="rating-ingest", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id: int, book_id: int, score: float) -> Future:
+        """Ставит оценку в очередь; future — оценка в форме RatingRead (None — книги нет) после commit"""
+        future = Future()
+        try:
+            self._queue.put_nowait((user_id, book_id, score, future, time.perf_counter()))
+        except queue.Full:
+            metrics.INGEST_REJECTED.inc()
+            raise IngestQueueFull() from None
+        metrics.INGEST_QUEUE_DEPTH.set(self._queue.qsize())
+        return future
+
+    async def rate(self, user_id: int, book_id: int, score: float) -> Optional[dict]:
+        """submit для async-эндпоинта: ожидание не занимает поток"""
+        return await asyncio.wrap_future(self.submit(user_id, book_id, score))
+
+    def stop(self, timeout: float = 10.0):
+        """Дописывает уже принятые оценки и останавливает писателя"""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _collect(self) -> tuple[list, bool]:
+        """Пачка из очереди и признак остановки"""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            metrics.INGEST_QUEUE_DEPTH.set(self._queue.qsize())
+            # Оценки, чей запрос уже отменён (клиент ушёл), не пишутся
+            batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+            if batch:
+                self._flush(batch)
+
+    def _write(self, items: list[tuple[int, int, float]]) -> list[Optional[dict]]:
+        db = self._session_factory()
+        try:
+            return crud.create_ratings_batch(db, items)
+        finally:
+            db.close()
+
+    def _flush(self, batch: list):
+        started = time.perf_counter()
+        try:
+            outcomes = [(result, None) for result in self._write([item[:3] for item in batch])]
+        except Exception:
+            logger.exception("Пачка из %s оценок не записана, запись по одной", len(batch))
+            outcomes = []
+            for item in batch:
+                try:
+                    outcomes.append((self._write([item[:3]])[0], None))
+                except Exception as error:
+                    outcomes.append((None, error))
+        finished = time.perf_counter()
+        metrics.INGEST_BATCH_SIZE.observe(len(batch))
+        metrics.INGEST_FLUSH_SECONDS.observe(finished - started)
+        for item, (result, error) in zip(batch, outcomes):
+            metrics.INGEST_ACK_SECONDS.observe(finished - item[4])
+            if error is None:
+                item[3].set_result(result)
+            else:
+                item[3].set_exception(error)
+
+
+_lock = threading.Lock()
+_ingestor: Optional[RatingIngestor] = None
+
+
+def get_ingestor() -> RatingIngestor:
+    """Писатель по текущим настройкам; запускается при первом обращении (обычно в lifespan)"""
+    global _ingestor
+    with _lock:
+        if _ingestor is None:
+            _ingestor = RatingIngestor(settings.RATING_INGEST_BATCH_SIZE, settings.RATING_INGEST_MAX_DELAY,
+                                       settings.RATING_INGEST_QUEUE_DEPTH)
+        return _ingestor
+
+
+def stop():
+    """Останавливает писателя, дописав очередь (остановка приложения)"""
+    global _ingestor
+    with _lock:
+        ingestor, _ingestor = _ingestor, None
+    if ingestor is not None:
+        ingestor.stop()
@@ -1,64 +1,129 @@
 """Основной модуль приложения FastAPI для управления книгами, жанрами, рейтингами и пользователями."""
 
-from typing import List, Optional, Dict
+import asyncio
+import contextlib
+from typing import List, Literal, Optional, Dict
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm, HTTPBasic
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from app import auth, models, schemas, crud, stats
+from app import (
+    auth, models, schemas, crud, stats, search, export, versions, migrations, metrics, querybudget,
+    recommend, database, config, coherence, ingest, admission,
+)
 from app.auth import get_current_user
-from app.database import engine, SessionLocal
+from app.config import Settings, settings
+from app.database import get_primary_read_db, get_read_db, get_write_db
+from app.fastjson import FastJSONResponse
 
-# Создание экземпляра приложения FastAPI
-app = FastAPI()
 
-# Создание таблиц при запуске
-models.Base.metadata.create_all(bind=engine)
+# Маршруты синхронного режима; приложение собирает create_app
+router = APIRouter()
 
 # Для Basic Auth (логин/пароль)
 security = HTTPBasic()
 
 
-def get_db():
-    """Получение сессии базы данных."""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-@app.get("/")
+@router.get("/")
 def root():
     """Корневой эндпоинт, проверка готовности приложения."""
     return {"message": "Схема БД и связи готовы!"}
 
 
 # --- Books ---
-@app.post("/books/", response_model=schemas.BookRead)
-def create_book(book: schemas.BookCreate, db: Session = Depends(get_db)):
+@router.post("/books/", response_model=schemas.BookRead)
+def create_book(book: schemas.BookCreate, db: Session = Depends(get_write_db)):
     """Создать книгу."""
     return crud.create_book(db, book)
 
 
-@app.get("/books/", response_model=List[schemas.BookRead])
-def read_books(db: Session = Depends(get_db)):
-    """Получить список всех книг."""
-    return crud.get_all_books(db)
+@router.post("/books/bulk", response_model=schemas.BulkResult)
+def create_books_bulk(payload: schemas.BookBulkCreate, db: Session = Depends(get_write_db)):
+    """Создать книги пачкой в одной транзакции, с результатом по каждой."""
+    return crud.create_books_bulk(db, payload.items)
+
+
+@router.post("/books/genres/bulk", response_model=schemas.BulkResult)
+def link_genres_bulk(payload: schemas.BookGenreBulk, db: Session = Depends(get_write_db)):
+    """Привязать жанры к книгам пачкой."""
+    return crud.add_genres_to_books_bulk(db, payload.items)
 
 
-@app.get("/books/{book_id}", response_model=schemas.BookRead)
-def read_book(book_id: int, db: Session = Depends(get_db)):
-    """Получить книгу по ID."""
+@router.get("/books/", response_model=schemas.BookPage)
+def read_books(
+    limit: int = Query(schemas.BOOKS_PAGE_DEFAULT, ge=1, le=schemas.BOOKS_PAGE_MAX),
+    after: Optional[int] = Query(None, ge=0, description="ID последней книги предыдущей страницы"),
+    author_id: Optional[int] = Query(None, description="Только книги автора"),
+    genre_id: Optional[int] = Query(None, description="Только книги жанра"),
+    min_rating: Optional[float] = Query(None, description="Средняя оценка не ниже"),
+    title_prefix: Optional[str] = Query(
+        None, min_length=1, max_length=200, description="Начало названия (без учёта регистра латиницы)"),
+    sort: schemas.BookSort = Query("id", description="id, title или rating (по убыванию средней оценки)"),
+    facets: bool = Query(False, description="Счётчики по жанрам, авторам и диапазонам оценок для выборки"),
+    db: Session = Depends(get_read_db)
+):
+    """Получить страницу книг с фильтрами (keyset-пагинация: after — ID последней книги)."""
+    filters = schemas.BookFilter(
+        author_id=author_id, genre_id=genre_id, min_rating=min_rating, title_prefix=title_prefix)
+    book_facets = crud.get_book_facets(db, filters) if facets else None
+    if settings.FAST_JSON:
+        page = crud.get_books_page_rows(db, limit=limit, after=after, filters=filters, sort=sort)
+        if not page["items"] and crud.books_cursor_missing(db, after, sort):
+            raise HTTPException(status_code=400, detail="Книги курсора after уже нет, начните с первой страницы")
+        return FastJSONResponse({**page, "facets": book_facets})
+    books, next_cursor = crud.get_books_page(db, limit=limit, after=after, filters=filters, sort=sort)
+    if not books and crud.books_cursor_missing(db, after, sort):
+        raise HTTPException(status_code=400, detail="Книги курсора after уже нет, начните с первой страницы")
+    return {"items": books, "next_cursor": next_cursor, "facets": book_facets}
+
+
+@router.get("/books/search", response_model=schemas.BookSearchPage)
+def search_books(
+    q: str = Query(..., min_length=1, max_length=200, description="Слова из названия, описания или имён авторов"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    db: Session = Depends(get_read_db)
+):
+    """Полнотекстовый поиск книг (FTS5, ранжирование BM25)."""
+    books, next_offset = search.search_books(db, q, limit=limit, offset=offset)
+    return {"items": books, "next_offset": next_offset}
+
+
+@router.get("/books/export")
+def export_books(
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="ndjson — книга на строку, csv — с заголовком"),
+    gzip: bool = Query(False, description="Сжать поток (Content-Encoding: gzip)"),
+):
+    """Потоковая выгрузка всего каталога с авторами и жанрами."""
+    headers = {"Content-Disposition": f'attachment; filename="books.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export.export_books(format, gzip=gzip),
+        media_type=export.EXPORT_MEDIA_TYPES[format],
+        headers=headers,
+    )
+
+
+@router.get("/books/{book_id}", response_model=schemas.BookRead)
+def read_book(book_id: int, request: Request, response: Response, db: Session = Depends(get_primary_read_db)):
+    """Получить книгу по ID (поддерживает If-None-Match / If-Modified-Since)."""
+    validator = versions.book_validator(book_id)
+    if validator.is_fresh(request):
+        return validator.not_modified()
     db_book = crud.get_book(db, book_id)
     if db_book is None:
         raise HTTPException(status_code=404, detail="Книга не найдена")
+    response.headers.update(validator.headers())
     return db_book
 
 
-@app.put("/books/{book_id}", response_model=schemas.BookRead)
-def update_book(book_id: int, book: schemas.BookCreate, db: Session = Depends(get_db)):
+@router.put("/books/{book_id}", response_model=schemas.BookRead)
+def update_book(book_id: int, book: schemas.BookCreate, db: Session = Depends(get_write_db)):
     """Обновить книгу по ID."""
     db_book = crud.update_book(db, book_id, book)
     if not db_book:
@@ -66,8 +131,8 @@ def update_book(book_id: int, book: schemas.BookCreate, db: Session = Depends(ge
     return db_book
 
 
-@app.delete("/books/{book_id}", response_model=schemas.BookRead)
-def delete_book(book_id: int, db: Session = Depends(get_db)):
+@router.delete("/books/{book_id}", response_model=schemas.BookRead)
+def delete_book(book_id: int, db: Session = Depends(get_write_db)):
     """Удалить книгу по ID."""
     db_book = crud.delete_book(db, book_id)
     if not db_book:
@@ -75,36 +140,59 @@ def delete_book(book_id: int, db: Session = Depends(get_db)):
     return db_book
 
 
-@app.get("/books/{book_id}/ratings", response_model=List[schemas.RatingRead])
-def get_ratings(book_id: int, db: Session = Depends(get_db)):
+@router.get("/books/{book_id}/ratings", response_model=List[schemas.RatingRead])
+def get_ratings(book_id: int, db: Session = Depends(get_read_db)):
     """Получить все рейтинги книги."""
     return crud.get_ratings_for_book(db, book_id)
 
 
+@router.get("/books/{book_id}/similar", response_model=List[schemas.BookRecommendation])
+def get_similar_books(
+    book_id: int,
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    """Похожие книги по оценкам читателей (предрассчитанные соседи, см. app/recommend.py)."""
+    similar = recommend.get_similar(db, book_id, limit=limit)
+    if similar is None:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    return similar
+
+
 # --- Genres ---
-@app.post("/genres/", response_model=schemas.GenreRead)
-def create_genre(genre: schemas.GenreCreate, db: Session = Depends(get_db)):
+@router.post("/genres/", response_model=schemas.GenreRead)
+def create_genre(genre: schemas.GenreCreate, db: Session = Depends(get_write_db)):
     """Создать жанр."""
     return crud.create_genre(db, genre)
 
 
-@app.get("/genres/", response_model=List[schemas.GenreRead])
-def read_genres(db: Session = Depends(get_db)):
-    """Получить все жанры."""
+@router.get("/genres/", response_model=List[schemas.GenreRead])
+def read_genres(request: Request, response: Response, db: Session = Depends(get_primary_read_db)):
+    """Получить все жанры (поддерживает If-None-Match / If-Modified-Since)."""
+    validator = versions.validator(("genres", None))
+    if validator.is_fresh(request):
+        return validator.not_modified()
+    if settings.FAST_JSON:
+        return FastJSONResponse(crud.get_all_genres_rows(db), headers=validator.headers())
+    response.headers.update(validator.headers())
     return crud.get_all_genres(db)
 
 
-@app.get("/genres/{genre_id}", response_model=schemas.GenreRead)
-def read_genre(genre_id: int, db: Session = Depends(get_db)):
+@router.get("/genres/{genre_id}", response_model=schemas.GenreRead)
+def read_genre(genre_id: int, request: Request, response: Response, db: Session = Depends(get_primary_read_db)):
     """Получить жанр по ID."""
+    validator = versions.validator(("genres", genre_id))
+    if validator.is_fresh(request):
+        return validator.not_modified()
     genre = crud.get_genre(db, genre_id)
     if not genre:
         raise HTTPException(status_code=404, detail="Жанр не найден")
+    response.headers.update(validator.headers())
     return genre
 
 
-@app.put("/genres/{genre_id}", response_model=schemas.GenreRead)
-def update_genre(genre_id: int, genre: schemas.GenreCreate, db: Session = Depends(get_db)):
+@router.put("/genres/{genre_id}", response_model=schemas.GenreRead)
+def update_genre(genre_id: int, genre: schemas.GenreCreate, db: Session = Depends(get_write_db)):
     """Обновить жанр по ID."""
     db_genre = crud.update_genre(db, genre_id, genre)
     if not db_genre:
@@ -112,8 +200,8 @@ def update_genre(genre_id: int, genre: schemas.GenreCreate, db: Session = Depend
     return db_genre
 
 
-@app.delete("/genres/{genre_id}", response_model=schemas.GenreRead)
-def delete_genre(genre_id: int, db: Session = Depends(get_db)):
+@router.delete("/genres/{genre_id}", response_model=schemas.GenreRead)
+def delete_genre(genre_id: int, db: Session = Depends(get_write_db)):
     """Удалить жанр по ID."""
     db_genre = crud.delete_genre(db, genre_id)
     if not db_genre:
@@ -122,8 +210,8 @@ def delete_genre(genre_id: int, db: Session = Depends(get_db)):
 
 
 # --- Genre-to-book ---
-@app.post("/books/{book_id}/genres/{genre_id}", response_model=schemas.BookRead)
-def link_genre(book_id: int, genre_id: int, db: Session = Depends(get_db)):
+@router.post("/books/{book_id}/genres/{genre_id}", response_model=schemas.BookRead)
+def link_genre(book_id: int, genre_id: int, db: Session = Depends(get_write_db)):
     """Привязать жанр к книге."""
     result = crud.add_genre_to_book(db, book_id, genre_id)
     if not result:
@@ -131,8 +219,8 @@ def link_genre(book_id: int, genre_id: int, db: Session = Depends(get_db)):
     return result
 
 
-@app.delete("/books/{book_id}/genres/{genre_id}", response_model=schemas.BookRead)
-def unlink_genre(book_id: int, genre_id: int, db: Session = Depends(get_db)):
+@router.delete("/books/{book_id}/genres/{genre_id}", response_model=schemas.BookRead)
+def unlink_genre(book_id: int, genre_id: int, db: Session = Depends(get_write_db)):
     """Отвязать жанр от книги."""
     result = crud.remove_genre_from_book(db, book_id, genre_id)
     if not result:
@@ -140,8 +228,8 @@ def unlink_genre(book_id: int, genre_id: int, db: Session = Depends(get_db)):
     return result
 
 
-@app.get("/books/{book_id}/genres", response_model=List[schemas.GenreRead])
-def get_book_genres(book_id: int, db: Session = Depends(get_db)):
+@router.get("/books/{book_id}/genres", response_model=List[schemas.GenreRead])
+def get_book_genres(book_id: int, db: Session = Depends(get_read_db)):
     """Получить жанры книги."""
     genres = crud.get_book_genres(db, book_id)
     if genres is None:
@@ -150,95 +238,310 @@ def get_book_genres(book_id: int, db: Session = Depends(get_db)):
 
 
 # --- Ratings ---
-@app.post("/books/{book_id}/rate", response_model=schemas.RatingRead)
+@router.post("/books/{book_id}/rate", response_model=schemas.RatingRead)
 def rate_book(
     book_id: int,
     rating: schemas.RatingCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: Session = Depends(get_write_db),
+    current_user: auth.UserPrincipal = Depends(get_current_user)
 ):
     """Оценить книгу от имени текущего пользователя."""
-    return crud.create_rating(db, user_id=current_user.id, book_id=book_id, rating=rating)
+    db_rating = crud.create_rating(db, user_id=current_user.id, book_id=book_id, rating=rating)
+    if db_rating is None:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    return db_rating
+
+
+async def rate_book_batched(
+    book_id: int,
+    rating: schemas.RatingCreate,
+    response: Response,
+    current_user: auth.UserPrincipal = Depends(get_current_user)
+):
+    """Оценить книгу: оценка пишется пачкой с другими (RATING_INGEST), ответ — после commit пачки."""
+    database.mark_written(response)
+    try:
+        db_rating = await ingest.get_ingestor().rate(current_user.id, book_id, rating.score)
+    except ingest.IngestQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Очередь записи оценок переполнена, повторите позже",
+            headers={"Retry-After": str(settings.RATING_INGEST_RETRY_AFTER)},
+        )
+    if db_rating is None:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    return db_rating
+
+
+@router.post("/ratings/bulk", response_model=schemas.BulkResult)
+def rate_books_bulk(
+    payload: schemas.RatingBulkCreate,
+    db: Session = Depends(get_write_db),
+    current_user: auth.UserPrincipal = Depends(get_current_user)
+):
+    """Оценить много книг от имени текущего пользователя одним запросом."""
+    return crud.create_ratings_bulk(db, user_id=current_user.id, ratings=payload.items)
 
 
 # --- Users ---
-@app.post("/register", response_model=schemas.UserRead)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+# bcrypt выполняется в ограниченном пуле auth.hashing_pool (при переполнении — 503),
+# запросы к БД — в threadpool, поэтому эндпоинты асинхронные. Пользователь ищется в read-only
+# пуле основной БД, а сессия писателя (одно соединение) открывается только после хэширования
+def _create_user(user: schemas.UserCreate, hashed_pw: str):
+    db = database.SessionLocal()
+    try:
+        return crud.create_user(db, user, hashed_pw)
+    except IntegrityError:
+        # Имя заняли, пока считался bcrypt: проверку до хэширования прошли оба запроса
+        return None
+    finally:
+        db.close()
+
+
+def _save_password_hash(user_id: int, hashed_pw: str):
+    db = database.SessionLocal()
+    try:
+        user = db.get(models.User, user_id)
+        if user is not None:
+            crud.update_password_hash(db, user, hashed_pw)
+    finally:
+        db.close()
+
+
+@router.post("/register", response_model=schemas.UserRead)
+async def register(user: schemas.UserCreate, response: Response, db: Session = Depends(get_primary_read_db)):
     """Зарегистрировать нового пользователя."""
-    existing_user = db.query(models.User).filter(models.User.username == user.username).first()
+    existing_user = await run_in_threadpool(crud.get_user_by_username, db, user.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="Пользователь уже существует")
 
-    hashed_pw = auth.get_password_hash(user.password)
-    new_user = models.User(username=user.username, hashed_password=hashed_pw)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
+    hashed_pw = await auth.get_password_hash_async(user.password)
+    database.mark_written(response)
+    db_user = await run_in_threadpool(_create_user, user, hashed_pw)
+    if db_user is None:
+        raise HTTPException(status_code=400, detail="Пользователь уже существует")
+    return db_user
 
 
-@app.post("/token", response_model=schemas.Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post("/token", response_model=schemas.Token)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_primary_read_db)):
     """Получить токен по логину и паролю."""
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    user = await run_in_threadpool(crud.get_user_by_username, db, form_data.username)
+    if not user:
         raise HTTPException(status_code=401, detail="Неверные учетные данные")
+    verified, new_hash = await auth.verify_password_async(form_data.password, user.hashed_password)
+    if not verified:
+        raise HTTPException(status_code=401, detail="Неверные учетные данные")
+    user_id = user.id
+    if new_hash:
+        await run_in_threadpool(_save_password_hash, user_id, new_hash)
 
-    token = auth.create_access_token({"sub": str(user.id)})
+    token = auth.create_access_token({"sub": str(user_id)})
     return {"access_token": token, "token_type": "bearer"}
 
 
-@app.get("/me", response_model=schemas.UserRead)
-def get_me(current_user: models.User = Depends(auth.get_current_user)):
+@router.get("/me", response_model=schemas.UserRead)
+def get_me(current_user: auth.UserPrincipal = Depends(auth.get_current_user)):
     """Получить информацию о текущем пользователе."""
     return current_user
 
 
-@app.get("/stats/top-books")
-def stats_top_books(db: Session = Depends(get_db)):
+@router.get("/me/recommendations", response_model=List[schemas.BookRecommendation])
+def get_my_recommendations(
+    limit: int = Query(10, ge=1, le=100),
+    current_user: auth.UserPrincipal = Depends(auth.get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """Рекомендации по оценкам текущего пользователя; без оценок — топ книг."""
+    return recommend.get_user_recommendations(db, current_user.id, limit=limit)
+
+
+@router.get("/stats/top-books")
+def stats_top_books(
+    limit: int = Query(3, ge=1, le=100),
+    genre: Optional[str] = Query(None, description="Название жанра: топ внутри жанра"),
+    min_ratings: int = Query(1, ge=1, description="Минимальное число оценок у книги"),
+    rank: Literal["weighted", "average"] = Query(
+        "weighted", description="weighted — байесовское среднее, average — простое среднее"),
+    db: Session = Depends(get_primary_read_db)  # кэш лидербордов общий: не заполнять его с отстающей реплики
+):
+    """Топ книг и авторов по рейтингу (через кэш лидербордов)."""
     return {
-        "top_books": stats.get_top_books(db),
-        "top_authors": stats.get_top_authors(db)
+        "top_books": stats.cached_top_books(db, limit=limit, genre=genre, min_ratings=min_ratings, rank=rank),
+        "top_authors": stats.cached_top_authors(db, limit=limit)
     }
 
-@app.get("/stats/top-authors")
-def stats_top_authors(db: Session = Depends(get_db)):
+@router.get("/stats/top-authors")
+def stats_top_authors(limit: int = Query(3, ge=1, le=100), db: Session = Depends(get_primary_read_db)):
+    """Топ авторов и книг по рейтингу (через кэш лидербордов)."""
     return {
-        "top_books": stats.get_top_books(db),
-        "top_authors": stats.get_top_authors(db)
+        "top_books": stats.cached_top_books(db, limit=limit),
+        "top_authors": stats.cached_top_authors(db, limit=limit)
     }
 
+@router.get("/stats/cache")
+def stats_cache():
+    """Счётчики кэша лидербордов (попадания, промахи, вытеснения)."""
+    return stats.leaderboard_cache.stats()
+
+@router.get("/stats/summary")
+def stats_summary(
+    fresh: bool = Query(False, description="Дождаться снимка текущего поколения записей"),
+    db: Session = Depends(get_primary_read_db)  # снимок помечается поколением записей основной БД
+):
+    """Аналитический снимок: распределение оценок, перцентили по жанрам, авторы, оценки на книгу."""
+    from app import analytics  # pandas загружается при первом запросе, а не при старте воркера
+    return analytics.get_summary(db, fresh=fresh)
+
+
+@router.get("/stats/admission")
+async def stats_admission(request: Request):
+    """Admission control: занятые слоты, очереди, отказы и ведра клиентов по классам маршрутов."""
+    # async: отвечает без потока из threadpool, даже когда записи его заняли
+    controller = getattr(request.app.state, "admission", None)
+    return controller.stats() if controller else {"enabled": False}
+
+
+def read_metrics():
+    """Метрики в формате Prometheus (GET /metrics при METRICS_ENABLED)."""
+    return metrics.metrics_response()
+
 # --- Authors ---
-@app.post("/authors/", response_model=schemas.AuthorRead)
-def create_author(author: schemas.AuthorCreate, db: Session = Depends(get_db)):
+@router.post("/authors/", response_model=schemas.AuthorRead)
+def create_author(author: schemas.AuthorCreate, db: Session = Depends(get_write_db)):
     """Создать автора"""
     return crud.create_author(db, author)
 
-@app.get("/authors/", response_model=List[schemas.AuthorRead])
-def read_authors(db: Session = Depends(get_db)):
-    """Считать всех авторов"""
+@router.get("/authors/", response_model=List[schemas.AuthorRead])
+def read_authors(request: Request, response: Response, db: Session = Depends(get_primary_read_db)):
+    """Считать всех авторов (поддерживает If-None-Match / If-Modified-Since)"""
+    validator = versions.validator(("authors", None))
+    if validator.is_fresh(request):
+        return validator.not_modified()
+    if settings.FAST_JSON:
+        return FastJSONResponse(crud.get_all_authors_rows(db), headers=validator.headers())
+    response.headers.update(validator.headers())
     return crud.get_all_authors(db)
 
-@app.get("/authors/{author_id}", response_model=schemas.AuthorRead)
-def read_author(author_id: int, db: Session = Depends(get_db)):
+@router.get("/authors/{author_id}", response_model=schemas.AuthorRead)
+def read_author(author_id: int, request: Request, response: Response, db: Session = Depends(get_primary_read_db)):
     """Получить автора по id"""
+    validator = versions.validator(("authors", author_id))
+    if validator.is_fresh(request):
+        return validator.not_modified()
     author = crud.get_author(db, author_id)
     if not author:
         raise HTTPException(status_code=404, detail="Автор не найден")
+    response.headers.update(validator.headers())
     return author
 
-@app.put("/authors/{author_id}", response_model=schemas.AuthorRead)
-def update_author(author_id: int, author: schemas.AuthorCreate, db: Session = Depends(get_db)):
+@router.put("/authors/{author_id}", response_model=schemas.AuthorRead)
+def update_author(author_id: int, author: schemas.AuthorCreate, db: Session = Depends(get_write_db)):
     """Обновить автора"""
     db_author = crud.update_author(db, author_id, author)
     if db_author is None:
         raise HTTPException(status_code=404, detail="Author not found")
     return db_author
 
-@app.delete("/authors/{author_id}", response_model=schemas.AuthorRead)
-def delete_author(author_id: int, db: Session = Depends(get_db)):
+@router.delete("/authors/{author_id}", response_model=schemas.AuthorRead)
+def delete_author(author_id: int, db: Session = Depends(get_write_db)):
     """Удалить автора"""
     db_author = crud.delete_author(db, author_id)
     if db_author is None:
         raise HTTPException(status_code=404, detail="Author not found")
     return db_author
+
+
+# --- Приложение ---
+def prepare_database():
+    """Движки и схема БД: создание таблиц, миграции, поисковый индекс и жанровые лидерборды"""
+    database.init_engines()
+    models.Base.metadata.create_all(bind=database.engine)
+    migrations.upgrade_schema(database.engine)
+    search.ensure_search_index(database.engine)
+    stats.ensure_genre_stats(database.engine)
+    coherence.sync(force=True)  # поколения таблиц на момент запуска
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Запуск: движки и проверка схемы БД, фоновый пересчёт рекомендаций (RECOMMEND_REFRESH_INTERVAL > 0),
+    писатель пакетной записи оценок (RATING_INGEST).
+    Остановка: задача отменяется, очередь оценок дописывается, соединения и пулы закрываются
+    """
+    await run_in_threadpool(prepare_database)
+    if settings.RATING_INGEST:
+        ingest.get_ingestor()
+    task = None
+    if settings.RECOMMEND_REFRESH_INTERVAL > 0:
+        task = asyncio.create_task(recommend.refresh_periodically(
+            database.engine, database.read_engine, settings.RECOMMEND_REFRESH_INTERVAL))
+    yield
+    if task is not None:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await run_in_threadpool(ingest.stop)  # принятые оценки дописываются до закрытия пулов
+    coherence.close()
+    database.dispose_engines()
+
+
+def create_app(app_settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Приложение FastAPI по настройкам (по умолчанию — из окружения и .env).
+    Здесь — middleware, маршруты и кэши; движки, схема БД и фоновые задачи поднимаются в lifespan.
+    Для uvicorn: uvicorn app.main:app или uvicorn --factory app.main:create_app
+    """
+    if app_settings is not None:
+        config.configure(app_settings)
+        coherence.close()
+        database.dispose_engines()  # движки прежних настроек
+    auth.configure()
+    stats.configure()
+
+    application = FastAPI(lifespan=lifespan)
+
+    # Записи других воркеров в ту же БД сбрасывают кэши этого (CACHE_COHERENCE)
+    if settings.CACHE_COHERENCE:
+        application.add_middleware(coherence.CoherenceMiddleware)
+
+    # Ограничение записей и аутентификации: лишние запросы отклоняются до эндпоинта (ADMISSION_CONTROL)
+    if settings.ADMISSION_CONTROL:
+        application.state.admission = admission.AdmissionController.from_settings()
+        application.add_middleware(admission.AdmissionMiddleware, controller=application.state.admission)
+
+    # Метрики: задержки по шаблонам маршрутов, SQL и ожидание пула (GET /metrics)
+    if settings.METRICS_ENABLED:
+        application.add_middleware(metrics.MetricsMiddleware, router=application.router)
+
+    # Бюджет SQL-запросов на маршрут (QUERY_BUDGET_MODE=log|raise)
+    if settings.QUERY_BUDGET_MODE != "off":
+        application.add_middleware(
+            querybudget.QueryBudgetMiddleware,
+            router=application.router,
+            default=settings.QUERY_BUDGET_DEFAULT,
+            strict=settings.QUERY_BUDGET_MODE == "raise",
+        )
+
+    # Пакетная запись оценок перекрывает обычный POST /books/{book_id}/rate (в том числе асинхронный)
+    if settings.RATING_INGEST:
+        application.add_api_route("/books/{book_id}/rate", rate_book_batched, methods=["POST"],
+                                  response_model=schemas.RatingRead, include_in_schema=False)
+
+    # Асинхронный режим: async-эндпоинты регистрируются первыми и перекрывают синхронные
+    if settings.ASYNC_DB:
+        from app import routes_async
+        application.include_router(routes_async.router, include_in_schema=False)
+    application.include_router(router)
+    if settings.METRICS_ENABLED:
+        application.add_api_route("/metrics", read_metrics, include_in_schema=False)
+    return application
+
+
+def __getattr__(name: str):
+    # app.main:app создаётся при первом обращении (uvicorn, from app.main import app), а не при импорте модуля
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,183 @@
+"""
+Метрики Prometheus (GET /metrics): задержка и число запросов в обработке по шаблону маршрута,
+число и суммарное время SQL-запросов, ожидание соединения из пула.
+
+SQL и ожидание пула накапливаются в объекте текущего запроса (contextvar) и попадают
+в Prometheus один раз по окончании запроса: на каждый SQL-запрос — только сложение.
+Счётчики живут в памяти процесса, при нескольких воркерах каждый отдаёт свои.
+"""
+
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.routing import Match
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Пути без маршрута (404) собираются под одной меткой, чтобы не плодить ряды
+UNMATCHED_ROUTE = "unmatched"
+# SQL вне HTTP-запроса: запуск приложения, скрипты
+NO_ROUTE = "none"
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса",
+    ["method", "route"], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter("http_requests", "Число HTTP-запросов", ["method", "route", "status"])
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP-запросы в обработке", ["method", "route"])
+SQL_STATEMENTS = Counter("db_statements", "Число SQL-запросов", ["route"])
+SQL_SECONDS = Counter("db_statement_seconds", "Суммарное время выполнения SQL-запросов", ["route"])
+POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "Ожидание соединения из пула (вместе с открытием нового)",
+    ["pool"], buckets=LATENCY_BUCKETS)
+POOL_WAIT_BY_ROUTE = Counter("db_pool_wait_route_seconds", "Суммарное ожидание пула по маршрутам", ["route"])
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+INGEST_QUEUE_DEPTH = Gauge("rating_ingest_queue_depth", "Оценки в очереди пакетной записи")
+INGEST_BATCH_SIZE = Histogram("rating_ingest_batch_size", "Оценок в одной транзакции", buckets=BATCH_BUCKETS)
+INGEST_FLUSH_SECONDS = Histogram(
+    "rating_ingest_flush_seconds", "Время записи пачки оценок (транзакция с commit)", buckets=LATENCY_BUCKETS)
+INGEST_ACK_SECONDS = Histogram(
+    "rating_ingest_ack_seconds", "От постановки оценки в очередь до подтверждения commit", buckets=LATENCY_BUCKETS)
+INGEST_REJECTED = Counter("rating_ingest_rejected", "Оценки, отклонённые из-за заполненной очереди")
+ADMISSION_ACTIVE = Gauge("admission_active", "Запросы, допущенные admission control", ["route_class"])
+ADMISSION_QUEUED = Gauge("admission_queued", "Запросы в очереди admission control", ["route_class"])
+ADMISSION_REJECTED = Counter(
+    "admission_rejected", "Запросы, отклонённые admission control (rate — 429, queue / timeout — 503)",
+    ["route_class", "reason"])
+CACHE_REMOTE_INVALIDATIONS = Counter(
+    "cache_remote_invalidations", "Сбросы кэшей из-за записей в других процессах", ["table"])
+
+_NO_ROUTE_STATEMENTS = SQL_STATEMENTS.labels(NO_ROUTE)
+_NO_ROUTE_SECONDS = SQL_SECONDS.labels(NO_ROUTE)
+
+
+class RequestStats:
+    """Накопленные за запрос SQL-запросы и ожидание пула"""
+
+    __slots__ = ("statements", "sql_seconds", "pool_wait_seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    """Статистика текущего HTTP-запроса (None вне запроса)"""
+    return _current.get()
+
+
+# --- SQL ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    stats = _current.get()
+    if stats is None:
+        _NO_ROUTE_STATEMENTS.inc()
+        _NO_ROUTE_SECONDS.inc(elapsed)
+    else:
+        stats.statements += 1
+        stats.sql_seconds += elapsed
+
+
+def instrument_engine(sync_engine):
+    """Считает SQL-запросы движка (для AsyncEngine — его sync_engine)"""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# --- Пул соединений ---
+class _TimedGet:
+    """Замеряет ожидание соединения; метка пула — pool_logging_name движка"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            POOL_WAIT.labels(self.logging_name or "default").observe(waited)
+            stats = _current.get()
+            if stats is not None:
+                stats.pool_wait_seconds += waited
+
+
+class TimedQueuePool(_TimedGet, QueuePool):
+    """QueuePool с замером ожидания соединения"""
+
+
+class TimedAsyncQueuePool(_TimedGet, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool с замером ожидания соединения"""
+
+
+# --- HTTP ---
+def route_template(router, scope) -> str:
+    """Шаблон пути маршрута, который обработает запрос (как выбирает его Router)"""
+    partial = None
+    for route in router.routes:
+        match, _ = route.matches(scope)
+        if match is Match.FULL:
+            return route.path_format
+        if match is Match.PARTIAL and partial is None:
+            partial = route.path_format
+    return partial or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: метка маршрута — шаблон пути ("/books/{book_id}"), а не сам путь.
+    Маршрут определяется заранее, чтобы учитывать запрос в http_requests_in_flight;
+    конвертеры из шаблона убираются ("/books/{book_id:int}" -> "/books/{book_id}")
+    """
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(self.router, scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        in_flight = IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.dec()
+            _current.reset(token)
+            REQUEST_LATENCY.labels(method, route).observe(elapsed)
+            REQUESTS.labels(method, route, str(status)).inc()
+            if stats.statements:
+                SQL_STATEMENTS.labels(route).inc(stats.statements)
+                SQL_SECONDS.labels(route).inc(stats.sql_seconds)
+            if stats.pool_wait_seconds:
+                POOL_WAIT_BY_ROUTE.labels(route).inc(stats.pool_wait_seconds)
+
+
+def metrics_response() -> Response:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,53 @@
+"""
+Доводит существующую БД до схемы app/models.py (create_all создаёт только новые таблицы):
+добавляет недостающие колонки агрегатов, удаляет повторные оценки перед уникальным
+индексом (user_id, book_id) и создаёт недостающие индексы. Идемпотентно, вызывается при запуске.
+"""
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+
+from app import models, stats
+
+# Колонки, добавленные в существующие таблицы: (таблица, колонка, DDL)
+_ADDED_COLUMNS = [
+    ("book_rating_stats", "weighted_score", "FLOAT NOT NULL DEFAULT 0"),
+]
+
+# Оставляем последнюю оценку пользователя для книги — как при повторной оценке через API
+_DEDUP_RATINGS_SQL = """
+DELETE FROM ratings WHERE id NOT IN (
+    SELECT MAX(id) FROM ratings GROUP BY user_id, book_id
+)
+"""
+
+
+def upgrade_schema(bind) -> dict:
+    """Применяет недостающие изменения схемы; агрегаты пересобираются, если данные менялись"""
+    done = {"columns": [], "duplicates_removed": 0, "indexes": []}
+
+    with bind.begin() as conn:
+        inspector = inspect(conn)
+        for table, column, ddl in _ADDED_COLUMNS:
+            existing = {info["name"] for info in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                done["columns"].append(f"{table}.{column}")
+
+        for table in models.Base.metadata.sorted_tables:
+            existing = {info["name"] for info in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                if index.unique and table.name == "ratings":
+                    done["duplicates_removed"] = conn.execute(text(_DEDUP_RATINGS_SQL)).rowcount
+                index.create(conn)
+                done["indexes"].append(index.name)
+
+    if done["columns"] or done["duplicates_removed"]:
+        db = Session(bind=bind)
+        try:
+            stats.rebuild_rating_aggregates(db)
+        finally:
+            db.close()
+    return done
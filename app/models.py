@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, Float, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, Table, Float, Text, Index, LargeBinary, collate
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -7,7 +7,7 @@ book_author_table = Table(
     "book_author",
     Base.metadata,
     Column("book_id", ForeignKey("books.id"), primary_key=True),
-    Column("author_id", ForeignKey("authors.id"), primary_key=True)
+    Column("author_id", ForeignKey("authors.id"), primary_key=True, index=True)
 )
 
 # Таблица связи книга-жанр
@@ -15,7 +15,7 @@ book_genre_table = Table(
     "book_genre",
     Base.metadata,
     Column("book_id", ForeignKey("books.id"), primary_key=True),
-    Column("genre_id", ForeignKey("genres.id"), primary_key=True)
+    Column("genre_id", ForeignKey("genres.id"), primary_key=True, index=True)
 )
 
 # Автор
@@ -26,6 +26,7 @@ class Author(Base):
     name = Column(String, unique=True, nullable=False)
 
     books = relationship("Book", secondary=book_author_table, back_populates="authors")
+    rating_stats = relationship("AuthorRatingStats", uselist=False, cascade="all, delete-orphan")
 
 # Жанр
 class Genre(Base):
@@ -44,9 +45,15 @@ class Book(Base):
     title = Column(String, nullable=False, index=True)
     description = Column(Text, nullable=True)
 
+    # Фильтр по началу названия (LIKE без учёта регистра) и сортировка по названию
+    __table_args__ = (
+        Index("ix_books_title_nocase", collate(title, "NOCASE")),
+    )
+
     authors = relationship("Author", secondary=book_author_table, back_populates="books")
     genres = relationship("Genre", secondary=book_genre_table, back_populates="books")
-    ratings = relationship("Rating", back_populates="book")
+    ratings = relationship("Rating", back_populates="book", cascade="all, delete-orphan")
+    rating_stats = relationship("BookRatingStats", uselist=False, cascade="all, delete-orphan")
 
 # Пользователь
 class User(Base):
@@ -58,7 +65,7 @@ class User(Base):
 
     ratings = relationship("Rating", back_populates="user")
 
-# Рейтинг
+# Рейтинг: одна оценка на пару пользователь-книга, повторная оценка её заменяет
 class Rating(Base):
     __tablename__ = "ratings"
 
@@ -66,7 +73,79 @@ class Rating(Base):
     score = Column(Float, nullable=False)  # от 1 до 5
 
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    book_id = Column(Integer, ForeignKey("books.id"), nullable=False)
+    book_id = Column(Integer, ForeignKey("books.id"), nullable=False, index=True)
+
+    # Уникальный индекс заодно обслуживает поиск по user_id (левый префикс)
+    __table_args__ = (
+        Index("ux_ratings_user_book", "user_id", "book_id", unique=True),
+    )
 
     user = relationship("User", back_populates="ratings")
     book = relationship("Book", back_populates="ratings")
+
+# Агрегаты рейтинга книги (поддерживаются в crud.create_rating)
+class BookRatingStats(Base):
+    __tablename__ = "book_rating_stats"
+
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True)
+    ratings_count = Column(Integer, nullable=False, default=0)
+    ratings_sum = Column(Float, nullable=False, default=0.0)
+    average_rating = Column(Float, nullable=False, default=0.0, index=True)
+    weighted_score = Column(Float, nullable=False, default=0.0, index=True)  # см. stats.weighted_score
+
+# Агрегаты рейтинга автора по всем его книгам
+class AuthorRatingStats(Base):
+    __tablename__ = "author_rating_stats"
+
+    author_id = Column(Integer, ForeignKey("authors.id"), primary_key=True)
+    ratings_count = Column(Integer, nullable=False, default=0)
+    ratings_sum = Column(Float, nullable=False, default=0.0)
+    average_rating = Column(Float, nullable=False, default=0.0, index=True)
+
+# Предрассчитанный лидерборд по жанрам: строка на пару жанр-книга с оценками
+# (поддерживается в stats.refresh_genre_stats, индексы — под ORDER BY внутри жанра)
+class GenreBookStats(Base):
+    __tablename__ = "genre_book_stats"
+
+    genre_id = Column(Integer, ForeignKey("genres.id"), primary_key=True)
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True, index=True)
+    ratings_count = Column(Integer, nullable=False)
+    average_rating = Column(Float, nullable=False)
+    weighted_score = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_genre_book_stats_weighted", "genre_id", "weighted_score", "book_id"),
+        Index("ix_genre_book_stats_average", "genre_id", "average_rating", "book_id"),
+    )
+
+# Похожие книги: top-k соседей по оценкам (см. app/recommend.py), отсортированы по убыванию сходства.
+# Массивы хранятся компактно: id соседей — int32, сходство — float32 (little-endian)
+class BookNeighbors(Base):
+    __tablename__ = "book_neighbors"
+
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True)
+    neighbors = Column(LargeBinary, nullable=False)
+    scores = Column(LargeBinary, nullable=False)
+
+# Книги с новыми оценками, соседей которых ещё не пересчитал recommend.refresh
+# (version растёт с каждой пометкой: refresh снимает только прочитанные им пометки)
+class RecommendationDirtyBook(Base):
+    __tablename__ = "recommendation_dirty"
+
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+
+# Поколения таблиц для сброса in-process кэшей в других процессах (см. app/coherence.py)
+class CacheGeneration(Base):
+    __tablename__ = "cache_generations"
+
+    name = Column(String, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+# Аренда фоновой задачи: из всех воркеров задачу выполняет владелец живой аренды (см. app/recommend.py)
+class JobLease(Base):
+    __tablename__ = "job_leases"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(Float, nullable=False)  # unix time
@@ -0,0 +1,211 @@
+"""Бюджет SQL-запросов на блок кода и на маршрут (QUERY_BUDGET_MODE) — защита от N+1"""
+
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import database, metrics
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# (метод, шаблон пути) -> максимум SQL-запросов за HTTP-запрос; None — не проверять.
+# Бюджет — число запросов самого длинного пути маршрута (новые связи, промах кэша
+# пользователя), а не наблюдаемый максимум тестов; от размера ответа и пачки не зависит.
+# Синхронные ответы на запись перечитывают книгу и её связи (+3 к асинхронному режиму,
+# где связи загружены заранее); FAST_JSON числа запросов не меняет.
+# В записи входит upsert поколений cache_generations перед commit (app/coherence.py)
+ROUTE_BUDGETS: dict[tuple[str, str], Optional[int]] = {
+    ("GET", "/"): 0,
+    ("POST", "/books/"): 11,  # жанры, авторы, книга, 2 связи, 2 FTS, поколения, ответ 3
+    ("POST", "/books/bulk"): 9,  # авторы, жанры, MAX(id), книги, 2 связи, 2 FTS, поколения
+    ("POST", "/books/genres/bulk"): 7,
+    ("GET", "/books/"): 4,
+    ("GET", "/books/search"): 4,
+    ("GET", "/books/export"): None,  # по три запроса на пачку, число пачек зависит от каталога
+    ("GET", "/books/{book_id}"): 3,
+    # книга, жанры, авторы, текущие связи 2, правка, связи ±4, агрегаты авторов 2
+    # и жанров 2, FTS 2, поколения, ответ 3
+    ("PUT", "/books/{book_id}"): 20,
+    # книга и её связи 5, агрегаты и соседи 3, связи, оценки и книга 5 (executemany),
+    # агрегаты авторов 3, FTS, поколения
+    ("DELETE", "/books/{book_id}"): 18,
+    ("GET", "/books/{book_id}/ratings"): 1,
+    ("GET", "/books/{book_id}/similar"): 4,
+    ("POST", "/genres/"): 3,
+    ("GET", "/genres/"): 1,
+    ("GET", "/genres/{genre_id}"): 1,
+    ("PUT", "/genres/{genre_id}"): 4,
+    ("DELETE", "/genres/{genre_id}"): 5,
+    # книга, жанр, жанры книги, связь, агрегаты жанров 2, поколения, ответ 3
+    ("POST", "/books/{book_id}/genres/{genre_id}"): 10,
+    ("DELETE", "/books/{book_id}/genres/{genre_id}"): 10,
+    ("GET", "/books/{book_id}/genres"): 3,
+    # пользователь, книга, прежняя оценка, авторы книги, оценка, агрегаты книги 3
+    # и авторов 3, агрегаты жанров 2, пометка соседей, поколения, ответ
+    ("POST", "/books/{book_id}/rate"): 16,
+    # как /rate, но оценки пишутся пачкой: MAX(id), вставка и обновление вместо одной записи
+    ("POST", "/ratings/bulk"): 17,
+    ("POST", "/register"): 4,
+    ("POST", "/token"): 4,  # поиск пользователя; при пересчёте хэша — чтение, запись и поколение
+    ("GET", "/me"): 1,
+    # пользователь при промахе кэша, оценки, соседи, книги со связями 3 (или запасной топ 3)
+    ("GET", "/me/recommendations"): 6,
+    ("GET", "/stats/top-books"): 4,
+    ("GET", "/stats/top-authors"): 4,  # при промахе кэша лидербордов
+    ("GET", "/stats/cache"): 0,
+    ("GET", "/stats/summary"): 6,
+    ("GET", "/stats/admission"): 0,
+    ("GET", "/metrics"): 0,
+    ("POST", "/authors/"): 3,
+    ("GET", "/authors/"): 1,
+    ("GET", "/authors/{author_id}"): 1,
+    ("PUT", "/authors/{author_id}"): 7,
+    ("DELETE", "/authors/{author_id}"): 6,
+}
+
+_SKIPPED_FRAMES = ("/sqlalchemy/", __file__)
+_STACK_DEPTH = 12
+
+
+class QueryBudgetExceeded(AssertionError):
+    """SQL-запросов больше, чем разрешает бюджет"""
+
+
+class QueryLog:
+    """SQL-запросы и стеки ленивых загрузок, выполненные в блоке или HTTP-запросе"""
+
+    def __init__(self):
+        self.statements: list[str] = []
+        self.lazy_loads: list[tuple[str, list[str]]] = []
+
+    def report(self, label: str, limit: int) -> str:
+        lines = [f"{label}: {len(self.statements)} SQL-запросов при бюджете {limit}"]
+        lines += [f"  {number}. {' '.join(statement.split())[:200]}"
+                  for number, statement in enumerate(self.statements, 1)]
+        for relationship, stack in self.lazy_loads:
+            lines.append(f"  ленивая загрузка {relationship}:")
+            lines += [line.rstrip() for line in stack]
+        return "\n".join(lines)
+
+
+class _RequestTracker:
+    """Учёт одного HTTP-запроса в QueryBudgetMiddleware"""
+
+    __slots__ = ("log", "label", "budget", "strict")
+
+    def __init__(self, label: str, budget: Optional[int], strict: bool):
+        self.log = QueryLog()
+        self.label = label
+        self.budget = budget
+        self.strict = strict
+
+    @property
+    def exceeded(self) -> bool:
+        return self.budget is not None and len(self.log.statements) > self.budget
+
+    def add(self, statement: str):
+        self.log.statements.append(statement)
+        if self.strict and self.exceeded:
+            raise QueryBudgetExceeded(self.log.report(self.label, self.budget))
+
+
+# Логи активных query_budget: учитывают SQL из любых потоков (TestClient выполняет приложение в своём)
+_block_logs: list[QueryLog] = []
+_current: ContextVar[Optional[_RequestTracker]] = ContextVar("query_budget", default=None)
+_install_lock = threading.Lock()
+_instrumented: set = set()
+
+
+def _lazy_load_stack() -> list[str]:
+    frames = [frame for frame in traceback.extract_stack()
+              if not any(part in frame.filename for part in _SKIPPED_FRAMES)]
+    return traceback.format_list(frames[-_STACK_DEPTH:])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if statement == "BEGIN IMMEDIATE":
+        # Начало транзакции писателя (см. database.apply_sqlite_profile), как и COMMIT, не считается
+        return
+    for log in _block_logs:
+        log.statements.append(statement)
+    tracker = _current.get()
+    if tracker is not None:
+        tracker.add(statement)
+
+
+def _do_orm_execute(orm_execute_state):
+    if not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None:
+        return
+    tracker = _current.get()
+    logs = [*_block_logs, *([tracker.log] if tracker is not None else [])]
+    if not logs:
+        return
+    path = orm_execute_state.loader_strategy_path
+    relationship = f"{path[0].class_.__name__}.{path[1].key}" if path is not None else "?"
+    stack = _lazy_load_stack()
+    for log in logs:
+        log.lazy_loads.append((relationship, stack))
+
+
+def install():
+    """Вешает счётчики на движки приложения и сессии; повторные вызовы ничего не делают"""
+    engines = [database.engine, database.read_engine, *database.replica_engines]
+    if settings.ASYNC_DB:
+        engines += [database.get_async_engine().sync_engine, database.get_async_read_engine().sync_engine]
+    with _install_lock:
+        if Session not in _instrumented:
+            event.listen(Session, "do_orm_execute", _do_orm_execute)
+            _instrumented.add(Session)
+        for sync_engine in engines:
+            if sync_engine not in _instrumented:
+                event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+                _instrumented.add(sync_engine)
+
+
+@contextmanager
+def query_budget(limit: int, label: str = "query_budget"):
+    """Падает с QueryBudgetExceeded, если в блоке выполнено больше limit SQL-запросов"""
+    install()
+    log = QueryLog()
+    _block_logs.append(log)
+    try:
+        yield log
+    finally:
+        _block_logs.remove(log)
+    if len(log.statements) > limit:
+        raise QueryBudgetExceeded(log.report(label, limit))
+
+
+class QueryBudgetMiddleware:
+    """ASGI-middleware: бюджет SQL-запросов на HTTP-запрос по маршрутам из ROUTE_BUDGETS"""
+
+    def __init__(self, app, router, default: int, strict: bool):
+        self.app = app
+        self.router = router
+        self.default = default
+        self.strict = strict
+        install()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = metrics.route_template(self.router, scope)
+        key = (scope["method"], route)
+        budget = ROUTE_BUDGETS[key] if key in ROUTE_BUDGETS else self.default
+        tracker = _RequestTracker(f"{key[0]} {route}", budget, self.strict)
+        token = _current.set(tracker)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            if tracker.exceeded and not self.strict:
+                logger.warning(tracker.log.report(tracker.label, tracker.budget))
@@ -0,0 +1,152 @@
+"""
+Похожие книги и персональные рекомендации по оценкам (item-to-item, скорректированный косинус).
+
+Для каждой книги хранится top-k соседей (book_neighbors), поэтому /books/{id}/similar
+и /me/recommendations читают O(k) строк; чтение обходится без NumPy. Соседей собирает
+app/recommend_build.py: полностью (rebuild) или только для книг, которые оценки пометили
+в recommendation_dirty (refresh, фоновая задача приложения).
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sys
+import time
+from array import array
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, selectinload
+
+from app import models, stats
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# --- Хранение ---
+def decode(row: models.BookNeighbors) -> tuple[array, array]:
+    """id соседей (int32) и сходства (float32) из строки book_neighbors (little-endian)"""
+    neighbor_ids, scores = array("i", row.neighbors), array("f", row.scores)
+    if sys.byteorder == "big":
+        neighbor_ids.byteswap()
+        scores.byteswap()
+    return neighbor_ids, scores
+
+
+def mark_dirty(db: Session, book_ids: Iterable[int]):
+    """Помечает книги для refresh (в транзакции записи оценок)"""
+    rows = [{"book_id": book_id} for book_id in set(book_ids)]
+    if not rows:
+        return
+    table = models.RecommendationDirtyBook.__table__
+    statement = sqlite_insert(table)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.book_id], set_={"version": table.c.version + 1}), rows)
+
+
+def remove_books(db: Session, book_ids: Iterable[int]):
+    """Убирает соседей и пометки удаляемых книг (в чужих списках они отсеются при чтении)"""
+    book_ids = list(book_ids)
+    db.execute(delete(models.BookNeighbors).where(models.BookNeighbors.book_id.in_(book_ids)))
+    db.execute(delete(models.RecommendationDirtyBook).where(models.RecommendationDirtyBook.book_id.in_(book_ids)))
+
+
+REFRESH_LEASE = "recommend_refresh"
+
+
+def acquire_lease(bind, name: str, seconds: float, owner: Optional[str] = None) -> bool:
+    """
+    Берёт или продлевает аренду задачи name на seconds секунд (строка job_leases).
+    False — аренду держит другой процесс, и она ещё не истекла
+    """
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+    now = time.time()
+    table = models.JobLease.__table__
+    statement = sqlite_insert(table).values(name=name, owner=owner, expires_at=now + seconds)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={"owner": statement.excluded.owner, "expires_at": statement.excluded.expires_at},
+        where=(table.c.owner == statement.excluded.owner) | (table.c.expires_at < now))
+    with bind.begin() as conn:
+        return conn.execute(statement.returning(table.c.owner)).first() is not None
+
+
+async def refresh_periodically(bind, read_bind, interval: float):
+    """
+    Фоновый refresh раз в interval секунд (задача lifespan приложения). Первый проход —
+    через interval после запуска: старт воркера не ждёт сборки и не импортирует NumPy / SciPy.
+    Задача запущена в каждом воркере, но проход делает только владелец аренды REFRESH_LEASE:
+    один процесс на развёртывание; если он пропал, аренду через 3 × interval заберёт другой
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if not await run_in_threadpool(acquire_lease, bind, REFRESH_LEASE, interval * 3):
+                continue
+            from app import recommend_build
+            result = await run_in_threadpool(recommend_build.refresh, bind, read_bind)
+            if result["refreshed"]:
+                logger.info("Рекомендации: пересчитано %s книг", result["refreshed"])
+        except Exception:
+            logger.exception("Не удалось обновить рекомендации")
+
+
+# --- Чтение ---
+def _recommendations(db: Session, scored: list[tuple[int, Optional[float]]]) -> list[dict]:
+    """Книги в заданном порядке с оценкой сходства; удалённые книги пропускаются"""
+    if not scored:
+        return []
+    books = db.query(models.Book).options(
+        selectinload(models.Book.authors),
+        selectinload(models.Book.genres),
+    ).filter(models.Book.id.in_([book_id for book_id, _ in scored])).all()
+    by_id = {book.id: book for book in books}
+    return [{"book": by_id[book_id], "score": None if score is None else round(score, 4)}
+            for book_id, score in scored if book_id in by_id]
+
+
+def get_similar(db: Session, book_id: int, limit: int = 10) -> Optional[list[dict]]:
+    """Похожие книги из предрассчитанного списка; None — книги нет"""
+    row = db.get(models.BookNeighbors, book_id)
+    if row is None:
+        exists = db.scalar(select(models.Book.id).where(models.Book.id == book_id))
+        return None if exists is None else []
+    neighbor_ids, scores = decode(row)
+    return _recommendations(db, list(zip(neighbor_ids[:limit], scores[:limit])))
+
+
+def get_user_recommendations(db: Session, user_id: int, limit: int = 10) -> list[dict]:
+    """
+    Рекомендации пользователю: соседи его книг с весом «сходство × отклонение оценки от его
+    среднего»; оценённые книги исключаются. Без данных — топ книг каталога (score = None)
+    """
+    rated = db.execute(select(models.Rating.book_id, models.Rating.score)
+                       .where(models.Rating.user_id == user_id)).all()
+    rated_ids = {book_id for book_id, _ in rated}
+    recommendations = []
+    if rated:
+        scores = [score for _, score in rated]
+        # Все оценки одинаковые — отклонение считается от априорного среднего топа книг
+        baseline = sum(scores) / len(scores) if max(scores) > min(scores) else settings.TOP_BOOKS_PRIOR_MEAN
+        history = sorted(((book_id, score - baseline) for book_id, score in rated if score != baseline),
+                         key=lambda item: -abs(item[1]))[:settings.RECOMMEND_USER_HISTORY]
+        weight_of = dict(history)
+        totals = defaultdict(float)
+        for row in db.scalars(select(models.BookNeighbors)
+                              .where(models.BookNeighbors.book_id.in_(list(weight_of)))):
+            weight = weight_of[row.book_id]
+            for neighbor_id, similarity in zip(*decode(row)):
+                totals[neighbor_id] += similarity * weight
+        ranked = sorted(((book_id, total) for book_id, total in totals.items()
+                         if total > 0 and book_id not in rated_ids), key=lambda item: (-item[1], item[0]))
+        recommendations = _recommendations(db, ranked[:limit])
+    if recommendations:
+        return recommendations
+    # Топ без оценённых книг одним запросом; мимо кэша лидербордов — ключ был бы свой у каждого пользователя
+    top = db.scalars(stats.top_books_query(limit, exclude_rated_by=user_id)).all()
+    return [{"book": book, "score": None} for book in top]
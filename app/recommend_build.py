@@ -0,0 +1,251 @@
+"""Сборка и обновление похожих книг (book_neighbors) на NumPy / SciPy; импортируется только сборкой"""
+
+import json
+from typing import Iterable, Optional
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import delete, func, select, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app import analytics, models
+from app.config import settings
+
+# Формат book_neighbors (см. recommend.decode): int32 и float32, little-endian
+_ID_DTYPE = np.dtype("<i4")
+_SCORE_DTYPE = np.dtype("<f4")
+# Размер плотного блока сходств (строк × книг) при сборке
+_BLOCK_CELLS = 8_000_000
+
+
+def encode(neighbor_ids: np.ndarray, scores: np.ndarray) -> dict:
+    """Колонки строки book_neighbors из массивов соседей и сходств"""
+    return {"neighbors": neighbor_ids.astype(_ID_DTYPE).tobytes(), "scores": scores.astype(_SCORE_DTYPE).tobytes()}
+
+
+def decode(row) -> tuple[np.ndarray, np.ndarray]:
+    return np.frombuffer(row.neighbors, dtype=_ID_DTYPE), np.frombuffer(row.scores, dtype=_SCORE_DTYPE)
+
+
+# --- Матрица и сходство ---
+class RatingMatrix:
+    """Нормированные центрированные оценки и бинарная матрица «оценил» (строки — книги)"""
+
+    def __init__(self, ratings: np.ndarray, norms: Optional[dict[int, float]] = None):
+        """norms — нормы строк по id книг, если ratings содержит не все оценки книг"""
+        self.book_ids, book_index = np.unique(ratings["book_id"], return_inverse=True)
+        user_ids, user_index = np.unique(ratings["user_id"], return_inverse=True)
+        shape = (len(self.book_ids), len(user_ids))
+        scores = ratings["score"]
+        user_means = np.bincount(user_index, weights=scores) / np.maximum(np.bincount(user_index), 1)
+        centered = sparse.csr_matrix((scores - user_means[user_index], (book_index, user_index)), shape=shape)
+        if norms is None:
+            norms = np.sqrt(np.asarray(centered.multiply(centered).sum(axis=1)).ravel())
+        else:
+            norms = np.array([norms.get(book_id, 0.0) for book_id in self.book_ids.tolist()])
+        norms[norms == 0] = 1.0
+        self.normalized = sparse.diags(1.0 / norms) @ centered
+        self.rated = sparse.csr_matrix((np.ones(len(scores)), (book_index, user_index)), shape=shape)
+
+    def lookup(self, book_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Номера строк книг и маска найденных (у книги есть оценки)"""
+        if not len(self.book_ids):
+            return np.zeros(len(book_ids), dtype=np.int64), np.zeros(len(book_ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.book_ids, book_ids), len(self.book_ids) - 1)
+        return positions, self.book_ids[positions] == book_ids
+
+    def rows_of(self, book_ids: Iterable[int]) -> np.ndarray:
+        """Номера строк книг, у которых есть оценки"""
+        positions, found = self.lookup(np.fromiter(book_ids, dtype=np.int64))
+        return positions[found]
+
+    def similarity_blocks(self, rows: np.ndarray, shrink: float):
+        """Пары (строки блока, плотный блок сходств со всеми книгами); сходство с собой — 0"""
+        block = max(1, _BLOCK_CELLS // max(len(self.book_ids), 1))
+        for start in range(0, len(rows), block):
+            chunk = rows[start:start + block]
+            similarity = (self.normalized[chunk] @ self.normalized.T).toarray()
+            if shrink:
+                common = (self.rated[chunk] @ self.rated.T).toarray()
+                similarity *= common / (common + shrink)
+            similarity[np.arange(len(chunk)), chunk] = 0.0
+            yield chunk, similarity
+
+
+def top_k(similarity: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Номера столбцов и значения k наибольших сходств в каждой строке (по убыванию)"""
+    k = min(k, similarity.shape[1])
+    columns = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(similarity, columns, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+def _neighbor_rows(matrix: RatingMatrix, columns: np.ndarray, values: np.ndarray, book_id: int) -> dict:
+    positive = values > 0
+    return {"book_id": int(book_id), **encode(matrix.book_ids[columns[positive]], values[positive])}
+
+
+# --- Сборка ---
+def _dirty_versions(conn) -> list[tuple[int, int]]:
+    table = models.RecommendationDirtyBook.__table__
+    return [tuple(row) for row in conn.execute(select(table.c.book_id, table.c.version))]
+
+
+def _clear_dirty(conn, seen: list[tuple[int, int]]):
+    """Снимает пометки, прочитанные до сборки (помеченные заново во время сборки остаются)"""
+    if seen:
+        table = models.RecommendationDirtyBook.__table__
+        conn.execute(delete(table).where(tuple_(table.c.book_id, table.c.version).in_(seen)))
+
+
+def _upsert_neighbors(conn, rows: list[dict]):
+    if rows:
+        table = models.BookNeighbors.__table__
+        statement = sqlite_insert(table)
+        conn.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.book_id],
+            set_={"neighbors": statement.excluded.neighbors, "scores": statement.excluded.scores}), rows)
+
+
+def _load_matrix(read_bind) -> RatingMatrix:
+    db = Session(bind=read_bind)
+    try:
+        return RatingMatrix(analytics.load_ratings(db))
+    finally:
+        db.close()
+
+
+def _json_ids(ids: Iterable[int]) -> str:
+    # Список id одним параметром для json_each: длина не упирается в лимит переменных SQLite
+    return json.dumps([int(value) for value in ids])
+
+
+def _in_ids(column, ids: Iterable[int]):
+    """column IN (id...) через json_each"""
+    values = func.json_each(_json_ids(ids)).table_valued("value")
+    return column.in_(select(values.c.value))
+
+
+# Средние пользователей — один проход по ux_ratings_user_book (в окрестность почти всегда попадают
+# популярные книги, и отбор читателей списком выходит дороже). CROSS JOIN фиксирует порядок
+# соединения в SQLite: оценки книг по ix_ratings_book_id, среднее читателя — по индексу
+# материализованной means (иначе планировщик перебирает пары читатель × книга из списка)
+_ROW_NORMS = text("""
+WITH means AS MATERIALIZED (SELECT user_id, AVG(score) AS mean FROM ratings GROUP BY user_id)
+SELECT r.book_id, SUM((r.score - m.mean) * (r.score - m.mean))
+FROM ratings AS r CROSS JOIN means AS m ON m.user_id = r.user_id
+WHERE r.book_id IN (SELECT value FROM json_each(:books))
+GROUP BY r.book_id
+""")
+
+
+def _row_norms(db: Session, book_ids: np.ndarray) -> dict[int, float]:
+    """Нормы центрированных строк книг по всем их оценкам (средние — по всем оценкам читателей)"""
+    rows = db.execute(_ROW_NORMS, {"books": _json_ids(book_ids)})
+    return {book_id: float(np.sqrt(total)) for book_id, total in rows}
+
+
+def _load_neighborhood(read_bind, dirty_ids: list[int]) -> RatingMatrix:
+    """
+    Все оценки читателей помеченных книг; нормы строк — по полным оценкам книг.
+    Если книги читала больше чем половина пользователей, полная матрица дешевле выборки и норм
+    """
+    db = Session(bind=read_bind)
+    try:
+        ratings = models.Rating.__table__
+        readers = select(ratings.c.user_id).where(_in_ids(ratings.c.book_id, dirty_ids)).distinct()
+        readers_count = db.scalar(select(func.count()).select_from(readers.subquery()))
+        if readers_count * 2 > db.scalar(select(func.count()).select_from(models.User)):
+            return RatingMatrix(analytics.load_ratings(db))
+        loaded = analytics.load_ratings(db, user_ids=readers)
+        return RatingMatrix(loaded, norms=_row_norms(db, np.unique(loaded["book_id"])))
+    finally:
+        db.close()
+
+
+def rebuild(bind, read_bind=None) -> dict:
+    """Полная сборка соседей всех книг; оценки читаются через read_bind (по умолчанию bind)"""
+    with bind.connect() as conn:
+        seen = _dirty_versions(conn)
+    matrix = _load_matrix(read_bind or bind)
+    k = settings.RECOMMEND_NEIGHBORS
+    rows = []
+    for chunk, similarity in matrix.similarity_blocks(np.arange(len(matrix.book_ids)), settings.RECOMMEND_SHRINK):
+        columns, values = top_k(similarity, k)
+        rows += [_neighbor_rows(matrix, columns[i], values[i], matrix.book_ids[row])
+                 for i, row in enumerate(chunk)]
+    with bind.begin() as conn:
+        conn.execute(delete(models.BookNeighbors))
+        if rows:
+            conn.execute(sqlite_insert(models.BookNeighbors.__table__), rows)
+        _clear_dirty(conn, seen)
+    return {"books": len(rows), "refreshed": len(rows)}
+
+
+def refresh(bind, read_bind=None) -> dict:
+    """
+    Пересчёт соседей книг из recommendation_dirty; пустой book_neighbors — полная сборка.
+    Помеченная книга получает новый список, а в списках других книг её сходство заменяется
+    новым: вставляется, если проходит в их top-k, и убирается, если стало неположительным.
+    Затронуты только книги с общими оценщиками (оценки не удаляются, поэтому и прежние
+    соседи помеченной книги среди них); books в ответе — размер этой окрестности
+    """
+    with bind.connect() as conn:
+        seen = _dirty_versions(conn)
+        if not seen:
+            return {"books": None, "refreshed": 0}
+        if conn.execute(select(models.BookNeighbors.book_id).limit(1)).first() is None:
+            return rebuild(bind, read_bind)
+    matrix = _load_neighborhood(read_bind or bind, [book_id for book_id, _ in seen])
+    with bind.connect() as conn:
+        table = models.BookNeighbors.__table__
+        stored = {row.book_id: decode(row)
+                  for row in conn.execute(select(table).where(_in_ids(table.c.book_id, matrix.book_ids)))}
+    k = settings.RECOMMEND_NEIGHBORS
+    dirty_rows = matrix.rows_of(book_id for book_id, _ in seen)
+    dirty_ids = matrix.book_ids[dirty_rows]
+
+    # Худшее сходство в списке каждой книги (0, пока список короче k) и списки, где есть помеченные книги
+    floor = np.zeros(len(matrix.book_ids))
+    full = [(book_id, scores[k - 1]) for book_id, (_, scores) in stored.items() if len(scores) >= k]
+    if full:
+        positions, found = matrix.lookup(np.array([book_id for book_id, _ in full], dtype=np.int64))
+        floor[positions[found]] = np.array([score for _, score in full])[found]
+    holders: dict[int, list[int]] = {}
+    if stored:
+        owners = np.repeat(list(stored), [len(neighbor_ids) for neighbor_ids, _ in stored.values()])
+        listed = np.concatenate([neighbor_ids for neighbor_ids, _ in stored.values()])
+        hit = np.isin(listed, dirty_ids)
+        for dirty_id, owner in zip(listed[hit].tolist(), owners[hit].tolist()):
+            holders.setdefault(dirty_id, []).append(owner)
+
+    changed: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+    for chunk, similarity in matrix.similarity_blocks(dirty_rows, settings.RECOMMEND_SHRINK):
+        columns, values = top_k(similarity, k)
+        for i, row in enumerate(chunk):
+            dirty_id = int(matrix.book_ids[row])
+            positive = values[i] > 0
+            changed[dirty_id] = (matrix.book_ids[columns[i][positive]], values[i][positive])
+            others = np.union1d(np.flatnonzero(similarity[i] > floor),
+                                matrix.rows_of(holders.get(dirty_id, [])))
+            for other_row in others:
+                other_id = int(matrix.book_ids[other_row])
+                if other_id == dirty_id:
+                    continue
+                neighbor_ids, scores = changed.get(other_id) or stored.get(
+                    other_id, (np.empty(0, _ID_DTYPE), np.empty(0, _SCORE_DTYPE)))
+                keep = neighbor_ids != dirty_id
+                neighbor_ids, scores = neighbor_ids[keep], scores[keep]
+                if similarity[i, other_row] > 0:
+                    neighbor_ids = np.append(neighbor_ids, dirty_id)
+                    scores = np.append(scores, similarity[i, other_row])
+                order = np.argsort(-scores, kind="stable")[:k]
+                changed[other_id] = (neighbor_ids[order], scores[order])
+
+    with bind.begin() as conn:
+        _upsert_neighbors(conn, [{"book_id": book_id, **encode(neighbor_ids, scores)}
+                                 for book_id, (neighbor_ids, scores) in changed.items()])
+        _clear_dirty(conn, seen)
+    return {"books": len(matrix.book_ids), "refreshed": len(changed)}
@@ -0,0 +1,291 @@
+"""
+Асинхронные эндпоинты (AsyncSession + aiosqlite), включаются настройкой ASYNC_DB.
+Подключаются раньше синхронных и перекрывают их по тому же пути и методу;
+схема OpenAPI берётся из синхронных эндпоинтов, ответы у них совпадают.
+ID в путях объявлены как {id:int}, чтобы статические пути вроде /books/search
+не перехватывались и доходили до синхронных эндпоинтов.
+"""
+
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import auth, schemas, crud, crud_async, stats_async, versions
+from app.config import settings
+from app.database import get_async_read_db, get_async_write_db
+from app.fastjson import FastJSONResponse
+
+router = APIRouter()
+
+
+# --- Books ---
+@router.post("/books/", response_model=schemas.BookRead)
+async def create_book(book: schemas.BookCreate, db: AsyncSession = Depends(get_async_write_db)):
+    """Создать книгу."""
+    return await crud_async.create_book(db, book)
+
+
+@router.get("/books/", response_model=schemas.BookPage)
+async def read_books(
+    limit: int = Query(schemas.BOOKS_PAGE_DEFAULT, ge=1, le=schemas.BOOKS_PAGE_MAX),
+    after: Optional[int] = Query(None, ge=0),
+    author_id: Optional[int] = Query(None),
+    genre_id: Optional[int] = Query(None),
+    min_rating: Optional[float] = Query(None),
+    title_prefix: Optional[str] = Query(None, min_length=1, max_length=200),
+    sort: schemas.BookSort = Query("id"),
+    facets: bool = Query(False),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Получить страницу книг с фильтрами (keyset-пагинация: after — ID последней книги)."""
+    filters = schemas.BookFilter(
+        author_id=author_id, genre_id=genre_id, min_rating=min_rating, title_prefix=title_prefix)
+    book_facets = await db.run_sync(crud.get_book_facets, filters) if facets else None
+    if settings.FAST_JSON:
+        page = await db.run_sync(crud.get_books_page_rows, limit=limit, after=after, filters=filters, sort=sort)
+        if not page["items"] and await db.run_sync(crud.books_cursor_missing, after, sort):
+            raise HTTPException(status_code=400, detail="Книги курсора after уже нет, начните с первой страницы")
+        return FastJSONResponse({**page, "facets": book_facets})
+    books, next_cursor = await crud_async.get_books_page(db, limit=limit, after=after, filters=filters, sort=sort)
+    if not books and await db.run_sync(crud.books_cursor_missing, after, sort):
+        raise HTTPException(status_code=400, detail="Книги курсора after уже нет, начните с первой страницы")
+    return {"items": books, "next_cursor": next_cursor, "facets": book_facets}
+
+
+@router.get("/books/{book_id:int}", response_model=schemas.BookRead)
+async def read_book(book_id: int, request: Request, response: Response,
+                    db: AsyncSession = Depends(get_async_read_db)):
+    """Получить книгу по ID (поддерживает If-None-Match / If-Modified-Since)."""
+    validator = versions.book_validator(book_id)
+    if validator.is_fresh(request):
+        return validator.not_modified()
+    db_book = await crud_async.get_book(db, book_id)
+    if db_book is None:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    response.headers.update(validator.headers())
+    return db_book
+
+
+@router.put("/books/{book_id:int}", response_model=schemas.BookRead)
+async def update_book(book_id: int, book: schemas.BookCreate, db: AsyncSession = Depends(get_async_write_db)):
+    """Обновить книгу по ID."""
+    db_book = await crud_async.update_book(db, book_id, book)
+    if not db_book:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    return db_book
+
+
+@router.delete("/books/{book_id:int}", response_model=schemas.BookRead)
+async def delete_book(book_id: int, db: AsyncSession = Depends(get_async_write_db)):
+    """Удалить книгу по ID."""
+    db_book = await crud_async.delete_book(db, book_id)
+    if not db_book:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    return db_book
+
+
+@router.get("/books/{book_id:int}/ratings", response_model=List[schemas.RatingRead])
+async def get_ratings(book_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    """Получить все рейтинги книги."""
+    return await crud_async.get_ratings_for_book(db, book_id)
+
+
+# --- Genres ---
+@router.post("/genres/", response_model=schemas.GenreRead)
+async def create_genre(genre: schemas.GenreCreate, db: AsyncSession = Depends(get_async_write_db)):
+    """Создать жанр."""
+    return await crud_async.create_genre(db, genre)
+
+
+@router.get("/genres/", response_model=List[schemas.GenreRead])
+async def read_genres(request: Request, response: Response, db: AsyncSession = Depends(get_async_read_db)):
+    """Получить все жанры (поддерживает If-None-Match / If-Modified-Since)."""
+    validator = versions.validator(("genres", None))
+    if validator.is_fresh(request):
+        return validator.not_modified()
+    if settings.FAST_JSON:
+        return FastJSONResponse(await db.run_sync(crud.get_all_genres_rows), headers=validator.headers())
+    response.headers.update(validator.headers())
+    return await crud_async.get_all_genres(db)
+
+
+@router.get("/genres/{genre_id:int}", response_model=schemas.GenreRead)
+async def read_genre(genre_id: int, request: Request, response: Response,
+                     db: AsyncSession = Depends(get_async_read_db)):
+    """Получить жанр по ID."""
+    validator = versions.validator(("genres", genre_id))
+    if validator.is_fresh(request):
+        return validator.not_modified()
+    genre = await crud_async.get_genre(db, genre_id)
+    if not genre:
+        raise HTTPException(status_code=404, detail="Жанр не найден")
+    response.headers.update(validator.headers())
+    return genre
+
+
+@router.put("/genres/{genre_id:int}", response_model=schemas.GenreRead)
+async def update_genre(genre_id: int, genre: schemas.GenreCreate, db: AsyncSession = Depends(get_async_write_db)):
+    """Обновить жанр по ID."""
+    db_genre = await crud_async.update_genre(db, genre_id, genre)
+    if not db_genre:
+        raise HTTPException(status_code=404, detail="Жанр не найден")
+    return db_genre
+
+
+@router.delete("/genres/{genre_id:int}", response_model=schemas.GenreRead)
+async def delete_genre(genre_id: int, db: AsyncSession = Depends(get_async_write_db)):
+    """Удалить жанр по ID."""
+    db_genre = await crud_async.delete_genre(db, genre_id)
+    if not db_genre:
+        raise HTTPException(status_code=404, detail="Жанр не найден")
+    return db_genre
+
+
+# --- Genre-to-book ---
+@router.post("/books/{book_id:int}/genres/{genre_id:int}", response_model=schemas.BookRead)
+async def link_genre(book_id: int, genre_id: int, db: AsyncSession = Depends(get_async_write_db)):
+    """Привязать жанр к книге."""
+    result = await crud_async.add_genre_to_book(db, book_id, genre_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Книга или жанр не найдены")
+    return result
+
+
+@router.delete("/books/{book_id:int}/genres/{genre_id:int}", response_model=schemas.BookRead)
+async def unlink_genre(book_id: int, genre_id: int, db: AsyncSession = Depends(get_async_write_db)):
+    """Отвязать жанр от книги."""
+    result = await crud_async.remove_genre_from_book(db, book_id, genre_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Книга или жанр не найдены")
+    return result
+
+
+@router.get("/books/{book_id:int}/genres", response_model=List[schemas.GenreRead])
+async def get_book_genres(book_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    """Получить жанры книги."""
+    genres = await crud_async.get_book_genres(db, book_id)
+    if genres is None:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    return genres
+
+
+# --- Ratings ---
+@router.post("/books/{book_id:int}/rate", response_model=schemas.RatingRead)
+async def rate_book(
+    book_id: int,
+    rating: schemas.RatingCreate,
+    db: AsyncSession = Depends(get_async_write_db),
+    current_user: auth.UserPrincipal = Depends(auth.get_current_user_async)
+):
+    """Оценить книгу от имени текущего пользователя."""
+    db_rating = await crud_async.create_rating(db, user_id=current_user.id, book_id=book_id, rating=rating)
+    if db_rating is None:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    return db_rating
+
+
+# --- Users ---
+@router.post("/register", response_model=schemas.UserRead)
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_write_db)):
+    """Зарегистрировать нового пользователя."""
+    if await crud_async.get_user_by_username(db, user.username):
+        raise HTTPException(status_code=400, detail="Пользователь уже существует")
+    db_user = await crud_async.create_user(db, user)
+    if db_user is None:
+        raise HTTPException(status_code=400, detail="Пользователь уже существует")
+    return db_user
+
+
+@router.post("/token", response_model=schemas.Token)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_write_db)):
+    """Получить токен по логину и паролю."""
+    user = await crud_async.authenticate_user(db, form_data.username, form_data.password)
+    if not user:
+        raise HTTPException(status_code=401, detail="Неверные учетные данные")
+
+    token = auth.create_access_token({"sub": str(user.id)})
+    return {"access_token": token, "token_type": "bearer"}
+
+
+@router.get("/me", response_model=schemas.UserRead)
+async def get_me(current_user: auth.UserPrincipal = Depends(auth.get_current_user_async)):
+    """Получить информацию о текущем пользователе."""
+    return current_user
+
+
+@router.get("/stats/top-books")
+async def stats_top_books(
+    limit: int = Query(3, ge=1, le=100),
+    genre: Optional[str] = Query(None),
+    min_ratings: int = Query(1, ge=1),
+    rank: Literal["weighted", "average"] = Query("weighted"),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Топ книг и авторов по рейтингу (через кэш лидербордов)."""
+    return {
+        "top_books": await stats_async.cached_top_books(
+            db, limit=limit, genre=genre, min_ratings=min_ratings, rank=rank),
+        "top_authors": await stats_async.cached_top_authors(db, limit=limit)
+    }
+
+
+@router.get("/stats/top-authors")
+async def stats_top_authors(limit: int = Query(3, ge=1, le=100), db: AsyncSession = Depends(get_async_read_db)):
+    """Топ авторов и книг по рейтингу (через кэш лидербордов)."""
+    return {
+        "top_books": await stats_async.cached_top_books(db, limit=limit),
+        "top_authors": await stats_async.cached_top_authors(db, limit=limit)
+    }
+
+
+# --- Authors ---
+@router.post("/authors/", response_model=schemas.AuthorRead)
+async def create_author(author: schemas.AuthorCreate, db: AsyncSession = Depends(get_async_write_db)):
+    """Создать автора"""
+    return await crud_async.create_author(db, author)
+
+
+@router.get("/authors/", response_model=List[schemas.AuthorRead])
+async def read_authors(request: Request, response: Response, db: AsyncSession = Depends(get_async_read_db)):
+    """Считать всех авторов (поддерживает If-None-Match / If-Modified-Since)"""
+    validator = versions.validator(("authors", None))
+    if validator.is_fresh(request):
+        return validator.not_modified()
+    if settings.FAST_JSON:
+        return FastJSONResponse(await db.run_sync(crud.get_all_authors_rows), headers=validator.headers())
+    response.headers.update(validator.headers())
+    return await crud_async.get_all_authors(db)
+
+
+@router.get("/authors/{author_id:int}", response_model=schemas.AuthorRead)
+async def read_author(author_id: int, request: Request, response: Response,
+                      db: AsyncSession = Depends(get_async_read_db)):
+    """Получить автора по id"""
+    validator = versions.validator(("authors", author_id))
+    if validator.is_fresh(request):
+        return validator.not_modified()
+    author = await crud_async.get_author(db, author_id)
+    if not author:
+        raise HTTPException(status_code=404, detail="Автор не найден")
+    response.headers.update(validator.headers())
+    return author
+
+
+@router.put("/authors/{author_id:int}", response_model=schemas.AuthorRead)
+async def update_author(author_id: int, author: schemas.AuthorCreate, db: AsyncSession = Depends(get_async_write_db)):
+    """Обновить автора"""
+    db_author = await crud_async.update_author(db, author_id, author)
+    if db_author is None:
+        raise HTTPException(status_code=404, detail="Author not found")
+    return db_author
+
+
+@router.delete("/authors/{author_id:int}", response_model=schemas.AuthorRead)
+async def delete_author(author_id: int, db: AsyncSession = Depends(get_async_write_db)):
+    """Удалить автора"""
+    db_author = await crud_async.delete_author(db, author_id)
+    if db_author is None:
+        raise HTTPException(status_code=404, detail="Author not found")
+    return db_author
@@ -1,7 +1,7 @@
 """Схемы сущностей БД"""
 
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
 from pydantic.config import ConfigDict
 
 # --- Author ---
@@ -48,6 +48,48 @@ class BookRead(BookBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+# Похожая или рекомендованная книга; score = None — запасной вариант из топа книг
+class BookRecommendation(BaseModel):
+    book: BookRead
+    score: Optional[float] = None
+
+# Размер страницы списка книг
+BOOKS_PAGE_DEFAULT = 50
+BOOKS_PAGE_MAX = 500
+
+# Сортировки списка книг: id, название (без учёта регистра), средняя оценка (по убыванию)
+BookSort = Literal["id", "title", "rating"]
+
+class BookFilter(BaseModel):
+    """Фильтры списка книг; условия объединяются через И"""
+    author_id: Optional[int] = None
+    genre_id: Optional[int] = None
+    min_rating: Optional[float] = None
+    title_prefix: Optional[str] = None
+
+class FacetCount(BaseModel):
+    id: int
+    name: str
+    count: int
+
+class RatingBandCount(BaseModel):
+    band: Optional[int] = None  # средняя оценка в [band, band + 1); None — оценок нет
+    count: int
+
+class BookFacets(BaseModel):
+    genres: List[FacetCount]
+    authors: List[FacetCount]  # самые частые авторы, не больше FACET_AUTHORS_LIMIT
+    rating_bands: List[RatingBandCount]
+
+class BookPage(BaseModel):
+    items: List[BookRead]
+    next_cursor: Optional[int] = None
+    facets: Optional[BookFacets] = None
+
+class BookSearchPage(BaseModel):
+    items: List[BookRead]
+    next_offset: Optional[int] = None
+
 # --- User ---
 class UserBase(BaseModel):
     username: str
@@ -75,6 +117,38 @@ class RatingRead(RatingBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+# --- Bulk ---
+# Предел элементов в одном пакетном запросе
+BULK_MAX_ITEMS = 5000
+
+class BookBulkCreate(BaseModel):
+    items: List[BookCreate] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class RatingBulkItem(RatingCreate):
+    book_id: int
+
+class RatingBulkCreate(BaseModel):
+    items: List[RatingBulkItem] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class BookGenreLink(BaseModel):
+    book_id: int
+    genre_id: int
+
+class BookGenreBulk(BaseModel):
+    items: List[BookGenreLink] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class BulkItemResult(BaseModel):
+    index: int  # позиция элемента в запросе
+    status: Literal["created", "updated", "exists", "error"]
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkResult(BaseModel):
+    created: int
+    updated: int = 0
+    failed: int
+    results: List[BulkItemResult]
+
 # --- Auth ---
 class Token(BaseModel):
     access_token: str
@@ -0,0 +1,134 @@
+"""Полнотекстовый поиск книг на SQLite FTS5 (название, описание, имена авторов)"""
+
+import re
+from typing import Iterable, Optional
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session, selectinload
+from app import models
+
+FTS_TABLE = "books_fts"
+
+# Веса bm25 по колонкам: название важнее имён авторов, описание — слабее всего
+BM25_WEIGHTS = (10.0, 1.0, 5.0)
+
+_CREATE_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+USING fts5(title, description, authors, tokenize = 'unicode61 remove_diacritics 2')
+"""
+
+# Документ индекса: rowid = id книги, авторы склеены через пробел
+_DOCUMENTS_SQL = f"""
+INSERT INTO {FTS_TABLE} (rowid, title, description, authors)
+SELECT b.id, b.title, COALESCE(b.description, ''), COALESCE(GROUP_CONCAT(a.name, ' '), '')
+FROM books b
+LEFT JOIN book_author ba ON ba.book_id = b.id
+LEFT JOIN authors a ON a.id = ba.author_id
+{{where}}
+GROUP BY b.id
+"""
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def ensure_search_index(bind):
+    """Создаёт таблицу FTS5, если её нет; новую таблицу сразу заполняет по books"""
+    with bind.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE},
+        ).first()
+        if exists:
+            return
+        conn.execute(text(_CREATE_SQL))
+        conn.execute(text(_DOCUMENTS_SQL.format(where="")))
+
+
+def drop_search_index(bind):
+    """Удаляет таблицу FTS5 (drop_all про неё не знает)"""
+    with bind.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+
+
+def index_books(db, book_ids: Iterable[int]):
+    """Переиндексирует книги в текущей транзакции (db — Session или Connection)"""
+    book_ids = list(set(book_ids))
+    if not book_ids:
+        return
+    if isinstance(db, Session):
+        db.flush()
+    remove_books(db, book_ids)
+    db.execute(
+        text(_DOCUMENTS_SQL.format(where="WHERE b.id IN :ids"))
+        .bindparams(bindparam("ids", expanding=True)),
+        {"ids": book_ids},
+    )
+
+
+def remove_books(db, book_ids: Iterable[int]):
+    """Убирает книги из индекса"""
+    book_ids = list(book_ids)
+    if not book_ids:
+        return
+    db.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN :ids")
+        .bindparams(bindparam("ids", expanding=True)),
+        {"ids": book_ids},
+    )
+
+
+def author_book_ids(db, author_id: int) -> list[int]:
+    """ID книг автора — их документы зависят от имени автора"""
+    return [row[0] for row in db.execute(
+        text("SELECT book_id FROM book_author WHERE author_id = :author_id"),
+        {"author_id": author_id},
+    )]
+
+
+def rebuild_search_index(db: Session) -> int:
+    """Полностью пересобирает индекс по таблице books"""
+    db.execute(text(_CREATE_SQL))
+    db.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    db.execute(text(_DOCUMENTS_SQL.format(where="")))
+    db.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"))
+    db.commit()
+    return db.execute(text(f"SELECT COUNT(*) FROM {FTS_TABLE}")).scalar()
+
+
+def build_match_query(q: str) -> Optional[str]:
+    """
+    Превращает пользовательский ввод в безопасный запрос FTS5:
+    каждое слово в кавычках (без операторов), последнее — как префикс
+    """
+    tokens = _TOKEN_RE.findall(q)
+    if not tokens:
+        return None
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search_books(db: Session, q: str, limit: int = 20, offset: int = 0):
+    """
+    Книги по релевантности BM25. Возвращает (книги, offset следующей страницы или None);
+    авторы и жанры подгружаются пачками
+    """
+    match = build_match_query(q)
+    if match is None:
+        return [], None
+    weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+    rows = db.execute(
+        text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match "
+             f"ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT :limit OFFSET :offset"),
+        {"match": match, "limit": limit + 1, "offset": offset},
+    ).all()
+    ids = [row[0] for row in rows[:limit]]
+    next_offset = offset + limit if len(rows) > limit else None
+    if not ids:
+        return [], next_offset
+
+    books = db.query(models.Book) \
+        .options(selectinload(models.Book.authors), selectinload(models.Book.genres)) \
+        .filter(models.Book.id.in_(ids)) \
+        .all()
+    by_id = {book.id: book for book in books}
+    return [by_id[book_id] for book_id in ids if book_id in by_id], next_offset
@@ -1,33 +1,297 @@
 """Решение бизнес задачи --- топ книг"""
 
-from typing import Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app import models, schemas
+from typing import Iterable, Optional
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func, case, select, insert, update, delete, bindparam
+from app import coherence, models, schemas
+from app.cache import TTLCache
+from app.config import Settings, settings
 
+# Кэш лидербордов: ключ (вид, limit, параметры), сбрасывается при записях в crud
+# (размер и TTL из настроек выставляет configure)
+leaderboard_cache = TTLCache(ttl=Settings.model_fields["LEADERBOARD_CACHE_TTL"].default,
+                             maxsize=Settings.model_fields["LEADERBOARD_CACHE_SIZE"].default)
 
-def get_top_books(db: Session, limit: int = 3, genre: Optional[str] = None) -> list[schemas.BookRead]:
-    """Выдаёт топ 3 книги по рейтингу"""
-    query = db.query(
-        models.Book,
-        func.avg(models.Rating.score).label("average_rating")
-    ).join(models.Rating).group_by(models.Book.id).order_by(func.avg(models.Rating.score).desc())
 
-    books = [book for book, _ in query.limit(limit).all()]
+def configure():
+    """Применяет текущие настройки к кэшу лидербордов"""
+    leaderboard_cache.configure(ttl=settings.LEADERBOARD_CACHE_TTL, maxsize=settings.LEADERBOARD_CACHE_SIZE)
+
+# weighted — байесовское среднее (мало оценок тянет к PRIOR_MEAN), average — простое среднее
+TOP_BOOKS_RANKS = ("weighted", "average")
+
+
+def weighted_score(count, total):
+    """Байесовское среднее по числу и сумме оценок (SQL-выражение или числа)"""
+    prior_weight = settings.TOP_BOOKS_PRIOR_WEIGHT
+    return (prior_weight * settings.TOP_BOOKS_PRIOR_MEAN + total) / (prior_weight + count)
+
+
+def top_books_query(limit: int = 3, genre: Optional[str] = None, min_ratings: int = 1, rank: str = "weighted",
+                    exclude_rated_by: Optional[int] = None):
+    """
+    Запрос топа книг (общий для sync и async).
+    С жанром читается предрассчитанная genre_book_stats по индексу (genre_id, score),
+    без жанра — book_rating_stats. exclude_rated_by — без книг, оценённых этим пользователем
+    """
+    if genre is None:
+        stats_table = models.BookRatingStats
+        score = stats_table.weighted_score if rank == "weighted" else stats_table.average_rating
+        query = select(models.Book).select_from(stats_table).join(models.Book, models.Book.id == stats_table.book_id)
+    else:
+        stats_table = models.GenreBookStats
+        score = stats_table.weighted_score if rank == "weighted" else stats_table.average_rating
+        query = select(models.Book) \
+            .select_from(stats_table) \
+            .join(models.Genre, models.Genre.id == stats_table.genre_id) \
+            .join(models.Book, models.Book.id == stats_table.book_id) \
+            .where(models.Genre.name == genre)
+    if exclude_rated_by is not None:
+        query = query.where(stats_table.book_id.not_in(
+            select(models.Rating.book_id).where(models.Rating.user_id == exclude_rated_by)))
+    return query \
+        .where(stats_table.ratings_count >= max(min_ratings, 1)) \
+        .options(selectinload(models.Book.authors), selectinload(models.Book.genres)) \
+        .order_by(score.desc(), stats_table.book_id.desc()) \
+        .limit(limit)
+
+
+def get_top_books(db: Session, limit: int = 3, genre: Optional[str] = None,
+                  min_ratings: int = 1, rank: str = "weighted") -> list[schemas.BookRead]:
+    """Выдаёт топ книг по рейтингу, при необходимости внутри жанра"""
+    books = db.scalars(top_books_query(limit, genre, min_ratings, rank)).all()
     return [schemas.BookRead.from_orm(book) for book in books]
 
 
 def get_top_authors(db: Session, limit: int = 3) -> list[schemas.AuthorRead]:
     """Выдаёт топ 3 автора по рейтингу их книг"""
-    top_authors = db.query(
-        models.Author,
-        func.avg(models.Rating.score).label("average_rating")
-    ).join(models.book_author_table, models.book_author_table.c.author_id == models.Author.id) \
-     .join(models.Book, models.Book.id == models.book_author_table.c.book_id) \
-     .join(models.Rating, models.Rating.book_id == models.Book.id) \
-     .group_by(models.Author.id) \
-     .order_by(func.avg(models.Rating.score).desc()) \
-     .limit(limit) \
+    top_authors = db.query(models.Author) \
+        .join(models.AuthorRatingStats, models.AuthorRatingStats.author_id == models.Author.id) \
+        .filter(models.AuthorRatingStats.ratings_count > 0) \
+        .order_by(models.AuthorRatingStats.average_rating.desc(), models.AuthorRatingStats.author_id.desc()) \
+        .limit(limit) \
+        .all()
+
+    return [schemas.AuthorRead.from_orm(author) for author in top_authors]
+
+
+def cached_top_books(db: Session, limit: int = 3, genre: Optional[str] = None,
+                     min_ratings: int = 1, rank: str = "weighted") -> list[schemas.BookRead]:
+    """Топ книг через кэш лидербордов"""
+    return leaderboard_cache.get_or_compute(
+        ("books", limit, genre, min_ratings, rank),
+        lambda: get_top_books(db, limit=limit, genre=genre, min_ratings=min_ratings, rank=rank)
+    )
+
+
+def cached_top_authors(db: Session, limit: int = 3) -> list[schemas.AuthorRead]:
+    """Топ авторов через кэш лидербордов"""
+    return leaderboard_cache.get_or_compute(
+        ("authors", limit, None), lambda: get_top_authors(db, limit=limit)
+    )
+
+
+def invalidate_leaderboards():
+    """Сбрасывает кэш лидербордов после изменения рейтингов, книг, авторов или жанров"""
+    leaderboard_cache.invalidate()
+
+
+# Таблицы, от которых зависят лидерборды: их запись в другом процессе сбрасывает кэш здесь
+LEADERBOARD_TABLES = frozenset({"ratings", "books", "authors", "genres"})
+
+
+def _on_remote_write(tables: set[str]):
+    if tables & LEADERBOARD_TABLES:
+        invalidate_leaderboards()
+
+
+coherence.subscribe(_on_remote_write)
+
+
+# --- Агрегаты рейтингов ---
+def _apply_deltas(db: Session, model, key_column, deltas: dict):
+    """
+    Атомарно сдвигает count/sum/mean у строк агрегатов: deltas = {ключ: (сдвиг суммы, сдвиг числа)}.
+    Недостающие строки создаются, сами сдвиги — один executemany UPDATE
+    """
+    if not deltas:
+        return
+    keys = list(deltas)
+    db.flush()
+    existing = set(db.scalars(select(key_column).where(key_column.in_(keys))))
+    missing = [key for key in keys if key not in existing]
+    if missing:
+        db.execute(insert(model.__table__), [
+            {key_column.key: key, "ratings_count": 0, "ratings_sum": 0.0, "average_rating": 0.0}
+            for key in missing
+        ])
+
+    table = model.__table__
+    new_count = table.c.ratings_count + bindparam("count_delta")
+    new_sum = table.c.ratings_sum + bindparam("score_delta")
+    values = {
+        "ratings_count": new_count,
+        "ratings_sum": new_sum,
+        "average_rating": case((new_count > 0, new_sum / new_count), else_=0.0),
+    }
+    if "weighted_score" in table.c:
+        values["weighted_score"] = weighted_score(new_count, new_sum)
+    db.execute(
+        update(table)
+        .where(table.c[key_column.key] == bindparam("stats_key"))
+        .values(values),
+        [{"stats_key": key, "score_delta": score, "count_delta": count}
+         for key, (score, count) in deltas.items()],
+    )
+
+
+def apply_rating(db: Session, book_id: int, score_delta: float, count_delta: int = 1):
+    """
+    Учитывает оценку в агрегатах книги и всех её авторов.
+    Вызывается в той же транзакции, что и запись в ratings; commit делает вызывающий
+    """
+    apply_ratings_bulk(db, {book_id: (score_delta, count_delta)})
+
+
+def apply_ratings_bulk(db: Session, book_deltas: dict):
+    """
+    То же для многих книг сразу: book_deltas = {id книги: (сумма оценок, число оценок)}.
+    Сдвиги авторов складываются по всем их книгам, запросов — фиксированное число
+    """
+    if not book_deltas:
+        return
+    author_deltas = {}
+    links = db.execute(
+        select(models.book_author_table.c.book_id, models.book_author_table.c.author_id)
+        .where(models.book_author_table.c.book_id.in_(list(book_deltas)))
+    )
+    for book_id, author_id in links:
+        score, count = book_deltas[book_id]
+        total_score, total_count = author_deltas.get(author_id, (0.0, 0))
+        author_deltas[author_id] = (total_score + score, total_count + count)
+    _apply_deltas(db, models.BookRatingStats, models.BookRatingStats.book_id, book_deltas)
+    _apply_deltas(db, models.AuthorRatingStats, models.AuthorRatingStats.author_id, author_deltas)
+    refresh_genre_stats(db, book_deltas)
+
+
+def _genre_stats_select():
+    """Строки genre_book_stats из book_genre и агрегатов книг"""
+    book_stats = models.BookRatingStats
+    return select(
+        models.book_genre_table.c.genre_id,
+        models.book_genre_table.c.book_id,
+        book_stats.ratings_count,
+        book_stats.average_rating,
+        book_stats.weighted_score,
+    ).join(book_stats, book_stats.book_id == models.book_genre_table.c.book_id) \
+     .where(book_stats.ratings_count > 0)
+
+
+_GENRE_STATS_COLUMNS = ["genre_id", "book_id", "ratings_count", "average_rating", "weighted_score"]
+
+
+def refresh_genre_stats(db, book_ids: Iterable[int]):
+    """
+    Пересчитывает жанровые лидерборды для книг: после оценок или смены жанров.
+    db — Session или Connection; commit делает вызывающий
+    """
+    book_ids = list(set(book_ids))
+    if not book_ids:
+        return
+    if isinstance(db, Session):
+        db.flush()
+    table = models.GenreBookStats.__table__
+    db.execute(delete(table).where(table.c.book_id.in_(book_ids)))
+    db.execute(insert(table).from_select(
+        _GENRE_STATS_COLUMNS,
+        _genre_stats_select().where(models.book_genre_table.c.book_id.in_(book_ids)),
+    ))
+
+
+def remove_genre_stats(db, book_ids: Iterable[int] = (), genre_ids: Iterable[int] = ()):
+    """Убирает строки жанровых лидербордов до удаления книг или жанров (внешние ключи)"""
+    table = models.GenreBookStats.__table__
+    book_ids, genre_ids = list(book_ids), list(genre_ids)
+    if book_ids:
+        db.execute(delete(table).where(table.c.book_id.in_(book_ids)))
+    if genre_ids:
+        db.execute(delete(table).where(table.c.genre_id.in_(genre_ids)))
+
+
+def ensure_genre_stats(bind):
+    """Заполняет пустую genre_book_stats по агрегатам книг (БД, созданная до появления таблицы)"""
+    with bind.begin() as conn:
+        if conn.execute(select(models.GenreBookStats.book_id).limit(1)).first():
+            return
+        conn.execute(insert(models.GenreBookStats.__table__).from_select(
+            _GENRE_STATS_COLUMNS, _genre_stats_select()))
+
+
+def refresh_author_stats(db: Session, author_ids: Iterable[int]):
+    """Пересчитывает агрегаты авторов из агрегатов их книг (после смены авторов или удаления книги)"""
+    author_ids = set(author_ids)
+    if not author_ids:
+        return
+    db.flush()
+    totals = db.query(
+        models.book_author_table.c.author_id,
+        func.sum(models.BookRatingStats.ratings_count),
+        func.sum(models.BookRatingStats.ratings_sum),
+    ).join(models.BookRatingStats,
+           models.BookRatingStats.book_id == models.book_author_table.c.book_id) \
+     .filter(models.book_author_table.c.author_id.in_(author_ids)) \
+     .group_by(models.book_author_table.c.author_id) \
      .all()
+    db.query(models.AuthorRatingStats) \
+        .filter(models.AuthorRatingStats.author_id.in_(author_ids)) \
+        .delete(synchronize_session=False)
+    for author_id, count, total in totals:
+        db.add(models.AuthorRatingStats(
+            author_id=author_id,
+            ratings_count=count or 0,
+            ratings_sum=total or 0.0,
+            average_rating=total / count if count else 0.0,
+        ))
+
+
+def rebuild_rating_aggregates(db: Session) -> dict:
+    """Полностью пересобирает агрегаты книг, авторов и жанровые лидерборды по таблице ratings"""
+    db.query(models.GenreBookStats).delete(synchronize_session=False)
+    db.query(models.AuthorRatingStats).delete(synchronize_session=False)
+    db.query(models.BookRatingStats).delete(synchronize_session=False)
+
+    db.execute(insert(models.BookRatingStats).from_select(
+        ["book_id", "ratings_count", "ratings_sum", "average_rating", "weighted_score"],
+        select(
+            models.Rating.book_id,
+            func.count(models.Rating.id),
+            func.sum(models.Rating.score),
+            func.avg(models.Rating.score),
+            weighted_score(func.count(models.Rating.id), func.sum(models.Rating.score)),
+        ).join(models.Book, models.Book.id == models.Rating.book_id)
+         .group_by(models.Rating.book_id)
+    ))
+
+    author_count = func.sum(models.BookRatingStats.ratings_count)
+    author_sum = func.sum(models.BookRatingStats.ratings_sum)
+    db.execute(insert(models.AuthorRatingStats).from_select(
+        ["author_id", "ratings_count", "ratings_sum", "average_rating"],
+        select(
+            models.book_author_table.c.author_id,
+            author_count,
+            author_sum,
+            author_sum / author_count,
+        ).join(models.BookRatingStats,
+               models.BookRatingStats.book_id == models.book_author_table.c.book_id)
+         .group_by(models.book_author_table.c.author_id)
+    ))
+    db.execute(insert(models.GenreBookStats.__table__).from_select(
+        _GENRE_STATS_COLUMNS, _genre_stats_select()))
+    db.commit()
+    invalidate_leaderboards()
 
-    return [schemas.AuthorRead.from_orm(author) for author, _ in top_authors]
+    return {
+        "books": db.query(func.count(models.BookRatingStats.book_id)).scalar(),
+        "authors": db.query(func.count(models.AuthorRatingStats.author_id)).scalar(),
+        "genre_books": db.query(func.count(models.GenreBookStats.book_id)).scalar(),
+    }
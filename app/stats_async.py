@@ -0,0 +1,41 @@
+"""Асинхронные версии лидербордов из app/stats.py"""
+
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import models, schemas
+from app.stats import leaderboard_cache, top_books_query
+
+
+async def get_top_books(db: AsyncSession, limit: int = 3, genre: Optional[str] = None,
+                        min_ratings: int = 1, rank: str = "weighted") -> list[schemas.BookRead]:
+    """Выдаёт топ книг по рейтингу, при необходимости внутри жанра"""
+    books = (await db.execute(top_books_query(limit, genre, min_ratings, rank))).scalars().all()
+    return [schemas.BookRead.from_orm(book) for book in books]
+
+
+async def get_top_authors(db: AsyncSession, limit: int = 3) -> list[schemas.AuthorRead]:
+    """Выдаёт топ 3 автора по рейтингу их книг"""
+    query = select(models.Author) \
+        .join(models.AuthorRatingStats, models.AuthorRatingStats.author_id == models.Author.id) \
+        .where(models.AuthorRatingStats.ratings_count > 0) \
+        .order_by(models.AuthorRatingStats.average_rating.desc(), models.AuthorRatingStats.author_id.desc()) \
+        .limit(limit)
+    authors = (await db.execute(query)).scalars().all()
+    return [schemas.AuthorRead.from_orm(author) for author in authors]
+
+
+async def cached_top_books(db: AsyncSession, limit: int = 3, genre: Optional[str] = None,
+                           min_ratings: int = 1, rank: str = "weighted") -> list[schemas.BookRead]:
+    """Топ книг через общий кэш лидербордов"""
+    return await leaderboard_cache.aget_or_compute(
+        ("books", limit, genre, min_ratings, rank),
+        lambda: get_top_books(db, limit=limit, genre=genre, min_ratings=min_ratings, rank=rank)
+    )
+
+
+async def cached_top_authors(db: AsyncSession, limit: int = 3) -> list[schemas.AuthorRead]:
+    """Топ авторов через общий кэш лидербордов"""
+    return await leaderboard_cache.aget_or_compute(
+        ("authors", limit, None), lambda: get_top_authors(db, limit=limit)
+    )
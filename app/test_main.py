@@ -1,11 +1,44 @@
 """Тестирование всех функций БД"""
 
+import os
+
+# Каждый запрос тестов проверяется по бюджету SQL-запросов своего маршрута (app/querybudget.py)
+os.environ.setdefault("QUERY_BUDGET_MODE", "raise")
+os.environ.setdefault("QUERY_BUDGET_DEFAULT", "0")
+# Рекомендации тесты пересчитывают сами, без фоновой задачи
+os.environ.setdefault("RECOMMEND_REFRESH_INTERVAL", "0")
+
+from fastapi import FastAPI
+from fastapi.exceptions import ResponseValidationError
 from fastapi.testclient import TestClient
 from app.main import app
+from app.routes_async import router as async_router
+from app import analytics, auth, crud, crud_async, database, export, models, querybudget, recommend, recommend_build, schemas, stats
+from app.config import settings
+from app.database import SessionLocal, engine, read_engine
+from app.cache import TTLCache
+from app.hashing import HashingPool, HashingPoolBusy
+from passlib.context import CryptContext
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, event
+import asyncio
+import csv
+import io
+import json
+import pytest
+import threading
+import time
 import uuid
 
 client = TestClient(app)
 
+
+@pytest.fixture(scope="module", autouse=True)
+def app_lifespan():
+    """Запуск приложения (движки, проверка схемы БД) на время тестов модуля"""
+    with client:
+        yield
+
 def make_unique_name(base: str) -> str:
     return f"{base}_{uuid.uuid4().hex[:8]}"
 
@@ -123,6 +156,17 @@ def test_stats_top_authors():
     assert "top_books" in json_data
     assert "top_authors" in json_data
 
+    # Равные средние оценки — по убыванию id автора, чтобы кэш не закрепил случайный порядок
+    db = SessionLocal()
+    try:
+        top = stats.get_top_authors(db, limit=50)
+        averages = dict(db.query(models.AuthorRatingStats.author_id, models.AuthorRatingStats.average_rating)
+                        .filter(models.AuthorRatingStats.author_id.in_([author.id for author in top])))
+    finally:
+        db.close()
+    keys = [(averages[author.id], author.id) for author in top]
+    assert keys == sorted(keys, reverse=True)
+
 
 def test_books_by_author():
     # Уникальные имена
@@ -162,4 +206,1195 @@ def test_books_by_author():
     # Удаление книги, автора и жанра
     client.delete(f"/books/{book['id']}")
     client.delete(f"/authors/{author['id']}")
-    client.delete(f"/genres/{genre['id']}")
\ No newline at end of file
+    client.delete(f"/genres/{genre['id']}")
+
+def test_books_pagination():
+    author = client.post("/authors/", json={"name": make_unique_name("PageAuthor")}).json()
+    genre = client.post("/genres/", json={"name": make_unique_name("PageGenre")}).json()
+    book_ids = []
+    for _ in range(3):
+        response = client.post("/books/", json={
+            "title": make_unique_name("PageBook"),
+            "author_ids": [author["id"]],
+            "genre_ids": [genre["id"]],
+        })
+        book_ids.append(response.json()["id"])
+
+    # Первая страница начинается сразу перед созданными книгами
+    response = client.get("/books/", params={"limit": 2, "after": book_ids[0] - 1})
+    assert response.status_code == 200
+    page = response.json()
+    assert [book["id"] for book in page["items"]] == book_ids[:2]
+    assert page["items"][0]["authors"][0]["id"] == author["id"]
+    assert page["next_cursor"] == book_ids[1]
+
+    response = client.get("/books/", params={"limit": 2, "after": page["next_cursor"]})
+    assert response.json()["items"][0]["id"] == book_ids[2]
+
+    assert client.get("/books/", params={"limit": 0}).status_code == 422
+
+    for book_id in book_ids:
+        client.delete(f"/books/{book_id}")
+    client.delete(f"/authors/{author['id']}")
+    client.delete(f"/genres/{genre['id']}")
+
+
+def test_rating_aggregates():
+    author = client.post("/authors/", json={"name": make_unique_name("RatedAuthor")}).json()
+    genre = client.post("/genres/", json={"name": make_unique_name("RatedGenre")}).json()
+    book = client.post("/books/", json={
+        "title": make_unique_name("RatedBook"),
+        "author_ids": [author["id"]],
+        "genre_ids": [genre["id"]],
+    }).json()
+
+    for score in (5, 2):
+        token, _ = test_register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        response = client.post(f"/books/{book['id']}/rate", json={"score": score}, headers=headers)
+        assert response.status_code == 200
+
+    db = SessionLocal()
+    try:
+        book_stats = db.get(models.BookRatingStats, book["id"])
+        assert (book_stats.ratings_count, book_stats.ratings_sum) == (2, 7)
+        assert book_stats.average_rating == 3.5
+        author_stats = db.get(models.AuthorRatingStats, author["id"])
+        assert (author_stats.ratings_count, author_stats.average_rating) == (2, 3.5)
+    finally:
+        db.close()
+
+    # Повторная оценка заменяет прежнюю, а не добавляет новую
+    rating_id = response.json()["id"]
+    response = client.post(f"/books/{book['id']}/rate", json={"score": 4}, headers=headers)
+    assert response.json()["id"] == rating_id
+    assert len(client.get(f"/books/{book['id']}/ratings").json()) == 2
+    db = SessionLocal()
+    try:
+        book_stats = db.get(models.BookRatingStats, book["id"])
+        assert (book_stats.ratings_count, book_stats.ratings_sum) == (2, 9)
+    finally:
+        db.close()
+
+    client.delete(f"/books/{book['id']}")
+    db = SessionLocal()
+    try:
+        assert db.get(models.BookRatingStats, book["id"]) is None
+        assert db.get(models.AuthorRatingStats, author["id"]) is None
+    finally:
+        db.close()
+    client.delete(f"/authors/{author['id']}")
+    client.delete(f"/genres/{genre['id']}")
+
+
+def test_stats_cache_hits_and_invalidation():
+    client.get("/stats/top-books", params={"limit": 7})
+    before = client.get("/stats/cache").json()
+    client.get("/stats/top-books", params={"limit": 7})
+    after = client.get("/stats/cache").json()
+    assert after["hits"] >= before["hits"] + 2
+    assert after["misses"] == before["misses"]
+
+    # Запись через crud сбрасывает кэш
+    author = client.post("/authors/", json={"name": make_unique_name("CacheAuthor")}).json()
+    client.put(f"/authors/{author['id']}", json={"name": make_unique_name("CacheAuthor")})
+    assert client.get("/stats/cache").json()["invalidations"] > after["invalidations"]
+    client.get("/stats/top-books", params={"limit": 7})
+    assert client.get("/stats/cache").json()["misses"] == after["misses"] + 2
+    client.delete(f"/authors/{author['id']}")
+
+
+def test_cache_computes_once_for_concurrent_misses():
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["value"] * 8
+    assert len(calls) == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_async_routes(monkeypatch):
+    async_app = FastAPI()
+    async_app.include_router(async_router)
+    with TestClient(async_app) as async_client:
+        author = async_client.post("/authors/", json={"name": make_unique_name("AsyncAuthor")}).json()
+        genre = async_client.post("/genres/", json={"name": make_unique_name("AsyncGenre")}).json()
+        response = async_client.post("/books/", json={
+            "title": make_unique_name("AsyncBook"),
+            "author_ids": [author["id"]],
+            "genre_ids": [genre["id"]],
+        })
+        assert response.status_code == 200, response.text
+        book = response.json()
+        assert book["authors"][0]["id"] == author["id"]
+
+        user_data = {"username": make_unique_name("asyncuser"), "password": "testpass"}
+        assert async_client.post("/register", json=user_data).status_code == 200
+        token = async_client.post("/token", data=user_data).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        assert async_client.get("/me", headers=headers).json()["username"] == user_data["username"]
+        response = async_client.post(f"/books/{book['id']}/rate", json={"score": 4}, headers=headers)
+        assert response.status_code == 200, response.text
+        rerated = async_client.post(f"/books/{book['id']}/rate", json={"score": 5}, headers=headers).json()
+        assert rerated["id"] == response.json()["id"]
+
+        page = async_client.get("/books/", params={"limit": 1, "after": book["id"] - 1}).json()
+        assert page["items"][0]["id"] == book["id"]
+        assert "top_books" in async_client.get("/stats/top-books").json()
+
+        # С репликами асинхронная запись, как и синхронная, переводит чтения клиента на основную БД
+        monkeypatch.setattr(settings, "READ_DATABASE_URLS", "sqlite:///replica.db")
+        response = async_client.delete(f"/books/{book['id']}")
+        assert response.status_code == 200
+        assert database.PRIMARY_UNTIL_COOKIE in response.cookies
+        monkeypatch.setattr(settings, "READ_DATABASE_URLS", "")
+        assert async_client.get(f"/books/{book['id']}").status_code == 404
+        assert async_client.delete(f"/authors/{author['id']}").status_code == 200
+        assert async_client.delete(f"/genres/{genre['id']}").status_code == 200
+
+    # Асинхронный писатель — одно соединение и один движок, даже если его создают несколько потоков
+    monkeypatch.setattr(database, "_async_engine", None)
+    monkeypatch.setattr(database, "_async_read_engine", None)
+    created = []
+    threads = [threading.Thread(target=lambda: created.append(database.get_async_engine())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(async_engine) for async_engine in created}) == 1
+    assert created[0].pool.size() == 1 and created[0].pool._max_overflow == 0
+    assert database.get_async_read_engine() is not created[0]
+    created[0].sync_engine.dispose()
+    database.get_async_read_engine().sync_engine.dispose()
+
+
+def test_sqlite_profile_and_read_pool():
+    with read_engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
+        assert conn.exec_driver_sql("PRAGMA query_only").scalar() == 1
+
+    # Открытая транзакция писателя не блокирует чтение через read-only пул
+    with engine.connect() as writer:
+        writer.exec_driver_sql("INSERT INTO genres (name) VALUES (?)", (make_unique_name("Uncommitted"),))
+        response = client.get("/genres/")
+        assert response.status_code == 200
+        writer.rollback()
+
+    token, _ = test_register_and_login()
+    response = client.post("/books/999999999/rate", json={"score": 3},
+                           headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 404
+
+
+def test_writer_transactions_begin_immediate(tmp_path):
+    # Два писателя (как в двух воркерах) читают, а потом пишут: без BEGIN IMMEDIATE второй сразу
+    # получает "database is locked", с ним — ждёт первого, и ни одно изменение не теряется
+    url = f"sqlite:///{tmp_path / 'race.db'}"
+    writers = [create_engine(url, connect_args={"check_same_thread": False}) for _ in range(2)]
+    for writer in writers:
+        database.apply_sqlite_profile(writer)
+    with writers[0].begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE counter (value INTEGER NOT NULL)")
+        conn.exec_driver_sql("INSERT INTO counter VALUES (0)")
+
+    barrier, errors = threading.Barrier(2), []
+
+    def increment(writer):
+        barrier.wait()
+        try:
+            with writer.begin() as conn:
+                value = conn.exec_driver_sql("SELECT value FROM counter").scalar()
+                time.sleep(0.1)
+                conn.exec_driver_sql("UPDATE counter SET value = ?", (value + 1,))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=increment, args=(writer,)) for writer in writers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with writers[0].connect() as conn:
+        assert conn.exec_driver_sql("SELECT value FROM counter").scalar() == 2
+    for writer in writers:
+        writer.dispose()
+
+
+def test_search_books():
+    word = uuid.uuid4().hex[:10]
+    author = client.post("/authors/", json={"name": f"Searchable {word}author"}).json()
+    genre = client.post("/genres/", json={"name": make_unique_name("SearchGenre")}).json()
+    title_hit = client.post("/books/", json={
+        "title": f"Chronicles of {word}",
+        "author_ids": [author["id"]],
+        "genre_ids": [genre["id"]],
+    }).json()
+    desc_hit = client.post("/books/", json={
+        "title": make_unique_name("Other"),
+        "description": f"mentions {word} once",
+        "author_ids": [],
+        "genre_ids": [genre["id"]],
+    }).json()
+
+    response = client.get("/books/search", params={"q": word})
+    assert response.status_code == 200, response.text
+    ids = [book["id"] for book in response.json()["items"]]
+    # Совпадение в названии ранжируется выше совпадения в описании
+    assert ids == [title_hit["id"], desc_hit["id"]]
+
+    # Префиксный поиск по последнему слову и поиск по имени автора
+    assert client.get("/books/search", params={"q": word[:6]}).json()["items"]
+    by_author = client.get("/books/search", params={"q": f"{word}author"}).json()["items"]
+    assert [book["id"] for book in by_author] == [title_hit["id"]]
+
+    # Переименование автора переиндексирует его книги
+    client.put(f"/authors/{author['id']}", json={"name": f"Renamed {word}writer"})
+    assert client.get("/books/search", params={"q": f"{word}author"}).json()["items"] == []
+
+    client.delete(f"/books/{title_hit['id']}")
+    client.delete(f"/books/{desc_hit['id']}")
+    assert client.get("/books/search", params={"q": word}).json()["items"] == []
+    assert client.get("/books/search", params={"q": "\"*:"}).json()["items"] == []
+    client.delete(f"/authors/{author['id']}")
+    client.delete(f"/genres/{genre['id']}")
+
+
+def test_current_user_cache():
+    token, username = test_register_and_login()
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/me", headers=headers).json()["username"] == username
+    hits = auth.user_cache.hits
+    assert client.get("/me", headers=headers).json()["username"] == username
+    assert auth.user_cache.hits == hits + 1
+
+    # Изменение пользователя через ORM сбрасывает кэш после commit
+    new_username = make_unique_name("renamed")
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        user.username = new_username
+        db.commit()
+    finally:
+        db.close()
+    assert client.get("/me", headers=headers).json()["username"] == new_username
+
+    assert client.get("/me", headers={"Authorization": "Bearer broken"}).status_code == 401
+
+
+def test_login_rehashes_password_with_new_cost():
+    username = make_unique_name("rehash")
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("testpass")
+    db = SessionLocal()
+    try:
+        db.add(models.User(username=username, hashed_password=old_hash))
+        db.commit()
+    finally:
+        db.close()
+
+    response = client.post("/token", data={"username": username, "password": "testpass"})
+    assert response.status_code == 200
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        assert user.hashed_password != old_hash
+        assert not auth.pwd_context.needs_update(user.hashed_password)
+    finally:
+        db.close()
+    assert client.post("/token", data={"username": username, "password": "wrong"}).status_code == 401
+
+
+def test_register_same_name_race_is_400(monkeypatch):
+    user_data = {"username": make_unique_name("raceuser"), "password": "testpass"}
+    assert client.post("/register", json=user_data).status_code == 200
+
+    # Второй запрос прошёл проверку имени до того, как первый вставил пользователя
+    async def no_user(db, username):
+        return None
+
+    monkeypatch.setattr(crud, "get_user_by_username", lambda db, username: None)
+    monkeypatch.setattr(crud_async, "get_user_by_username", no_user)
+    response = client.post("/register", json=user_data)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Пользователь уже существует"
+
+
+def test_auth_does_not_hold_writer_during_bcrypt(monkeypatch):
+    """/register и /token не держат соединение писателя, пока считается bcrypt"""
+    checked_out = []
+    original_hash, original_verify = auth.get_password_hash_async, auth.verify_password_async
+
+    async def hash_password(password):
+        checked_out.append(engine.pool.checkedout())
+        return await original_hash(password)
+
+    async def verify_password(password, hashed):
+        checked_out.append(engine.pool.checkedout())
+        return await original_verify(password, hashed)
+
+    monkeypatch.setattr(auth, "get_password_hash_async", hash_password)
+    monkeypatch.setattr(auth, "verify_password_async", verify_password)
+    user_data = {"username": make_unique_name("nowriter"), "password": "testpass"}
+    assert client.post("/register", json=user_data).status_code == 200
+    assert client.post("/token", data=user_data).status_code == 200
+    assert checked_out == [0, 0]
+
+
+def test_hashing_pool_rejects_when_full():
+    pool = HashingPool(workers=1, queue_depth=0)
+    release = threading.Event()
+
+    async def scenario():
+        busy = asyncio.ensure_future(pool.run(release.wait, 5))
+        await asyncio.sleep(0.05)
+        try:
+            await pool.run(lambda: None)
+        except HashingPoolBusy:
+            rejected = True
+        else:
+            rejected = False
+        release.set()
+        await busy
+        return rejected
+
+    assert asyncio.run(scenario())
+    assert pool.stats()["rejected"] == 1
+    assert pool.stats()["in_flight"] == 0
+
+    # Отменённый запрос (клиент отключился) не освобождает место, пока bcrypt ещё считает
+    release.clear()
+
+    async def cancelled_scenario():
+        busy = asyncio.ensure_future(pool.run(release.wait, 5))
+        await asyncio.sleep(0.05)
+        busy.cancel()
+        await asyncio.sleep(0.05)
+        with pytest.raises(HashingPoolBusy):
+            await pool.run(lambda: None)
+        release.set()
+        await asyncio.sleep(0.05)
+        return await pool.run(lambda: "done")
+
+    assert asyncio.run(cancelled_scenario()) == "done"
+    assert pool.stats()["in_flight"] == 0
+
+
+def test_fast_json_matches_default_responses(monkeypatch):
+    authors = [client.post("/authors/", json={"name": make_unique_name("FastAuthor")}).json() for _ in range(2)]
+    genre = client.post("/genres/", json={"name": make_unique_name("FastGenre")}).json()
+    book = client.post("/books/", json={
+        "title": make_unique_name("FastBook"),
+        "description": "Описание",
+        "author_ids": [author["id"] for author in authors],
+        "genre_ids": [genre["id"]],
+    }).json()
+
+    def by_id(items):
+        return sorted(items, key=lambda item: item["id"])
+
+    params = {"limit": 5, "after": max(book["id"] - 3, 0)}  # на чистой БД id книги может быть меньше 3
+    default_page = client.get("/books/", params=params).json()
+    default_genres = client.get("/genres/").json()
+    default_authors = client.get("/authors/").json()
+
+    monkeypatch.setattr(settings, "FAST_JSON", True)
+    response = client.get("/books/", params=params)
+    assert response.headers["content-type"] == "application/json"
+    fast_page = response.json()
+    assert fast_page["next_cursor"] == default_page["next_cursor"]
+    assert len(fast_page["items"]) == len(default_page["items"])
+    for fast, default in zip(fast_page["items"], default_page["items"]):
+        assert list(fast) == list(default)
+        assert by_id(fast.pop("authors")) == by_id(default.pop("authors"))
+        assert by_id(fast.pop("genres")) == by_id(default.pop("genres"))
+        assert fast == default
+    assert client.get("/genres/").json() == default_genres
+    assert client.get("/authors/").json() == default_authors
+
+    client.delete(f"/books/{book['id']}")
+    for author in authors:
+        client.delete(f"/authors/{author['id']}")
+    client.delete(f"/genres/{genre['id']}")
+
+
+def test_export_books():
+    author = client.post("/authors/", json={"name": make_unique_name("ExportAuthor")}).json()
+    genre = client.post("/genres/", json={"name": make_unique_name("ExportGenre")}).json()
+    book = client.post("/books/", json={
+        "title": make_unique_name("ExportBook"),
+        "author_ids": [author["id"]],
+        "genre_ids": [genre["id"]],
+    }).json()
+
+    response = client.get("/books/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    exported = [json.loads(line) for line in lines]
+    assert [item["id"] for item in exported] == sorted(item["id"] for item in exported)
+    assert next(item for item in exported if item["id"] == book["id"]) == book
+
+    compressed = client.get("/books/export", params={"gzip": True})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.text.splitlines() == lines
+
+    rows = list(csv.DictReader(io.StringIO(client.get("/books/export", params={"format": "csv"}).text)))
+    row = next(row for row in rows if row["id"] == str(book["id"]))
+    assert row["title"] == book["title"]
+    assert row["authors"] == author["name"]
+    assert row["genres"] == genre["name"]
+
+    assert client.get("/books/export", params={"format": "xml"}).status_code == 422
+
+    # Между пачками соединение в пуле: остановившийся клиент не держит транзакцию чтения
+    batches = export.iter_book_batches(batch_size=2)
+    ids = [item["id"] for item in next(batches)]
+    assert read_engine.pool.checkedout() == 0
+    ids += [item["id"] for item in next(batches, [])]
+    assert ids == [item["id"] for item in exported[:4]]
+    batches.close()
+
+    client.delete(f"/books/{book['id']}")
+    client.delete(f"/authors/{author['id']}")
+    client.delete(f"/genres/{genre['id']}")
+
+
+def test_bulk_endpoints():
+    author = client.post("/authors/", json={"name": make_unique_name("BulkAuthor")}).json()
+    genres = [client.post("/genres/", json={"name": make_unique_name("BulkGenre")}).json() for _ in range(2)]
+    title = make_unique_name("BulkBook")
+    response = client.post("/books/bulk", json={"items": [
+        {"title": f"{title} 1", "author_ids": [author["id"]], "genre_ids": [genres[0]["id"]]},
+        {"title": f"{title} 2", "author_ids": [0], "genre_ids": [genres[0]["id"]]},
+        {"title": f"{title} 3", "author_ids": [author["id"]], "genre_ids": []},
+    ]})
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert (result["created"], result["failed"]) == (2, 1)
+    assert [item["status"] for item in result["results"]] == ["created", "error", "created"]
+    book_ids = [result["results"][0]["id"], result["results"][2]["id"]]
+    assert client.get(f"/books/{book_ids[0]}").json()["authors"][0]["id"] == author["id"]
+    search_ids = [book["id"] for book in client.get("/books/search", params={"q": title}).json()["items"]]
+    assert sorted(search_ids) == sorted(book_ids)
+    # Число SQL-запросов пачки не зависит от её размера (бюджет маршрута в app/querybudget.py)
+    many = client.post("/books/bulk", json={"items": [
+        {"title": f"{title} x{index}", "author_ids": [author["id"]], "genre_ids": [genres[0]["id"]]}
+        for index in range(25)]}).json()
+    extra_ids = [item["id"] for item in many["results"]]
+    assert many["created"] == 25 and len(set(extra_ids)) == 25
+    assert client.get(f"/books/{extra_ids[-1]}").json()["title"] == f"{title} x24"
+
+    response = client.post("/books/genres/bulk", json={"items": [
+        {"book_id": book_ids[0], "genre_id": genres[0]["id"]},
+        {"book_id": book_ids[0], "genre_id": genres[1]["id"]},
+        {"book_id": book_ids[1], "genre_id": genres[1]["id"]},
+        {"book_id": book_ids[1], "genre_id": 0},
+    ]})
+    assert [item["status"] for item in response.json()["results"]] == ["exists", "created", "created", "error"]
+    assert len(client.get(f"/books/{book_ids[0]}/genres").json()) == 2
+
+    token, _ = test_register_and_login()
+    headers = {"Authorization": f"Bearer {token}"}
+    items = [{"book_id": book_ids[0], "score": 5}, {"book_id": book_ids[0], "score": 3},
+             {"book_id": book_ids[1], "score": 4}, {"book_id": 0, "score": 1}]
+    assert client.post("/ratings/bulk", json={"items": items}).status_code == 401
+    result = client.post("/ratings/bulk", json={"items": items}, headers=headers).json()
+    assert (result["created"], result["updated"], result["failed"]) == (2, 1, 1)
+    # Повторная оценка той же книги в пачке заменяет предыдущую
+    assert result["results"][1]["id"] == result["results"][0]["id"]
+    db = SessionLocal()
+    try:
+        rating = db.get(models.Rating, result["results"][2]["id"])
+        assert (rating.book_id, rating.score) == (book_ids[1], 4)
+        book_stats = db.get(models.BookRatingStats, book_ids[0])
+        assert (book_stats.ratings_count, book_stats.average_rating) == (1, 3.0)
+        author_stats = db.get(models.AuthorRatingStats, author["id"])
+        assert (author_stats.ratings_count, author_stats.ratings_sum) == (2, 7)
+    finally:
+        db.close()
+
+    assert client.post("/books/bulk", json={"items": []}).status_code == 422
+
+    for book_id in book_ids + extra_ids:
+        client.delete(f"/books/{book_id}")
+    client.delete(f"/authors/{author['id']}")
+    for genre in genres:
+        client.delete(f"/genres/{genre['id']}")
+
+
+def test_conditional_get():
+    author = client.post("/authors/", json={"name": make_unique_name("EtagAuthor")}).json()
+    genre = client.post("/genres/", json={"name": make_unique_name("EtagGenre")}).json()
+    book = client.post("/books/", json={
+        "title": make_unique_name("EtagBook"),
+        "author_ids": [author["id"]],
+        "genre_ids": [genre["id"]],
+    }).json()
+
+    response = client.get(f"/books/{book['id']}")
+    etag, last_modified = response.headers["etag"], response.headers["last-modified"]
+
+    statements = []
+    def count_statement(*args):
+        statements.append(args[2])
+    event.listen(read_engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.get(f"/books/{book['id']}", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+        response = client.get(f"/books/{book['id']}", headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 304
+    finally:
+        event.remove(read_engine, "before_cursor_execute", count_statement)
+    assert statements == []
+
+    # Переименование автора меняет вложенные данные книги
+    client.put(f"/authors/{author['id']}", json={"name": make_unique_name("EtagAuthor")})
+    response = client.get(f"/books/{book['id']}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+    # Замена жанров книги через PUT; затем прежний жанр привязывается заново
+    etag = response.headers["etag"]
+    other_genre = client.post("/genres/", json={"name": make_unique_name("EtagGenre")}).json()
+    response = client.put(f"/books/{book['id']}", json={
+        "title": book["title"],
+        "author_ids": [author["id"]],
+        "genre_ids": [other_genre["id"]],
+    })
+    assert response.status_code == 200
+    assert [g["id"] for g in response.json()["genres"]] == [other_genre["id"]]
+    assert client.get(f"/books/{book['id']}", headers={"If-None-Match": etag}).status_code == 200
+
+    genres_etag = client.get("/genres/").headers["etag"]
+    assert client.get("/genres/", headers={"If-None-Match": genres_etag}).status_code == 304
+    genre_etag = client.get(f"/genres/{genre['id']}").headers["etag"]
+    response = client.post(f"/books/{book['id']}/genres/{genre['id']}")
+    assert {g["id"] for g in response.json()["genres"]} == {genre["id"], other_genre["id"]}
+    client.put(f"/genres/{genre['id']}", json={"name": make_unique_name("EtagGenre")})
+    assert client.get("/genres/", headers={"If-None-Match": genres_etag}).status_code == 200
+    assert client.get(f"/genres/{genre['id']}", headers={"If-None-Match": genre_etag}).status_code == 200
+
+    authors_etag = client.get("/authors/").headers["etag"]
+    assert client.get("/authors/", headers={"If-None-Match": authors_etag}).status_code == 304
+
+    client.delete(f"/books/{book['id']}")
+    client.delete(f"/authors/{author['id']}")
+    client.delete(f"/genres/{genre['id']}")
+    client.delete(f"/genres/{other_genre['id']}")
+    assert client.get("/authors/", headers={"If-None-Match": authors_etag}).status_code == 200
+    # If-None-Match: * не отменяет 404 для удалённых строк
+    for path in (f"/books/{book['id']}", f"/genres/{genre['id']}", f"/authors/{author['id']}"):
+        assert client.get(path, headers={"If-None-Match": "*"}).status_code == 404
+
+
+def test_top_books_by_genre_and_weighted_score():
+    author = client.post("/authors/", json={"name": make_unique_name("TopAuthor")}).json()
+    genre = client.post("/genres/", json={"name": make_unique_name("TopGenre")}).json()
+    books = [client.post("/books/", json={
+        "title": make_unique_name("TopBook"),
+        "author_ids": [author["id"]],
+        "genre_ids": [genre["id"]],
+    }).json() for _ in range(2)]
+    single, popular = books
+
+    db = SessionLocal()
+    try:
+        users = [crud.create_user(db, schemas.UserCreate(username=make_unique_name("topuser"), password="x"),
+                                  hashed_pw="x") for _ in range(6)]
+        user_ids = [user.id for user in users]
+    finally:
+        db.close()
+    for index, user_id in enumerate(user_ids):
+        headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': str(user_id)})}"}
+        items = [{"book_id": popular["id"], "score": 4.5}]
+        if index == 0:
+            items.append({"book_id": single["id"], "score": 5})
+        assert client.post("/ratings/bulk", json={"items": items}, headers=headers).json()["failed"] == 0
+
+    def top(**params):
+        response = client.get("/stats/top-books", params={"genre": genre["name"], "limit": 10, **params})
+        assert response.status_code == 200
+        return [book["id"] for book in response.json()["top_books"]]
+
+    # Одна пятёрка не обгоняет шесть оценок 4.5 во взвешенном рейтинге, но обгоняет в простом среднем
+    assert top() == [popular["id"], single["id"]]
+    assert top(rank="average") == [single["id"], popular["id"]]
+    assert top(min_ratings=2) == [popular["id"]]
+    assert top(genre=make_unique_name("NoSuchGenre")) == []
+
+    # Жанровый лидерборд следует за привязками жанров
+    client.delete(f"/books/{single['id']}/genres/{genre['id']}")
+    assert top() == [popular["id"]]
+    db = SessionLocal()
+    try:
+        row = db.get(models.GenreBookStats, (genre["id"], popular["id"]))
+        assert row.ratings_count == 6
+    finally:
+        db.close()
+
+    for book in books:
+        client.delete(f"/books/{book['id']}")
+    client.delete(f"/authors/{author['id']}")
+    assert client.delete(f"/genres/{genre['id']}").status_code == 200
+
+
+def test_hot_path_query_plans():
+    import check_query_plans
+    assert check_query_plans.find_full_scans() == []
+
+    # Фильтр без индекса под LIMIT — полный просмотр, даже если страница короткая
+    page = "SELECT id FROM books ORDER BY id LIMIT 5"
+    filtered = "SELECT id FROM books WHERE description = ? ORDER BY id LIMIT 5"
+    assert check_query_plans.bounded_scan(page, ["SCAN books"], "SCAN books")
+    assert not check_query_plans.bounded_scan(filtered, ["SCAN books"], "SCAN books")
+    assert check_query_plans.bounded_scan(
+        filtered, ["SCAN books USING INDEX ix_books_title_nocase"], "SCAN books USING INDEX ix_books_title_nocase")
+    assert not check_query_plans.bounded_scan(
+        page, ["SCAN books", "USE TEMP B-TREE FOR ORDER BY"], "SCAN books")
+
+
+def test_metrics_endpoint():
+    book = client.post("/books/", json={"title": make_unique_name("MetricsBook"), "author_ids": [], "genre_ids": []}).json()
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    requests_before = sample("http_requests_total", method="GET", route="/books/{book_id}", status="200")
+    statements_before = sample("db_statements_total", route="/books/{book_id}")
+    client.get(f"/books/{book['id']}")
+    assert sample("http_requests_total", method="GET", route="/books/{book_id}", status="200") == requests_before + 1
+    assert sample("db_statements_total", route="/books/{book_id}") > statements_before
+    assert sample("db_statement_seconds_total", route="/books/{book_id}") > 0
+    assert sample("http_requests_in_flight", method="GET", route="/books/{book_id}") == 0
+
+    client.get("/no-such-path/123")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_bucket{le="0.005",method="GET",route="/books/{book_id}"}' in response.text
+    assert 'route="unmatched"' in response.text
+    assert "no-such-path" not in response.text
+    assert 'db_pool_wait_seconds_count{pool="read"}' in response.text
+    client.delete(f"/books/{book['id']}")
+
+
+@pytest.fixture
+def query_budget():
+    """Бюджет SQL-запросов на блок теста: with query_budget(3): ..."""
+    return querybudget.query_budget
+
+
+def test_every_route_has_query_budget():
+    documentation = {app.openapi_url, app.docs_url, app.docs_url + "/oauth2-redirect", app.redoc_url}
+    routes = {(method, route.path_format) for route in app.routes
+              if route.path_format not in documentation
+              for method in getattr(route, "methods", ()) if method != "HEAD"}
+    assert routes - set(querybudget.ROUTE_BUDGETS) == set()
+
+
+def test_query_budget_reports_lazy_loads(query_budget):
+    author = client.post("/authors/", json={"name": make_unique_name("BudgetAuthor")}).json()
+    book = client.post("/books/", json={"title": make_unique_name("BudgetBook"), "author_ids": [author["id"]], "genre_ids": []}).json()
+
+    db = SessionLocal()
+    try:
+        with query_budget(3) as log:
+            crud.get_book(db, book["id"])
+        assert log.lazy_loads == []
+        db.expunge_all()
+
+        with pytest.raises(querybudget.QueryBudgetExceeded) as excinfo:
+            with query_budget(1):
+                lazy_book = db.get(models.Book, book["id"])
+                assert lazy_book.authors
+        assert "ленивая загрузка Book.authors" in str(excinfo.value)
+        assert "test_main.py" in str(excinfo.value)
+    finally:
+        db.close()
+    client.delete(f"/books/{book['id']}")
+    client.delete(f"/authors/{author['id']}")
+
+
+def test_route_query_budget_is_enforced(monkeypatch):
+    book = client.post("/books/", json={"title": make_unique_name("BudgetBook"), "author_ids": [], "genre_ids": []}).json()
+    monkeypatch.setitem(querybudget.ROUTE_BUDGETS, ("GET", "/books/{book_id}"), 1)
+    # Лишний запрос из ленивой загрузки при сериализации ответа Pydantic оборачивает в ResponseValidationError
+    with pytest.raises((querybudget.QueryBudgetExceeded, ResponseValidationError)) as excinfo:
+        client.get(f"/books/{book['id']}")
+    assert "GET /books/{book_id}: 2 SQL-запросов при бюджете 1" in str(excinfo.value)
+    monkeypatch.undo()
+    assert client.get(f"/books/{book['id']}").status_code == 200
+    client.delete(f"/books/{book['id']}")
+
+
+def test_books_filters_sort_and_facets():
+    prefix = make_unique_name("Facet")
+    authors = [client.post("/authors/", json={"name": make_unique_name("FacetAuthor")}).json() for _ in range(2)]
+    genres = [client.post("/genres/", json={"name": make_unique_name("FacetGenre")}).json() for _ in range(2)]
+
+    def create(title, author, genre_list):
+        return client.post("/books/", json={
+            "title": title, "author_ids": [author["id"]], "genre_ids": [genre["id"] for genre in genre_list],
+        }).json()["id"]
+
+    top = create(f"{prefix} zeta", authors[0], genres[:1])
+    middle = create(f"{prefix.lower()} alpha", authors[0], genres)
+    unrated = create(f"{prefix} beta", authors[1], genres[1:])
+
+    db = SessionLocal()
+    try:
+        user_id = crud.create_user(db, schemas.UserCreate(username=make_unique_name("facetuser"), password="x"),
+                                   hashed_pw="x").id
+    finally:
+        db.close()
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': str(user_id)})}"}
+    items = [{"book_id": top, "score": 5}, {"book_id": middle, "score": 3}]
+    assert client.post("/ratings/bulk", json={"items": items}, headers=headers).json()["failed"] == 0
+
+    def page(**params):
+        response = client.get("/books/", params={"title_prefix": prefix, **params})
+        assert response.status_code == 200
+        return response.json()
+
+    def ids(**params):
+        return [book["id"] for book in page(**params)["items"]]
+
+    assert ids(author_id=authors[0]["id"]) == [top, middle]
+    assert ids(genre_id=genres[1]["id"], min_rating=3) == [middle]
+    assert ids(min_rating=4) == [top]
+    assert ids(title_prefix=prefix.upper()) == [top, middle, unrated]
+    assert ids(title_prefix=prefix + "%") == []
+
+    # Сортировка и keyset-курсор: курсор — ID последней книги страницы
+    first = page(sort="title", limit=2)
+    assert [book["id"] for book in first["items"]] == [middle, unrated]
+    assert ids(sort="title", limit=2, after=first["next_cursor"]) == [top]
+    collected, cursor = [], None
+    while True:
+        result = page(sort="rating", limit=1, **({"after": cursor} if cursor else {}))
+        collected += [book["id"] for book in result["items"]]
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+    assert collected == [top, middle, unrated]
+    # Курсор на удалённую книгу — 400, а не молча пустая страница; книга без оценок — обычный курсор
+    gone = create(f"{prefix} gone", authors[1], genres[1:])
+    client.delete(f"/books/{gone}")
+    for sort in ("title", "rating"):
+        response = client.get("/books/", params={"title_prefix": prefix, "sort": sort, "after": gone})
+        assert response.status_code == 400
+    assert ids(sort="id", after=gone) == []
+    assert ids(sort="rating", after=middle) == [unrated]
+    assert ids(sort="rating", after=unrated) == []
+
+    assert page()["facets"] is None
+    facets = page(facets=True)["facets"]
+    # Равные счётчики — по названию жанра
+    assert [(item["id"], item["count"]) for item in facets["genres"]] == [
+        (genre["id"], 2) for genre in sorted(genres, key=lambda genre: genre["name"])]
+    assert [(item["id"], item["count"]) for item in facets["authors"]] == [(authors[0]["id"], 2), (authors[1]["id"], 1)]
+    assert facets["rating_bands"] == [{"band": 5, "count": 1}, {"band": 3, "count": 1}, {"band": None, "count": 1}]
+    assert page(facets=True, genre_id=genres[0]["id"])["facets"]["authors"] == [
+        {"id": authors[0]["id"], "name": authors[0]["name"], "count": 2}]
+
+    for book_id in (top, middle, unrated):
+        client.delete(f"/books/{book_id}")
+
+
+def _rating_user(prefix: str) -> dict:
+    db = SessionLocal()
+    try:
+        user_id = crud.create_user(db, schemas.UserCreate(username=make_unique_name(prefix), password="x"),
+                                   hashed_pw="x").id
+    finally:
+        db.close()
+    return {"Authorization": f"Bearer {auth.create_access_token({'sub': str(user_id)})}"}
+
+
+def test_similar_books_and_recommendations():
+    genre = client.post("/genres/", json={"name": make_unique_name("SimilarGenre")}).json()
+    author = client.post("/authors/", json={"name": make_unique_name("SimilarAuthor")}).json()
+    a, b, c, d = [client.post("/books/", json={
+        "title": make_unique_name(f"Similar {name}"), "author_ids": [author["id"]], "genre_ids": [genre["id"]],
+    }).json()["id"] for name in "ABCD"]
+
+    def rate(headers, scores):
+        items = [{"book_id": book_id, "score": score} for book_id, score in scores.items()]
+        assert client.post("/ratings/bulk", json={"items": items}, headers=headers).json()["failed"] == 0
+
+    # A и B нравятся одним и тем же читателям, C — остальным
+    users = [_rating_user("similaruser") for _ in range(3)]
+    rate(users[0], {a: 5, b: 5, c: 1})
+    rate(users[1], {a: 5, b: 4, c: 2})
+    rate(users[2], {a: 1, b: 2, c: 5})
+    recommend_build.rebuild(engine)
+
+    similar = client.get(f"/books/{a}/similar").json()
+    assert similar[0]["book"]["id"] == b and similar[0]["score"] > 0
+    assert c not in [item["book"]["id"] for item in similar]
+    assert client.get(f"/books/{d}/similar").json() == []
+    assert client.get("/books/999999999/similar").status_code == 404
+
+    # Новая оценка помечает книгу, refresh пересчитывает её соседей и симметрично — чужие списки
+    rate(users[2], {d: 5})
+    assert recommend_build.refresh(engine)["refreshed"] >= 2
+    assert recommend_build.refresh(engine)["refreshed"] == 0
+    assert c in [item["book"]["id"] for item in client.get(f"/books/{d}/similar").json()]
+    assert d in [item["book"]["id"] for item in client.get(f"/books/{c}/similar").json()]
+    # refresh читает только окрестность D, но список D совпадает с полной сборкой
+    refreshed = client.get(f"/books/{d}/similar").json()
+    recommend_build.rebuild(engine)
+    assert client.get(f"/books/{d}/similar").json() == refreshed
+
+    # Проход refresh делает один воркер: владелец живой аренды
+    lease = make_unique_name("lease")
+    assert recommend.acquire_lease(engine, lease, 60, owner="worker-1")
+    assert recommend.acquire_lease(engine, lease, 60, owner="worker-1")
+    assert not recommend.acquire_lease(engine, lease, 60, owner="worker-2")
+    assert recommend.acquire_lease(engine, lease, -1, owner="worker-1")
+    assert recommend.acquire_lease(engine, lease, 60, owner="worker-2")
+
+    # Пользователю нравится A и не нравится C: рекомендуется B, но не D (сосед C)
+    reader = _rating_user("recommenduser")
+    rate(reader, {a: 5, c: 1})
+    recommendations = client.get("/me/recommendations", headers=reader).json()
+    assert recommendations[0]["book"]["id"] == b
+    assert {a, c, d}.isdisjoint(item["book"]["id"] for item in recommendations)
+
+    # Без оценок — топ книг каталога без оценки сходства
+    fallback = client.get("/me/recommendations", headers=_rating_user("newreader")).json()
+    assert fallback and all(item["score"] is None for item in fallback)
+
+    for book_id in (a, b, c, d):
+        client.delete(f"/books/{book_id}")
+    client.delete(f"/authors/{author['id']}")
+    client.delete(f"/genres/{genre['id']}")
+    db = SessionLocal()
+    try:
+        assert db.get(models.BookNeighbors, a) is None
+    finally:
+        db.close()
+
+
+def test_stats_summary():
+    genre = client.post("/genres/", json={"name": make_unique_name("SummaryGenre")}).json()
+    author = client.post("/authors/", json={"name": make_unique_name("SummaryAuthor")}).json()
+    books = [client.post("/books/", json={
+        "title": make_unique_name("Summary"), "author_ids": [author["id"]], "genre_ids": [genre["id"]],
+    }).json()["id"] for _ in range(3)]
+    headers = _rating_user("summaryuser")
+    items = [{"book_id": book_id, "score": score} for book_id, score in zip(books, (2, 4))]
+    assert client.post("/ratings/bulk", json={"items": items}, headers=headers).json()["failed"] == 0
+
+    summary = client.get("/stats/summary", params={"fresh": True}).json()
+    assert summary["stale"] is False
+    db = SessionLocal()
+    try:
+        ratings_total = db.query(models.Rating).count()
+        books_total = db.query(models.Book).count()
+    finally:
+        db.close()
+    assert summary["ratings"]["count"] == ratings_total
+    per_book = summary["ratings_per_book"]
+    assert per_book["books"] == books_total
+    assert sum(bucket["books"] for bucket in per_book["histogram"]) == books_total
+    assert per_book["histogram"][0] == {"min": 0, "max": 0, "books": books_total - per_book["rated"]}
+    genre_summary = next(item for item in summary["genres"] if item["id"] == genre["id"])
+    assert (genre_summary["books"], genre_summary["ratings"], genre_summary["mean"]) == (3, 2, 3.0)
+    assert (genre_summary["p25"], genre_summary["p50"], genre_summary["p75"]) == (2.5, 3.0, 3.5)
+    assert summary["authors"]["books_per_author"]["max"] >= 3
+
+    # Снимок отдаётся из памяти, пока нет записей; после записи — прежний с пометкой stale
+    assert client.get("/stats/summary").json()["generation"] == summary["generation"]
+    client.post(f"/books/{books[2]}/rate", json={"score": 5}, headers=headers)
+    stale = client.get("/stats/summary").json()
+    assert stale["generation"] == summary["generation"] and stale["stale"] is True
+    fresh = client.get("/stats/summary", params={"fresh": True}).json()
+    assert fresh["ratings"]["count"] == ratings_total + 1 and fresh["generation"] == analytics.write_generation()
+
+    for book_id in books:
+        client.delete(f"/books/{book_id}")
+    client.delete(f"/authors/{author['id']}")
+    client.delete(f"/genres/{genre['id']}")
+
+
+_STARTUP_SCRIPT = """
+import os, sys
+import app.main
+heavy = sorted(name for name in ("pandas", "scipy", "numpy", "passlib") if name in sys.modules)
+assert not heavy, heavy
+from fastapi.testclient import TestClient
+from app.config import Settings
+db_path = os.path.join(sys.argv[1], "app.db")
+application = app.main.create_app(Settings(SECRET_KEY="x", DB_PATH=db_path, RECOMMEND_REFRESH_INTERVAL=0))
+assert not os.path.exists(db_path)
+with TestClient(application) as client:
+    assert client.get("/").status_code == 200
+    assert os.path.exists(db_path)
+"""
+
+
+def test_create_app_is_lazy(tmp_path):
+    """Импорт app.main не читает настройки и не тянет pandas / passlib; БД создаётся в lifespan"""
+    import subprocess
+    import sys
+    env = {key: value for key, value in os.environ.items() if key not in ("SECRET_KEY", "DB_PATH")}
+    result = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT, str(tmp_path)], env=env,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+
+_OTHER_WORKER_SCRIPT = """
+import sys
+from app import crud, database, schemas
+db = database.SessionLocal()
+try:
+    crud.create_rating(db, int(sys.argv[1]), int(sys.argv[2]), schemas.RatingCreate(score=5))
+    crud.update_book(db, int(sys.argv[2]), schemas.BookUpdate(title=sys.argv[3]))
+finally:
+    db.close()
+"""
+
+
+def test_cache_generations_written_in_write_transaction(tmp_path):
+    """Поколения таблиц пишутся в транзакции записи и в БД той сессии, что писала"""
+    from sqlalchemy.orm import Session
+    other = create_engine(f"sqlite:///{tmp_path / 'other.db'}")
+    try:
+        models.Base.metadata.create_all(bind=other)
+        with Session(bind=other) as db:
+            crud.create_genre(db, schemas.GenreCreate(name="Жанр"))
+            db.add(models.Author(name="Автор"))
+            db.rollback()
+            generations = dict(db.query(models.CacheGeneration.name, models.CacheGeneration.generation))
+        assert generations == {"genres": 1}
+    finally:
+        other.dispose()
+
+
+def test_writes_from_other_process_invalidate_caches():
+    """Запись другого процесса (воркера) сбрасывает лидерборды и ETag книги в этом"""
+    import subprocess
+    import sys
+    genre = client.post("/genres/", json={"name": make_unique_name("CoherenceGenre")}).json()
+    author = client.post("/authors/", json={"name": make_unique_name("CoherenceAuthor")}).json()
+    book = client.post("/books/", json={"title": make_unique_name("Coherence"), "author_ids": [author["id"]],
+                                        "genre_ids": [genre["id"]]}).json()
+    db = SessionLocal()
+    try:
+        user_id = crud.create_user(db, schemas.UserCreate(username=make_unique_name("coherence"), password="x"),
+                                   hashed_pw="x").id
+    finally:
+        db.close()
+
+    params = {"genre": genre["name"], "min_ratings": 1}
+    assert client.get("/stats/top-books", params=params).json()["top_books"] == []
+    etag = client.get(f"/books/{book['id']}").headers["etag"]
+
+    env = {**os.environ, "SECRET_KEY": settings.SECRET_KEY, "DB_PATH": settings.DB_PATH}
+    title = make_unique_name("Coherence")
+    result = subprocess.run([sys.executable, "-c", _OTHER_WORKER_SCRIPT, str(user_id), str(book["id"]), title],
+                            env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+    top = client.get("/stats/top-books", params=params).json()["top_books"]
+    assert [item["id"] for item in top] == [book["id"]]
+    response = client.get(f"/books/{book['id']}", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.json()["title"] == title
+
+    client.delete(f"/books/{book['id']}")
+    client.delete(f"/authors/{author['id']}")
+    client.delete(f"/genres/{genre['id']}")
+
+
+_REPLICA_SCRIPT = """
+import os, sqlite3, sys
+from fastapi.testclient import TestClient
+import app.main
+from app.config import Settings
+primary, replica = (os.path.join(sys.argv[1], name) for name in ("primary.db", "replica.db"))
+application = app.main.create_app(Settings(SECRET_KEY="x", DB_PATH=primary, READ_DATABASE_URLS=f"sqlite:///{replica}",
+                                           RECOMMEND_REFRESH_INTERVAL=0))
+def titles(client):
+    return [book["title"] for book in client.get("/books/").json()["items"]]
+
+with TestClient(application) as writer, TestClient(application) as reader:
+    writer.post("/books/", json={"title": "Старая", "author_ids": [], "genre_ids": []})
+    # Реплика — копия основной БД на этот момент
+    with sqlite3.connect(primary) as source, sqlite3.connect(replica) as target:
+        source.backup(target)
+    response = writer.post("/books/", json={"title": "Новая", "author_ids": [], "genre_ids": []})
+    assert "db_primary_until" in response.cookies
+    # Писавший клиент читает свои записи из основной БД, остальные — из реплики
+    assert titles(writer) == ["Старая", "Новая"]
+    assert titles(reader) == ["Старая"]
+    writer.cookies.clear()
+    assert titles(writer) == ["Старая"]
+    # Ответы с ETag всегда читают основную БД
+    assert reader.get(f"/books/{response.json()['id']}").json()["title"] == "Новая"
+    # Пользователь и общий кэш лидербордов — тоже из основной БД, а не с отстающей реплики
+    writer.post("/register", json={"username": "reader", "password": "pw"})
+    token = writer.post("/token", data={"username": "reader", "password": "pw"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    assert reader.get("/me", headers=headers).status_code == 200
+    reader.post(f"/books/{response.json()['id']}/rate", json={"score": 5}, headers=headers)
+    reader.cookies.clear()
+    assert [book["title"] for book in reader.get("/stats/top-books").json()["top_books"]] == ["Новая"]
+"""
+
+
+def test_read_replicas_and_read_your_writes(tmp_path):
+    """GET читают реплику, клиент после записи — основную БД (вторая копия SQLite как реплика)"""
+    import subprocess
+    import sys
+    env = {key: value for key, value in os.environ.items() if key not in ("DB_PATH", "ASYNC_DB")}
+    result = subprocess.run([sys.executable, "-c", _REPLICA_SCRIPT, str(tmp_path)], env=env,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+
+def test_rating_ingest_group_commit(monkeypatch):
+    """Оценки через пакетную запись: одна транзакция на пачку, ответ после commit, агрегаты как при обычной записи"""
+    from app import ingest
+    from app.main import rate_book_batched
+    monkeypatch.setattr(settings, "RATING_INGEST_BATCH_SIZE", 8)
+    monkeypatch.setattr(settings, "RATING_INGEST_MAX_DELAY", 0.05)
+    ingest.stop()
+    ingest_app = FastAPI()
+    ingest_app.add_api_route("/books/{book_id}/rate", rate_book_batched, methods=["POST"],
+                             response_model=schemas.RatingRead)
+
+    author = client.post("/authors/", json={"name": make_unique_name("IngestAuthor")}).json()
+    books = [client.post("/books/", json={"title": make_unique_name("Ingest"), "author_ids": [author["id"]],
+                                          "genre_ids": []}).json()["id"] for _ in range(2)]
+    users = [_rating_user("ingest") for _ in range(6)]
+    batches = []
+    monkeypatch.setattr(crud, "create_ratings_batch",
+                        lambda db, items, original=crud.create_ratings_batch: batches.append(len(items)) or original(db, items))
+    try:
+        with TestClient(ingest_app) as ingest_client:
+            def rate(headers, book_id, score):
+                return ingest_client.post(f"/books/{book_id}/rate", json={"score": score}, headers=headers)
+
+            threads = [threading.Thread(target=rate, args=(headers, book_id, 2))
+                       for headers in users for book_id in books]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # Повторная оценка заменяет прежнюю; несуществующая книга — 404
+            response = rate(users[0], books[0], 5)
+            assert response.status_code == 200
+            assert {key: response.json()[key] for key in ("book_id", "score")} == {"book_id": books[0], "score": 5}
+            assert rate(users[0], 10 ** 9, 5).status_code == 404
+    finally:
+        ingest.stop()
+
+    assert sum(batches) == len(threads) + 2 and len(batches) < len(threads)
+    db = SessionLocal()
+    try:
+        first, second = (db.get(models.BookRatingStats, book_id) for book_id in books)
+        assert (first.ratings_count, first.ratings_sum) == (6, 15)
+        assert (second.ratings_count, second.ratings_sum) == (6, 12)
+        assert db.get(models.AuthorRatingStats, author["id"]).ratings_count == 12
+    finally:
+        db.close()
+    for book_id in books:
+        client.delete(f"/books/{book_id}")
+    client.delete(f"/authors/{author['id']}")
+
+
+def test_admission_control_sheds_writes(monkeypatch):
+    """Admission control: 503 при полной очереди записей и 429 по token bucket, чтение не ограничивается"""
+    import httpx
+    from app import admission
+    monkeypatch.setattr(settings, "ADMISSION_WRITE_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "ADMISSION_QUEUE_DEPTH", 1)
+    monkeypatch.setattr(settings, "ADMISSION_QUEUE_TIMEOUT", 5.0)
+    monkeypatch.setattr(settings, "ADMISSION_WRITE_RATE", 1.0)
+    monkeypatch.setattr(settings, "ADMISSION_WRITE_BURST", 3)
+    controller = admission.AdmissionController.from_settings()
+    token = auth.create_access_token({"sub": "424242"})
+    release = asyncio.Event()
+    shed_app = FastAPI()
+
+    @shed_app.post("/slow")
+    async def slow():
+        await release.wait()
+        return {"ok": True}
+
+    @shed_app.get("/slow")
+    async def read():
+        return {"ok": True}
+
+    shed_app.add_middleware(admission.AdmissionMiddleware, controller=controller)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=shed_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            running = asyncio.create_task(http.post("/slow"))
+            while controller.limits["write"].active < 1:
+                await asyncio.sleep(0.01)
+            queued = asyncio.create_task(http.post("/slow"))
+            while controller.limits["write"].stats()["queued"] < 1:
+                await asyncio.sleep(0.01)
+            # Слот занят, очередь полна: сразу 503, при этом GET отвечает
+            shed = await http.post("/slow")
+            assert shed.status_code == 503 and shed.headers["Retry-After"] == "1"
+            assert (await http.get("/slow")).status_code == 200
+            # Три токена потрачены, четвёртая запись — 429 с временем до следующего токена
+            limited = await http.post("/slow")
+            assert limited.status_code == 429 and limited.headers["Retry-After"] == "1"
+            # Непроверенный токен не даёт нового ведра, пользователь с валидным JWT ограничивается отдельно
+            forged = await http.post("/slow", headers={"Authorization": f"Bearer {uuid.uuid4()}"})
+            assert forged.status_code == 429
+            other = await http.post("/slow", headers={"Authorization": f"Bearer {token}"})
+            assert other.status_code == 503
+            release.set()
+            assert (await running).status_code == 200
+            assert (await queued).status_code == 200
+
+    asyncio.run(scenario())
+    write = controller.stats()["classes"]["write"]
+    assert {key: write[key] for key in ("active", "queued", "admitted", "rejected")} == {
+        "active": 0, "queued": 0, "admitted": 2, "rejected": 2}
+    assert write["rate_limit"]["throttled"] == 2 and write["rate_limit"]["clients"] == 2
+    assert controller.stats()["classes"]["read"]["rate_limit"]["throttled"] == 0
+    assert admission.route_class("POST", "/token") == "auth"
+    # Для /token и /register клиент — IP, даже с валидным токеном
+    scope = {"headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("10.0.0.1", 1234)}
+    assert admission.client_key(scope, "auth") == "ip:10.0.0.1"
+    assert admission.client_key(scope, "write") == "user:424242"
+
+    # Ожидание в очереди дольше таймаута — отказ, слот остаётся у первого запроса
+    limiter = admission.ConcurrencyLimiter("auth", limit=1, queue_depth=4, timeout=0.05)
+
+    async def wait_too_long():
+        assert await limiter.acquire() is None
+        assert await limiter.acquire() == "timeout"
+        limiter.release()
+
+    asyncio.run(wait_too_long())
+    assert {key: limiter.stats()[key] for key in ("active", "queued", "timed_out")} == {
+        "active": 0, "queued": 0, "timed_out": 1}
+    assert REGISTRY.get_sample_value("admission_rejected_total", {"route_class": "write", "reason": "rate"}) >= 1
+    assert client.get("/stats/admission").json() == {"enabled": False}
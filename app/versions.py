@@ -0,0 +1,105 @@
+"""
+Счётчики версий таблиц и строк для условных GET (ETag / Last-Modified / 304).
+Записи в crud увеличивают версию таблицы и затронутых строк после commit;
+эндпоинты сравнивают If-None-Match / If-Modified-Since с версиями до любых запросов к БД.
+
+Счётчики живут в памяти процесса. EPOCH (время запуска) входит в ETag, поэтому
+после перезапуска старые ETag не совпадут, а Last-Modified не бывает раньше запуска.
+Записи других процессов приходят через app/coherence.py без id строк: тогда сдвигаются
+версии таблицы и всех её строк сразу (свои записи coherence публикует в транзакции записи).
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterable, Optional
+
+from fastapi import Request, Response
+
+from app import coherence
+
+EPOCH = format(time.time_ns(), "x")
+_STARTED = time.time()
+
+_lock = threading.Lock()
+# (таблица, id строки или None для всей таблицы) -> (версия, время изменения)
+_versions: dict[tuple[str, Optional[int]], tuple[int, float]] = {}
+# таблица -> (сдвиг версий таблицы и всех строк, время) после записей других процессов
+_remote: dict[str, tuple[int, float]] = {}
+
+
+def bump(table: str, row_ids: Iterable[int] = ()):
+    """Новая версия таблицы и перечисленных строк; вызывается после commit"""
+    now = time.time()
+    with _lock:
+        for key in [(table, None), *((table, row_id) for row_id in row_ids)]:
+            version, _ = _versions.get(key, (0, _STARTED))
+            _versions[key] = (version + 1, now)
+
+
+def bump_remote(tables: Iterable[str]):
+    """Новая версия таблиц и всех их строк: их изменил другой процесс"""
+    now = time.time()
+    with _lock:
+        for table in tables:
+            shift, _ = _remote.get(table, (0, _STARTED))
+            _remote[table] = (shift + 1, now)
+
+
+coherence.subscribe(bump_remote)
+
+
+def current(table: str, row_id: Optional[int] = None) -> tuple[int, float]:
+    """(версия, время изменения) таблицы или строки"""
+    with _lock:
+        version, modified = _versions.get((table, row_id), (0, _STARTED))
+        shift, shifted_at = _remote.get(table, (0, _STARTED))
+    return version + shift, max(modified, shifted_at)
+
+
+@dataclass(frozen=True)
+class Validator:
+    """ETag и Last-Modified ответа, собранные из версий таблиц и строк"""
+
+    etag: str
+    last_modified: float
+
+    def headers(self) -> dict:
+        return {"ETag": self.etag, "Last-Modified": formatdate(self.last_modified, usegmt=True)}
+
+    def is_fresh(self, request: Request) -> bool:
+        """
+        Совпадает ли у клиента закэшированная версия (If-None-Match важнее If-Modified-Since).
+        "*" не учитывается: проверка идёт до запроса к БД, и для несуществующей строки
+        ответом был бы 304 вместо 404
+        """
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return self.etag in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is None:
+            return False
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(self.last_modified) <= since
+
+    def not_modified(self) -> Response:
+        return Response(status_code=304, headers=self.headers())
+
+
+def validator(*parts: tuple[str, Optional[int]]) -> Validator:
+    """Validator для ответа, зависящего от частей (таблица, id строки или None)"""
+    states = [current(table, row_id) for table, row_id in parts]
+    tokens = [f"{table[0]}{'' if row_id is None else row_id}.{version}"
+              for (table, row_id), (version, _) in zip(parts, states)]
+    etag = f'"{EPOCH}-{"-".join(tokens)}"'
+    return Validator(etag=etag, last_modified=max(modified for _, modified in states))
+
+
+def book_validator(book_id: int) -> Validator:
+    """Книга вместе со вложенными авторами и жанрами"""
+    return validator(("books", book_id), ("authors", None), ("genres", None))
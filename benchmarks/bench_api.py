@@ -0,0 +1,298 @@
+"""
+Воспроизводимый HTTP-бенчмарк API каталога.
+
+1. Создаёт изолированную БД (не data/catalog.db): книги из books.csv,
+   синтетические пользователи и оценки в заданном масштабе (10k / 100k / 1m оценок).
+2. Прогоняет ключевые эндпоинты конкурентно внутри процесса (httpx + ASGITransport).
+3. Для каждого эндпоинта считает пропускную способность, p50/p95/p99 задержки
+   и число SQL-запросов на запрос; результат пишет в JSON.
+4. При заданном --baseline сравнивает прогон с эталоном и завершается с кодом 1,
+   если пропускная способность упала или p95 вырос больше порога.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_api --scale 100k --output bench.json
+    python -m benchmarks.bench_api --scale 100k --baseline benchmarks/baseline.json --threshold 15
+    python -m benchmarks.bench_api --scale 100k --save-baseline benchmarks/baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+BENCH_PASSWORD = "benchpass"
+ROUTES = ("books_list", "book_detail", "top_books", "token", "rate")
+
+
+def configure_environment(db_path: str):
+    """Переменные окружения до импорта app: изолированная БД и ключ для JWT"""
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    # Фоновый пересчёт рекомендаций не должен делить CPU с замерами
+    os.environ.setdefault("RECOMMEND_REFRESH_INTERVAL", "0")
+
+
+# --- Подготовка данных ---
+def seed_database(csv_path: str, ratings: int, seed: int) -> dict:
+    """Заполняет пустую БД: книги из CSV, пользователи и ровно `ratings` уникальных оценок"""
+    import numpy as np
+    from sqlalchemy import insert, select
+    from sqlalchemy.orm import Session
+
+    import load_books
+    from app import auth, models, search, stats
+    from app.database import engine
+
+    random.seed(seed)
+    models.Base.metadata.create_all(bind=engine)
+    search.ensure_search_index(engine)
+    # Пользователей ещё нет, поэтому загрузчик не создаёт фейковых оценок
+    load_books.bulk_load_books_from_csv(csv_path, engine)
+
+    with engine.connect() as conn:
+        book_ids = np.array(list(conn.scalars(select(models.Book.id))), dtype=np.int64)
+    n_users = max(50, -(-ratings // 500))
+    if ratings > n_users * len(book_ids):
+        raise SystemExit("Слишком много оценок для числа книг и пользователей")
+
+    hashed = auth.get_password_hash(BENCH_PASSWORD)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User.__table__), [
+            {"username": f"bench{i}", "hashed_password": hashed} for i in range(n_users)
+        ])
+        user_ids = np.array(list(conn.scalars(select(models.User.id).order_by(models.User.id))),
+                            dtype=np.int64)
+
+    rng = np.random.default_rng(seed)
+    pairs = rng.choice(len(user_ids) * len(book_ids), size=ratings, replace=False)
+    users = user_ids[pairs // len(book_ids)]
+    books = book_ids[pairs % len(book_ids)]
+    scores = np.round(rng.uniform(1, 5, size=ratings), 1)
+    batch = 50_000
+    with engine.begin() as conn:
+        for start in range(0, ratings, batch):
+            end = start + batch
+            conn.execute(insert(models.Rating.__table__), [
+                {"user_id": int(u), "book_id": int(b), "score": float(s)}
+                for u, b, s in zip(users[start:end], books[start:end], scores[start:end])
+            ])
+
+    db = Session(bind=engine)
+    try:
+        stats.rebuild_rating_aggregates(db)
+    finally:
+        db.close()
+    return {"books": len(book_ids), "users": n_users, "ratings": ratings}
+
+
+# --- Нагрузка ---
+class QueryCounter:
+    """Считает SQL-запросы на всех движках приложения"""
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+        self.count = 0
+        for bench_engine in engines:
+            event.listen(bench_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Перцентиль по отсортированному списку (линейная интерполяция)"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def build_requests(route: str, book_ids: list, users: list, tokens: list):
+    """Фабрика запросов: по вызову возвращает (method, url, kwargs) для маршрута"""
+    def books_list():
+        after = random.choice(book_ids) if random.random() < 0.8 else None
+        params = {"limit": 50} if after is None else {"limit": 50, "after": after}
+        return "GET", "/books/", {"params": params}
+
+    def book_detail():
+        return "GET", f"/books/{random.choice(book_ids)}", {}
+
+    def top_books():
+        return "GET", "/stats/top-books", {}
+
+    def token():
+        return "POST", "/token", {"data": {"username": random.choice(users), "password": BENCH_PASSWORD}}
+
+    def rate():
+        headers = {"Authorization": f"Bearer {random.choice(tokens)}"}
+        body = {"score": round(random.uniform(1, 5), 1)}
+        return "POST", f"/books/{random.choice(book_ids)}/rate", {"json": body, "headers": headers}
+
+    return locals()[route]
+
+
+async def drive_route(client, make_request, total: int, concurrency: int) -> dict:
+    """Отправляет total запросов с заданной конкурентностью, собирает задержки"""
+    latencies, errors = [], 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, kwargs = make_request()
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(total / elapsed, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def run_benchmark(routes, requests_per_route: int, concurrency: int, warmup: int,
+                        token_requests: int) -> dict:
+    """Прогоняет маршруты по очереди; SQL-запросы считаются на время каждого маршрута"""
+    import httpx
+    from sqlalchemy import select
+
+    from app import auth, models
+    from app.database import engine, read_engine, ReadSessionLocal
+    from app.main import app
+
+    db = ReadSessionLocal()
+    try:
+        book_ids = list(db.scalars(select(models.Book.id)))
+        bench_users = db.execute(select(models.User.id, models.User.username)
+                                 .where(models.User.username.like("bench%"))).all()
+    finally:
+        db.close()
+    users = [username for _, username in bench_users]
+    tokens = [auth.create_access_token({"sub": str(user_id)}) for user_id, _ in bench_users]
+
+    counter = QueryCounter([engine, read_engine])
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport не вызывает lifespan: запуск и остановка приложения — вручную
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for route in routes:
+            make_request = build_requests(route, book_ids, users, tokens)
+            # /token упирается в bcrypt (~0.2 с на хэш), для него отдельное число запросов
+            total = token_requests if route == "token" else requests_per_route
+            if warmup:
+                await drive_route(client, make_request, min(warmup, total), concurrency)
+            before = counter.count
+            result = await drive_route(client, make_request, total, concurrency)
+            result["sql_per_request"] = round((counter.count - before) / total, 2)
+            results[route] = result
+            print(f"{route:12} {result['throughput_rps']:>9.1f} rps  p50 {result['p50_ms']:>8.2f} ms  "
+                  f"p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+                  f"sql/req {result['sql_per_request']:>6.2f}  errors {result['errors']}")
+    return results
+
+
+# --- Сравнение с эталоном ---
+def compare_with_baseline(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Список регрессий: падение rps или рост p95 больше threshold процентов"""
+    regressions = []
+    for route, result in current["routes"].items():
+        base = baseline.get("routes", {}).get(route)
+        if not base:
+            continue
+        if base["throughput_rps"] and result["throughput_rps"] < base["throughput_rps"] * (1 - threshold / 100):
+            regressions.append(f"{route}: throughput {base['throughput_rps']} -> {result['throughput_rps']} rps")
+        if base["p95_ms"] and result["p95_ms"] > base["p95_ms"] * (1 + threshold / 100):
+            regressions.append(f"{route}: p95 {base['p95_ms']} -> {result['p95_ms']} ms")
+        if result["sql_per_request"] > base["sql_per_request"]:
+            regressions.append(f"{route}: sql/req {base['sql_per_request']} -> {result['sql_per_request']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP-бенчмарк API каталога")
+    parser.add_argument("--scale", choices=SCALES, default="10k", help="число оценок в БД")
+    parser.add_argument("--db", help="файл БД; по умолчанию временный, существующий файл переиспользуется")
+    parser.add_argument("--csv", default="books.csv")
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    parser.add_argument("--requests", type=int, default=500, help="запросов на маршрут")
+    parser.add_argument("--token-requests", type=int, default=40, help="запросов к /token")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20, help="прогревочных запросов на маршрут")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    parser.add_argument("--baseline", help="эталонный JSON для проверки регрессий")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимое ухудшение, %%")
+    parser.add_argument("--save-baseline", help="сохранить результат как эталон")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="catalog-bench-"), f"bench-{args.scale}.db")
+    fresh = not os.path.exists(db_path)
+    configure_environment(db_path)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    dataset = None
+    if fresh:
+        started = time.perf_counter()
+        dataset = seed_database(args.csv, SCALES[args.scale], args.seed)
+        print(f"БД {db_path} заполнена за {time.perf_counter() - started:.1f} с: {dataset}")
+
+    random.seed(args.seed)
+    routes = asyncio.run(run_benchmark(args.routes, args.requests, args.concurrency, args.warmup,
+                                      args.token_requests))
+    report = {
+        "meta": {
+            "scale": args.scale,
+            "ratings": SCALES[args.scale],
+            "dataset": dataset,
+            "requests_per_route": args.requests,
+            "token_requests": args.token_requests,
+            "concurrency": args.concurrency,
+            "db_path": db_path,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "routes": routes,
+    }
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны в {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare_with_baseline(report, json.load(file), args.threshold)
+        if regressions:
+            print("Регрессии относительно эталона:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"Регрессий больше {args.threshold}% нет")
+
+
+if __name__ == "__main__":
+    main()
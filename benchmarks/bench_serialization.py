@@ -0,0 +1,96 @@
+"""
+Бенчмарк сериализации списков: CPU на запрос со стандартным ответом
+(ORM -> Pydantic -> json) и с FAST_JSON (строки -> orjson).
+
+Для каждого маршрута прогоняются оба режима на одной и той же изолированной БД,
+время CPU процесса делится на число запросов; результат — таблица и JSON.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_serialization --requests 50 --output serialization.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_api import configure_environment, seed_database
+
+ROUTES = {
+    "books_page_500": ("/books/", {"limit": 500}),
+    "books_page_50": ("/books/", {"limit": 50}),
+    "authors": ("/authors/", {}),
+    "genres": ("/genres/", {}),
+}
+
+
+async def measure(client, url: str, params: dict, requests: int) -> dict:
+    """CPU и wall-время на запрос для одного маршрута"""
+    await client.get(url, params=params)  # прогрев
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    size = 0
+    for _ in range(requests):
+        response = await client.get(url, params=params)
+        response.raise_for_status()
+        size = len(response.content)
+    return {
+        "cpu_ms_per_request": round((time.process_time() - cpu_started) * 1000 / requests, 3),
+        "wall_ms_per_request": round((time.perf_counter() - wall_started) * 1000 / requests, 3),
+        "response_bytes": size,
+    }
+
+
+async def run(requests: int) -> dict:
+    """Оба режима для каждого маршрута"""
+    import httpx
+    from app.config import settings
+    from app.main import app
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, (url, params) in ROUTES.items():
+            modes = {}
+            for fast in (False, True):
+                settings.FAST_JSON = fast
+                modes["fast_json" if fast else "default"] = await measure(client, url, params, requests)
+            settings.FAST_JSON = False
+            default, fast = modes["default"], modes["fast_json"]
+            modes["cpu_reduction_pct"] = round(
+                100 * (1 - fast["cpu_ms_per_request"] / default["cpu_ms_per_request"]), 1)
+            results[name] = modes
+            print(f"{name:15} default {default['cpu_ms_per_request']:>8.2f} ms CPU  "
+                  f"fast_json {fast['cpu_ms_per_request']:>8.2f} ms CPU  "
+                  f"(-{modes['cpu_reduction_pct']}%)  {default['response_bytes']} bytes")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU на запрос: стандартный ответ против FAST_JSON")
+    parser.add_argument("--db", help="файл БД; по умолчанию временный, существующий файл переиспользуется")
+    parser.add_argument("--csv", default="books.csv")
+    parser.add_argument("--ratings", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=50, help="запросов на маршрут и режим")
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="catalog-bench-"), "bench-serialization.db")
+    fresh = not os.path.exists(db_path)
+    configure_environment(db_path)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if fresh:
+        seed_database(args.csv, args.ratings, seed=42)
+
+    results = asyncio.run(run(args.requests))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"requests": args.requests, "routes": results}, file, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Бенчмарк холодного старта приложения.
+
+Каждый замер — отдельный процесс Python (без кэша модулей), в нём по шагам:
+1. import app.main — время импорта модулей;
+2. create_app() — сборка приложения (middleware, маршруты);
+3. lifespan + первый GET / — движки, проверка схемы БД, первый ответ.
+По N процессам считаются медиана и минимум каждого шага и общего времени.
+--importtime печатает самые медленные модули по python -X importtime.
+С --baseline прогон сравнивается с эталоном (код выхода 1, если медиана выросла больше порога).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_startup --runs 10 --output startup.json
+    python -m benchmarks.bench_startup --importtime 15
+    python -m benchmarks.bench_startup --baseline benchmarks/startup.json --threshold 20
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STEPS = ("import", "create_app", "first_request", "total")
+
+# Код одного замера; печатает JSON с длительностями шагов в миллисекундах
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+application = app.main.create_app() if hasattr(app.main, "create_app") else app.main.app
+created = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(application) as client:
+    assert client.get("/").status_code == 200
+    answered = time.perf_counter()
+print(json.dumps({
+    "import": (imported - started) * 1000,
+    "create_app": (created - imported) * 1000,
+    "first_request": (answered - created) * 1000,
+    "total": (answered - started) * 1000,
+    "modules": sorted(name for name in ("numpy", "pandas", "scipy", "passlib") if name in sys.modules),
+}))
+"""
+
+
+def probe_environment(db_path: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("SECRET_KEY", "benchmark-secret")
+    env["DB_PATH"] = db_path
+    env.setdefault("RECOMMEND_REFRESH_INTERVAL", "0")
+    return env
+
+
+def run_probe(env: dict) -> dict:
+    result = subprocess.run([sys.executable, "-c", _PROBE], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_profile(env: dict, top: int) -> list[dict]:
+    """Самые медленные модули (собственное время) по python -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        modules.append({"module": name.strip(), "self_ms": int(self_us) / 1000,
+                        "cumulative_ms": int(cumulative_us) / 1000})
+    return sorted(modules, key=lambda item: -item["self_ms"])[:top]
+
+
+def summarize(samples: list[dict]) -> dict:
+    return {step: {"median_ms": round(statistics.median(sample[step] for sample in samples), 2),
+                   "min_ms": round(min(sample[step] for sample in samples), 2)}
+            for step in STEPS}
+
+
+def compare_with_baseline(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Список регрессий: рост медианы шага больше threshold процентов"""
+    regressions = []
+    for step, result in current["steps"].items():
+        base = baseline.get("steps", {}).get(step)
+        if base and base["median_ms"] and result["median_ms"] > base["median_ms"] * (1 + threshold / 100):
+            regressions.append(f"{step}: median {base['median_ms']} -> {result['median_ms']} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта приложения")
+    parser.add_argument("--runs", type=int, default=7, help="число процессов-замеров")
+    parser.add_argument("--db", help="файл БД; по умолчанию временный (первый замер создаёт схему)")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="показать N самых медленных модулей при импорте")
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    parser.add_argument("--baseline", help="эталонный JSON для проверки регрессий")
+    parser.add_argument("--threshold", type=float, default=20.0, help="допустимое ухудшение, %%")
+    parser.add_argument("--save-baseline", help="сохранить результат как эталон")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="catalog-startup-"), "startup.db")
+    env = probe_environment(db_path)
+    # Прогревочный процесс: создаёт схему БД и .pyc, в замеры не входит
+    run_probe(env)
+    samples = [run_probe(env) for _ in range(args.runs)]
+    steps = summarize(samples)
+    for step, result in steps.items():
+        print(f"{step:14} median {result['median_ms']:>9.2f} ms  min {result['min_ms']:>9.2f} ms")
+    print(f"Тяжёлые модули после старта: {', '.join(samples[-1]['modules']) or 'нет'}")
+
+    report = {
+        "meta": {
+            "runs": args.runs,
+            "db_path": db_path,
+            "heavy_modules": samples[-1]["modules"],
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "steps": steps,
+    }
+    if args.importtime:
+        report["importtime"] = import_profile(env, args.importtime)
+        print("Самые медленные модули (собственное время):")
+        for item in report["importtime"]:
+            print(f"  {item['module']:45} {item['self_ms']:>8.2f} ms  (с вложенными {item['cumulative_ms']:.2f} ms)")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны в {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare_with_baseline(report, json.load(file), args.threshold)
+        if regressions:
+            print("Регрессии относительно эталона:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"Регрессий больше {args.threshold}% нет")
+
+
+if __name__ == "__main__":
+    main()
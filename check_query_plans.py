@@ -0,0 +1,204 @@
+# Проверка планов запросов горячего пути (app/crud.py, app/stats.py)
+#
+# Во временной БД прогоняется сценарий, вызывающий функции crud и stats, которые
+# обслуживают запросы API. Каждый выданный SQL-запрос снимается через before_cursor_execute
+# и проверяется EXPLAIN QUERY PLAN. Ошибка — полный просмотр таблицы (SCAN <таблица>),
+# кроме упорядоченного просмотра с LIMIT без временного B-дерева по индексу (страница по индексу)
+# или по rowid без условий; SCAN <таблица> с фильтром под LIMIT — ошибка (см. bounded_scan).
+#
+# Намеренно не проверяются функции, читающие таблицу целиком: get_all_*, rebuild_*, ensure_*,
+# фасеты get_book_facets, сортировка списка книг по оценке (агрегат / сортировка всей выборки),
+# сборка рекомендаций recommend_build.rebuild / refresh и снимок analytics.get_summary.
+#
+# Запуск: python check_query_plans.py  (код выхода 1, если найден полный просмотр)
+
+import os
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from app import crud, migrations, models, recommend, recommend_build, schemas, search, stats
+
+_SCAN_RE = re.compile(r"^SCAN (\w+)")
+_LIMIT_RE = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+_WHERE_RE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+_INDEX_SCAN_RE = re.compile(r" USING (COVERING )?INDEX ")
+_CHECKED_VERBS = ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")
+
+
+class StatementRecorder:
+    """Запоминает SQL и параметры каждого запроса вместе с шагом сценария"""
+
+    def __init__(self, engine):
+        self.current = None
+        self.statements = {}
+        event.listen(engine, "before_cursor_execute", self._record)
+
+    @contextmanager
+    def step(self, name: str):
+        self.current = name
+        try:
+            yield
+        finally:
+            self.current = None
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if self.current is None or not statement.lstrip().upper().startswith(_CHECKED_VERBS):
+            return
+        # executemany передаёт список наборов; пакетный INSERT (insertmanyvalues) — плоский список
+        if executemany and parameters and isinstance(parameters[0], (tuple, list)):
+            parameters = parameters[0]
+        self.statements.setdefault((self.current, statement), tuple(parameters))
+
+
+def run_workload(db: Session, step):
+    """Сценарий горячего пути: те же вызовы, что делают эндпоинты"""
+    with step("crud.create_user"):
+        user = crud.create_user(db, schemas.UserCreate(username="plan_user", password="x"), hashed_pw="x")
+        user_id = user.id
+    with step("crud.get_user_by_username"):
+        user = crud.get_user_by_username(db, "plan_user")
+    with step("crud.update_password_hash"):
+        crud.update_password_hash(db, user, "y")
+
+    with step("crud.create_genre"):
+        genre_ids = [crud.create_genre(db, schemas.GenreCreate(name=f"Жанр {i}")).id for i in range(3)]
+    with step("crud.get_genre"):
+        crud.get_genre(db, genre_ids[0])
+    with step("crud.update_genre"):
+        crud.update_genre(db, genre_ids[0], schemas.GenreCreate(name="Жанр 0 (новый)"))
+    with step("crud.create_author"):
+        author_ids = [crud.create_author(db, schemas.AuthorCreate(name=f"Автор {i}")).id for i in range(3)]
+    with step("crud.get_author"):
+        crud.get_author(db, author_ids[0])
+    with step("crud.update_author"):
+        crud.update_author(db, author_ids[0], schemas.AuthorCreate(name="Автор 0 (новый)"))
+
+    with step("crud.create_book"):
+        book_ids = [crud.create_book(db, schemas.BookCreate(
+            title=f"Книга {i}", description="Описание",
+            author_ids=author_ids[:2], genre_ids=genre_ids[:2])).id for i in range(3)]
+    with step("crud.create_books_bulk"):
+        result = crud.create_books_bulk(db, [schemas.BookCreate(
+            title=f"Пакетная книга {i}", author_ids=[author_ids[2]], genre_ids=[genre_ids[2]]) for i in range(3)])
+        book_ids += [item["id"] for item in result["results"]]
+    with step("crud.get_book"):
+        book = crud.get_book(db, book_ids[0])
+        assert book.authors and book.genres
+    with step("crud.get_books_page"):
+        crud.get_books_page(db, limit=2)
+        crud.get_books_page(db, limit=2, after=book_ids[1])
+    with step("crud.get_books_page_rows"):
+        crud.get_books_page_rows(db, limit=2, after=book_ids[1])
+    with step("crud.get_books_page (фильтры)"):
+        for filters in (schemas.BookFilter(author_id=author_ids[0]), schemas.BookFilter(genre_id=genre_ids[0]),
+                        schemas.BookFilter(title_prefix="Кни"), schemas.BookFilter(min_rating=3)):
+            crud.get_books_page(db, limit=2, filters=filters)
+        crud.get_books_page(db, limit=2, after=book_ids[1], sort="title")
+    with step("crud.update_book"):
+        crud.update_book(db, book_ids[0], schemas.BookUpdate(
+            title="Книга 0 (новая)", author_ids=[author_ids[1]], genre_ids=[genre_ids[1]]))
+
+    with step("crud.create_rating"):
+        crud.create_rating(db, user_id, book_ids[0], schemas.RatingCreate(score=4))
+        crud.create_rating(db, user_id, book_ids[0], schemas.RatingCreate(score=5))
+    with step("crud.create_ratings_bulk"):
+        crud.create_ratings_bulk(db, user_id, [
+            schemas.RatingBulkItem(book_id=book_id, score=3) for book_id in book_ids[:4]])
+    with step("crud.create_ratings_batch"):
+        other_id = crud.create_user(db, schemas.UserCreate(username="plan_user_2", password="x"), hashed_pw="x").id
+        crud.create_ratings_batch(db, [(user_id, book_ids[1], 4), (other_id, book_ids[1], 2), (other_id, book_ids[2], 5)])
+    with step("crud.get_ratings_for_book"):
+        crud.get_ratings_for_book(db, book_ids[0])
+
+    with step("crud.add_genre_to_book"):
+        crud.add_genre_to_book(db, book_ids[1], genre_ids[2])
+    with step("crud.remove_genre_from_book"):
+        crud.remove_genre_from_book(db, book_ids[1], genre_ids[2])
+    with step("crud.add_genres_to_books_bulk"):
+        crud.add_genres_to_books_bulk(db, [
+            schemas.BookGenreLink(book_id=book_id, genre_id=genre_ids[0]) for book_id in book_ids])
+    with step("crud.get_book_genres"):
+        crud.get_book_genres(db, book_ids[0])
+
+    recommend_build.rebuild(db.get_bind())
+    with step("recommend.get_similar"):
+        recommend.get_similar(db, book_ids[0])
+        recommend.get_similar(db, book_ids[-1])
+    with step("recommend.get_user_recommendations"):
+        recommend.get_user_recommendations(db, user_id)
+        recommend.get_user_recommendations(db, user_id + 1000)  # без оценок: топ книг без оценённых
+
+    with step("stats.get_top_books"):
+        for genre in (None, "Жанр 1"):
+            for rank in stats.TOP_BOOKS_RANKS:
+                stats.get_top_books(db, limit=3, genre=genre, min_ratings=1, rank=rank)
+    with step("stats.get_top_authors"):
+        stats.get_top_authors(db, limit=3)
+    with step("search.search_books"):
+        search.search_books(db, "книга", limit=2)
+
+    with step("crud.delete_book"):
+        crud.delete_book(db, book_ids[-1])
+    with step("crud.delete_author"):
+        crud.delete_author(db, author_ids[2])
+    with step("crud.delete_genre"):
+        crud.delete_genre(db, genre_ids[2])
+
+
+def bounded_scan(statement: str, plan: list[str], line: str) -> bool:
+    """
+    SCAN из строки плана line читает не больше LIMIT строк: под LIMIT без временного B-дерева
+    и по индексу, либо по rowid в запросе без условий (первая страница по id)
+    """
+    if not _LIMIT_RE.search(statement) or any("TEMP B-TREE" in step for step in plan):
+        return False
+    return bool(_INDEX_SCAN_RE.search(line)) or not _WHERE_RE.search(statement)
+
+
+def find_full_scans() -> list[dict]:
+    """Прогоняет сценарий во временной БД; список запросов с полным просмотром таблиц"""
+    tables = set(models.Base.metadata.tables)
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'plans.db')}")
+        try:
+            models.Base.metadata.create_all(bind=engine)
+            migrations.upgrade_schema(engine)
+            search.ensure_search_index(engine)
+            recorder = StatementRecorder(engine)
+            db = Session(bind=engine, autoflush=False)
+            try:
+                run_workload(db, recorder.step)
+            finally:
+                db.close()
+            event.remove(engine, "before_cursor_execute", recorder._record)
+
+            problems = []
+            with engine.connect() as conn:
+                for (step, statement), parameters in recorder.statements.items():
+                    plan = [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+                    for line in plan:
+                        match = _SCAN_RE.match(line)
+                        if match and match.group(1) in tables and not bounded_scan(statement, plan, line):
+                            problems.append({"step": step, "plan": line, "sql": " ".join(statement.split())})
+            return problems
+        finally:
+            engine.dispose()
+
+
+def main():
+    problems = find_full_scans()
+    if not problems:
+        print("Полных просмотров таблиц на горячем пути нет")
+        return
+    for problem in problems:
+        print(f"{problem['step']}: {problem['plan']}\n    {problem['sql'][:300]}")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
 """Загружает книги в БД из books.csv"""
 
+import argparse
+import time
 import pandas as pd
 import random
+from sqlalchemy import insert, select
+from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.orm import Session
-from app.models import Book, Author, Genre, Rating, User
-from app.database import SessionLocal
+from app.models import Book, Author, Genre, Rating, User, book_author_table, book_genre_table
+from app.database import SessionLocal, engine
+from app import stats, search
 
 GENRE_LIST = ["Fantasy", "Science Fiction", "Romance", "Mystery", "Historical", "Thriller", "Non-Fiction"]
 
@@ -103,10 +108,139 @@ def load_books_from_csv(file_path: str, db: Session):
     print(f"Загружено книг: {len(df)}")
 
 
+# --- Пакетная загрузка ---
+def resolve_names(conn: Connection, table, names, cache: dict) -> dict:
+    """
+    Возвращает {имя: id} для авторов/жанров: известные берёт из кэша,
+    остальные ищет одним IN-запросом, недостающие вставляет через executemany
+    """
+    missing = [name for name in dict.fromkeys(names) if name not in cache]
+    if missing:
+        query = select(table.c.name, table.c.id).where(table.c.name.in_(missing))
+        cache.update(conn.execute(query).all())
+        new_names = [name for name in missing if name not in cache]
+        if new_names:
+            conn.execute(insert(table), [{"name": name} for name in new_names])
+            query = select(table.c.name, table.c.id).where(table.c.name.in_(new_names))
+            cache.update(conn.execute(query).all())
+    return {name: cache[name] for name in names}
+
+
+def fake_rating_rows(book_id: int, avg_rating: float, user_ids: list) -> list:
+    """Строки фейковых оценок книги (та же логика, что и в assign_fake_ratings)"""
+    num_ratings = random.randint(3, 10)
+    rows = []
+    for user_id in random.sample(user_ids, min(num_ratings, len(user_ids))):
+        noise = random.uniform(-0.5, 0.5)
+        score = round(min(max(avg_rating + noise, 1), 5), 2)
+        rows.append({"score": score, "user_id": user_id, "book_id": book_id})
+    return rows
+
+
+def bulk_load_books_from_csv(file_path: str, bind: Engine, chunk_size: int = 2000) -> dict:
+    """
+    Быстрая загрузка books.csv: CSV читается чанками, авторы и жанры резолвятся пачкой,
+    книги, связи и оценки вставляются через executemany — одна транзакция на чанк
+    """
+    started = time.perf_counter()
+    author_cache, genre_cache = {}, {}
+    search.ensure_search_index(bind)
+    with bind.begin() as conn:
+        user_ids = list(conn.scalars(select(User.id)))
+        resolve_names(conn, Genre.__table__, GENRE_LIST, genre_cache)
+    if not user_ids:
+        print("Нет пользователей в БД — невозможно создать рейтинги.")
+
+    loaded = skipped = ratings_total = 0
+    columns = ['bookID', 'title', 'authors', 'average_rating']
+    for chunk in pd.read_csv(file_path, usecols=columns, chunksize=chunk_size):
+        chunk = chunk.dropna()
+        chunk = chunk.assign(
+            bookID=pd.to_numeric(chunk['bookID'], errors='coerce'),
+            average_rating=pd.to_numeric(chunk['average_rating'], errors='coerce'),
+        ).dropna().drop_duplicates('bookID')
+
+        with bind.begin() as conn:
+            chunk_ids = [int(book_id) for book_id in chunk['bookID']]
+            existing = set(conn.scalars(select(Book.id).where(Book.id.in_(chunk_ids))))
+            skipped += len(existing)
+
+            books, authors_by_book = [], {}
+            for book_id, title, authors, avg_rating in chunk.itertuples(index=False):
+                book_id = int(book_id)
+                if book_id in existing:
+                    continue
+                books.append({"id": book_id, "title": str(title), "description": "",
+                              "avg_rating": float(avg_rating)})
+                authors_by_book[book_id] = list(dict.fromkeys(
+                    name.strip() for name in str(authors).split('/')))
+            if not books:
+                continue
+
+            author_ids = resolve_names(
+                conn, Author.__table__,
+                [name for names in authors_by_book.values() for name in names], author_cache)
+
+            book_authors, book_genres, ratings = [], [], []
+            for book in books:
+                book_id = book["id"]
+                book_authors.extend({"book_id": book_id, "author_id": author_ids[name]}
+                                    for name in authors_by_book[book_id])
+                book_genres.extend({"book_id": book_id, "genre_id": genre_cache[name]}
+                                   for name in random.sample(GENRE_LIST, k=random.randint(1, 2)))
+                if user_ids:
+                    ratings.extend(fake_rating_rows(book_id, book["avg_rating"], user_ids))
+
+            conn.execute(insert(Book.__table__),
+                         [{key: book[key] for key in ("id", "title", "description")} for book in books])
+            conn.execute(insert(book_author_table), book_authors)
+            conn.execute(insert(book_genre_table), book_genres)
+            if ratings:
+                conn.execute(insert(Rating.__table__), ratings)
+            search.index_books(conn, [book["id"] for book in books])
+
+        loaded += len(books)
+        ratings_total += len(ratings)
+        elapsed = time.perf_counter() - started
+        print(f"Загружено {loaded} книг ({loaded / elapsed:.0f} книг/с)")
+
+    db = Session(bind=bind)
+    try:
+        stats.rebuild_rating_aggregates(db)
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    result = {
+        "books": loaded,
+        "skipped": skipped,
+        "ratings": ratings_total,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(loaded / elapsed, 1) if elapsed else 0.0,
+    }
+    print(f"Загружено книг: {loaded}, оценок: {ratings_total}, пропущено: {skipped} "
+          f"за {elapsed:.2f} с ({result['rows_per_sec']} книг/с)")
+    return result
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Загрузка книг из CSV")
+    parser.add_argument("file", nargs="?", default="books.csv")
+    parser.add_argument("--chunk-size", type=int, default=2000,
+                        help="строк CSV на одну транзакцию в пакетном режиме")
+    parser.add_argument("--row-by-row", action="store_true",
+                        help="старая построчная загрузка через ORM")
+    args = parser.parse_args()
+
+    if not args.row_by_row:
+        bulk_load_books_from_csv(args.file, engine, chunk_size=args.chunk_size)
+        return
+
     db = SessionLocal()
     try:
-        load_books_from_csv('books.csv', db)
+        load_books_from_csv(args.file, db)
+        stats.rebuild_rating_aggregates(db)
+        search.rebuild_search_index(db)
     finally:
         db.close()
 
@@ -0,0 +1,17 @@
+# Полная пересборка похожих книг (book_neighbors) по всем оценкам
+
+import time
+
+from app.database import engine, read_engine
+from app import models, migrations, recommend_build
+
+def main():
+    models.Base.metadata.create_all(bind=engine)
+    migrations.upgrade_schema(engine)
+    print("Пересчёт соседей книг...")
+    started = time.perf_counter()
+    result = recommend_build.rebuild(engine, read_engine)
+    print(f"Готово: книг с соседями — {result['books']} за {time.perf_counter() - started:.1f} с")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+# Пересборка полнотекстового индекса книг (FTS5) для существующей БД
+
+from app.database import SessionLocal, engine
+from app import models, search
+
+def main():
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        print("Пересборка поискового индекса...")
+        count = search.rebuild_search_index(db)
+        print(f"Проиндексировано книг: {count}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+# Пересборка агрегатов рейтингов для существующей БД
+
+from app.database import SessionLocal, engine
+from app import models, stats, migrations
+
+def main():
+    models.Base.metadata.create_all(bind=engine)
+    migrations.upgrade_schema(engine)
+    db = SessionLocal()
+    try:
+        print("Пересчёт агрегатов рейтингов...")
+        result = stats.rebuild_rating_aggregates(db)
+        print(f"Готово: книг — {result['books']}, авторов — {result['authors']}, "
+              f"строк жанровых лидербордов — {result['genre_books']}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,16 @@
 # Сброс БД
 
 from app.database import engine
-from app import models
+from app import models, search
 
 def reset_database():
     print("Удаление всех таблиц...")
+    search.drop_search_index(engine)
     models.Base.metadata.drop_all(bind=engine)
 
     print("Создание всех таблиц...")
     models.Base.metadata.create_all(bind=engine)
+    search.ensure_search_index(engine)
 
     print("База данных успешно сброшена и инициализирована!")
 